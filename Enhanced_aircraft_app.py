@@ -1,34 +1,1465 @@
 import pandas as pd
 from openpyxl import load_workbook
 from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.formula.translate import Translator, TranslatorError
+from openpyxl.formula.tokenizer import Tokenizer, Token, TokenizerError
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.xml.functions import tostring
 import json
 import re
 import os
 import pdfplumber
+from pdfminer.pdftypes import PDFStream, resolve1
 from io import BytesIO
 import tempfile
 import shutil
 import streamlit as st
 import io
+import hashlib
+import zlib
+import random
+import numpy as np
+import logging
+import time
+import functools
+import bisect
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from copy import copy
+import multiprocessing
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
 
-class CompletePlatform:
-    def __init__(self):
-        if 'configurations' not in st.session_state:
-            st.session_state.configurations = {}
-        if 'custom_upgrades' not in st.session_state:
-            st.session_state.custom_upgrades = []
+logger = logging.getLogger(__name__)
+
+# Field extraction patterns, in priority order per field. Everything except
+# year_model is matched case-insensitively (the PDF text is lowercased anyway).
+FIELD_PATTERNS = {
+    "serial_number": [
+        r'serial\s+number[:\s]*([A-Z0-9\-]+)',
+        r'sn[:\s]*([A-Z0-9\-]+)',
+        r's/n[:\s]*([A-Z0-9\-]+)',
+        r'serial[:\s]*([A-Z0-9\-]+)',
+        r'(\d{2,4}[A-Z]*\-?\d{3,4})',
+        r'airframe[:\s]*([A-Z0-9\-]+)',
+        r'aircraft[:\s]*([A-Z0-9\-]+)',
+        r'msn[:\s]*([A-Z0-9\-]+)'
+    ],
+    "year_model": [
+        r'(19|20)\d{2}.*?(lear|citation|phenom|model)'
+    ],
+    # Searched inside the engines section only (see segment_sections)
+    "engine_total_hours": [
+        r'engine\s*time\s*since\s*new[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'engine\s*ttsn[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'engine\s*total\s*time[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'total\s*time[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'(\d{1,2}[,\.]?\d{3})\s*hours?\s*total',
+        r'(\d{1,2}[,\.]?\d{3})\s*total\s*hours?'
+    ],
+    "total_hours": [
+        r'(\d{1,2}[,\.]?\d{3})\s*airframe\s*hours\s*since\s*new',
+        r'airframe\s*hours\s*since\s*new[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'total\s+time\s+since\s+new[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'(\d{1,2}[,\.]?\d{3})\s*hours\s*since\s*new',
+        r'hours\s*since\s*new[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'hours\s*/?\s*new[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'ttsn[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'total\s+hours[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'total\s+time[:\s]*(\d{1,2}[,\.]?\d{3})',  # Added: catches "TOTAL TIME: 7,677"
+        r'total\s+time\s+(\d{1,2}[,\.]?\d{3})',      # Added: catches "TOTAL TIME 7,677"
+        r'tt[:\s]*(\d{1,2}[,\.]?\d{3})',             # Added: catches "TT: 7,677"
+        r'airframe\s+total[:\s]*(\d{1,2}[,\.]?\d{3})', # Added: catches "AIRFRAME TOTAL: 7,677"
+        r'aftt[:\s]*(\d{1,2}[,\.]?\d{3})'            # Added: catches "AFTT: 7,677"
+    ],
+    "engine_overhaul": [
+        r'engine\s*time\s*since\s*overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'engine\s*tsoh[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'hours?\s*since\s*overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'time\s*since\s*overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'overhaul\s*hours?[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'tsoh[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'since\s*overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'(\d{1,2}[,\.]?\d{3})\s*hours?\s*since\s*overhaul',
+        r'(\d{1,2}[,\.]?\d{3})\s*tsoh',
+        r'(\d{1,2}[,\.]?\d{3})\s*since\s*overhaul',
+        r'overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
+        r'soh[:\s]*(\d{1,2}[,\.]?\d{3})'  # Sometimes abbreviated as SOH
+    ],
+    "engine_program": [
+        r'engines?\s*(?:are\s*)?enrolled\s*in\s*([A-Za-z\s\-&]+?)(?:\s*full|\s*engine|\s*program|\.|\n|$)',
+        r'both\s*engines?\s*(?:are\s*)?enrolled\s*in\s*([A-Za-z\s\-&]+?)(?:\s*full|\s*engine|\s*program|\.|\n|$)',
+        r'engines?\s*(?:are\s*)?(?:on|under)\s*([A-Za-z\s\-&]+?)\s*(?:program|warranty|plan|coverage)',
+        r'([A-Za-z\s\-&]+?)\s*full\s*engine\s*program',
+        r'engines?\s*program[:\s]*([A-Za-z\s\-&]+?)(?:\n|$|\.)',
+        r'engines?\s*warranty[:\s]*([A-Za-z\s\-&]+?)(?:\n|$|\.)',
+        r'engines?\s*-\s*([A-Za-z\s\-&]+?)(?:\n|$|\.)',
+        r'engine\s*maintenance[:\s]*([A-Za-z\s\-&]+?)(?:\n|$|\.)',
+        r'program[:\s]*([A-Za-z\s\-&]+?)(?:\s*\d+%|\s|$|\n)',  # Added: catches "Program: JSSI 100%"
+        r'engine\s*&\s*apu\s*status[^\n]*program[:\s]*([A-Za-z\s\-&]+?)(?:\s*\d+%|\s|$|\n)',  # Added: catches under ENGINE & APU STATUS
+        r'engine\s*status[^\n]*program[:\s]*([A-Za-z\s\-&]+?)(?:\s|$|\n)',  # Added: catches under ENGINE STATUS
+        r'maintenance\s*program[:\s]*([A-Za-z\s\-&]+?)(?:\s|$|\n)'  # Added: general maintenance program
+    ],
+    "number_of_seats": [
+        r'(\d+)\s*passenger\s*seat(?:ing|s)?',
+        r'number\s*of\s*seats[:\s]*(\d+)',
+        r'seats[:\s]*(\d+)',
+        r'(\d+)\s*seat(?:s)?\s*(?:configuration|config)',
+        r'seating\s*for\s*(\d+)',
+        r'(\d+)\s*pax'
+    ],
+    "seat_configuration": [
+        r'(?:seat(?:ing)?\s*)?config(?:uration)?[:\s]*([^\n]+)',
+        r'cabin\s*config(?:uration)?[:\s]*([^\n]+)',
+        r'interior\s*(?:features|has|with)[:\s]*([^\n]*(?:club|divan|forward facing|aft facing)[^\n]*)',
+        r'(\d+\s*place\s*(?:club|divan)|forward\s*facing|aft\s*facing|center\s*club|double\s*club)[^\n]*'
+    ],
+    "paint_exterior_year": [
+        r'paint(?:ed)?\s*(?:in\s*)?(\d{4})',
+        r'exterior\s*paint(?:ed)?\s*(?:in\s*)?(\d{4})',
+        r'(\d{4})\s*(?:exterior\s*)?paint',
+        r'paint\s*completed[:\s]*(\d{4})',
+        r'new\s*paint[:\s]*(\d{4})',
+        r'paint\s*exterior[:\s]*(\d{4})',  # Added: catches "Paint Exterior: 2023"
+        r'exterior[:\s]*(\d{4})',          # Added: catches "Exterior: 2023"
+        r'paint[^\n]*(\d{4})',            # Added: catches any paint mention with year
+        r'exterior[^\n]*paint[^\n]*(\d{4})', # Added: catches "Exterior... Paint... 2023"
+        r'paint[^\n]*exterior[^\n]*(\d{4})'  # Added: catches "Paint... Exterior... 2023"
+    ],
+    "interior_year": [
+        r'interior\s*(?:refurb(?:ished)?|completed|done|new)\s*(?:in\s*)?(\d{4})',
+        r'(\d{4})\s*interior\s*(?:refurb|refresh|update)',
+        r'new\s*interior[:\s]*(\d{4})',
+        r'interior\s*year[:\s]*(\d{4})',
+        r'refurb(?:ished)?\s*in\s*(\d{4})',
+        r'interior\s*paint[:\s]*(\d{4})',      # Added: catches "Interior Paint: 2023"
+        r'paint\s*interior[:\s]*(\d{4})',      # Added: catches "Paint Interior: 2023"
+        r'interior[:\s]*(\d{4})',              # Added: catches "Interior: 2023"
+        r'interior[^\n]*(\d{4})',             # Added: catches any interior mention with year
+        r'cabin\s*(?:refurb|refresh|update)[:\s]*(\d{4})', # Added: catches cabin updates
+        r'cabin[^\n]*(\d{4})'                 # Added: catches cabin with year
+    ]
+}
+
+CASE_SENSITIVE_FIELDS = {"year_model"}
+
+# Abbreviation/synonym groups for upgrade keywords; models add their own under "keyword_synonyms"
+KEYWORD_SYNONYMS_FILE = os.environ.get(
+    "KEYWORD_SYNONYMS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyword_synonyms.json")
+)
+VARIATION_CACHE_SIZE = 4096  # memoized keywords per synonym table
+
+# Aircraft model identification (see ModelIndex)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+MODEL_STOPWORDS = {"master", "for", "sale"}
+MODEL_MATCH_THRESHOLD = 0.6  # fraction of a model's name tokens the PDF must contain
+
+# Section headings recognised by segment_sections -> section name
+SECTION_HEADINGS = {
+    'engines': 'engines',
+    'engine': 'engines',
+    'powerplant': 'engines',
+    'powerplants': 'engines',
+    'apu': 'apu',
+    'auxiliary power unit': 'apu',
+    'avionics': 'avionics',
+    'interior': 'interior',
+    'cabin': 'interior',
+    'exterior': 'exterior',
+    'paint': 'exterior',
+    'inspections': 'inspections',
+    'inspection': 'inspections',
+    'maintenance': 'inspections',
+    'inspection status': 'inspections',
+    'airframe': 'airframe',
+    'additional equipment': 'equipment',
+    'equipment': 'equipment',
+}
+
+# Engine program names as found in broker PDFs -> the abbreviation written to the sheet
+ENGINE_PROGRAM_MAPPING = {
+    'jssi': 'JSSI',
+    'power advantage': 'PWR ADV',
+    'poweradvantage': 'PWR ADV',
+    'esp gold lite': 'ESP GOLD LITE',
+    'esp gold': 'ESP GOLD',
+    'esp': 'ESP',
+    'msp': 'MSP',
+    'csp': 'CSP',
+    'tap': 'TAP',
+    'tap blue': 'TAP BLUE',
+    'smart parts': 'SMART PARTS'
+}
+
+# Bump when extract_text_from_pdf output changes so stale cached text is never served
+EXTRACTOR_VERSION = f"pdfplumber-{pdfplumber.__version__}-1"
+PDF_TEXT_BACKEND = os.environ.get("PDF_TEXT_BACKEND", "pdfplumber")  # "pdfplumber", "pdftotext" or "auto"
+TEXT_CACHE_DIR = os.environ.get("PDF_TEXT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "aircraft_pdf_text_cache"))
+TEXT_CACHE_MAX_BYTES = int(os.environ.get("PDF_TEXT_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Near-duplicate PDF detection (see NearDuplicateIndex)
+NEAR_DUPLICATE_INDEX_PATH = os.environ.get(
+    "NEAR_DUPLICATE_INDEX", os.path.join(tempfile.gettempdir(), "aircraft_pdf_signatures.jsonl")
+)
+NEAR_DUPLICATE_THRESHOLD = 0.85  # estimated Jaccard similarity of word shingles
+NEAR_DUPLICATE_MAX_RECORDS = 2000
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 4 signature rows per band: candidates from roughly 50% similarity up
+SHINGLE_SIZE = 4  # words per shingle
+# Processing ledger (see ProcessingLedger)
+PROCESSING_LEDGER_PATH = os.environ.get(
+    "PROCESSING_LEDGER", os.path.join(tempfile.gettempdir(), "aircraft_processing_ledger.jsonl")
+)
+PROCESSING_LEDGER_MAX_ENTRIES = 5000
+JOURNAL_MIN_COMPACT_LINES = 64  # never compact a journal (see JsonJournal) shorter than this
+FORMULA_CACHE_SIZE = 8192  # memoized (formula, column shift) translations
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", "1"))
+# Hardened field matching: each pattern runs only in windows around its required keyword
+# (or in chunks when it has none) and gives up once its time budget is spent
+SCAN_WINDOW = 500  # characters searched on each side of a keyword
+SCAN_CHUNK = 8000  # longest range handed to the regex engine in one search
+PATTERN_TIME_BUDGET = float(os.environ.get("PATTERN_TIME_BUDGET_MS", "100")) / 1000
+PARALLEL_MIN_PAGES = 8  # below this, handing pages to the (already running) worker pool costs more than it saves
+PAGE_WINDOW = int(os.environ.get("PDF_PAGE_WINDOW", "16"))  # pages read per open of the document
+
+
+def required_literals(pattern):
+    """Return the plain-text runs that every match of `pattern` must contain.
+    
+    Only text outside groups, character classes and escapes counts, and a
+    top-level alternation means nothing is required.
+    """
+    runs = []
+    current = ""
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\":
+            runs.append(current)
+            current = ""
+            i += 2
+            continue
+        if ch == "[":
+            runs.append(current)
+            current = ""
+            i += 2 if pattern[i + 1:i + 2] == "]" else 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+        elif ch == "|" and depth == 0:
+            return []
+        elif ch in "?*{":
+            # The quantified character may repeat or vanish (e.g. 'engines?')
+            runs.append(current[:-1])
+            current = ""
+            if ch == "{" and "}" in pattern[i:]:
+                i = pattern.index("}", i)
+        elif depth == 0 and (ch.isalnum() or ch in "/&"):
+            current += ch
+        else:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            runs.append(current)
+            current = ""
+        i += 1
+    runs.append(current)
+    return sorted({run.lower() for run in runs if len(run) >= 2}, key=len, reverse=True)
+
+
+class FieldScan:
+    """Result of one CompiledFieldScanner pass over a piece of text.
+    
+    Fields are resolved lazily, pattern by pattern in priority order, so
+    callers that stop at the first acceptable match never pay for the
+    lower-priority patterns.
+    """
+    
+    def __init__(self, scanner, text, pos, endpos, present, hardened=False, fields=None):
+        self.scanner = scanner
+        self.fields = fields
+        self.text = text
+        self.pos = pos
+        self.endpos = endpos
+        self.present = present
+        self.hardened = hardened
+        self.anchors = {}
+        self.slow_patterns = []  # (field, pattern, seconds) for patterns that ran out of budget
+    
+    def _candidates(self, field):
+        if self.fields is not None and field not in self.fields:
+            return
+        for priority, (compiled, literals) in enumerate(self.scanner.patterns.get(field, [])):
+            if all(literal in self.present for literal in literals):
+                yield priority, compiled, literals
+    
+    def _ranges(self, literals):
+        """The (start, end) ranges a pattern is searched in.
+        
+        Unhardened, that is the whole scan. Hardened, it is a window of
+        SCAN_WINDOW characters around each occurrence of the pattern's
+        longest keyword, or fixed chunks for patterns without one, widened
+        to whole lines. Ranges are merged up to SCAN_CHUNK characters.
+        """
+        if not self.hardened:
+            yield self.pos, self.endpos
+            return
+        if not literals:
+            for start in range(self.pos, self.endpos, SCAN_CHUNK):
+                yield self._line_start(start), self._line_end(min(start + SCAN_CHUNK + SCAN_WINDOW, self.endpos))
+            return
+        
+        anchor = literals[0]
+        if anchor not in self.anchors:
+            anchor_pattern = re.compile(re.escape(anchor), re.IGNORECASE)
+            self.anchors[anchor] = [m.start() for m in anchor_pattern.finditer(self.text, self.pos, self.endpos)]
+        current = None
+        for position in self.anchors[anchor]:
+            start = self._line_start(max(self.pos, position - SCAN_WINDOW))
+            end = self._line_end(min(self.endpos, position + len(anchor) + SCAN_WINDOW))
+            if current and start <= current[1] and end - current[0] <= SCAN_CHUNK:
+                current = (current[0], end)
+                continue
+            if current:
+                yield current
+            current = (start, end)
+        if current:
+            yield current
+    
+    def _line_start(self, position):
+        """Start of the line holding `position`, not before the scan."""
+        return max(self.pos, self.text.rfind("\n", self.pos, position) + 1)
     
-    def extract_text_from_pdf(self, pdf_file):
+    def _line_end(self, position):
+        """End of the line holding `position`, past its newline, not after the scan."""
+        newline = self.text.find("\n", position, self.endpos)
+        return self.endpos if newline < 0 else newline + 1
+    
+    def _extend(self, compiled, match, end):
+        """Re-match `match`, a line further at a time, while it runs into the end of its range."""
+        while match.end() == end < self.endpos:
+            end = self._line_end(end)
+            match = compiled.match(self.text, match.start(), end) or match
+        return match
+    
+    def _finditer(self, field, compiled, literals, first_only):
+        """Matches of one pattern in document order, within its ranges and time budget.
+        
+        A match that reaches the end of its range may have been cut short
+        there, so it is matched again past the range (see _extend).
+        """
+        started = time.perf_counter()
+        last_end = -1
+        for start, end in self._ranges(literals):
+            matches = [compiled.search(self.text, start, end)] if first_only else compiled.finditer(self.text, start, end)
+            for match in matches:
+                if match and self.hardened:
+                    match = self._extend(compiled, match, end)
+                if match and match.start() >= last_end:
+                    last_end = match.end() if match.end() > match.start() else match.end() + 1
+                    yield match
+                    if first_only:
+                        return
+            elapsed = time.perf_counter() - started
+            if self.hardened and elapsed > PATTERN_TIME_BUDGET:
+                self.slow_patterns.append((field, compiled.pattern, elapsed))
+                logger.warning("Pattern for %s exceeded its %.0f ms budget (%.0f ms): %s",
+                               field, PATTERN_TIME_BUDGET * 1000, elapsed * 1000, compiled.pattern)
+                return
+    
+    def search(self, field):
+        """Yield (priority, match) with the first match of each pattern of `field` that matches."""
+        for priority, compiled, literals in self._candidates(field):
+            match = next(self._finditer(field, compiled, literals, first_only=True), None)
+            if match:
+                yield priority, match
+    
+    def findall(self, field):
+        """Yield (priority, values) as re.findall would for each pattern of `field` that matches."""
+        for priority, compiled, literals in self._candidates(field):
+            values = [findall_value(match) for match in self._finditer(field, compiled, literals, first_only=False)]
+            if values:
+                yield priority, values
+
+
+def findall_value(match):
+    """What re.findall reports for `match`: the whole match, the only group, or all groups."""
+    groups = match.groups()
+    if not groups:
+        return match.group(0)
+    return groups[0] if len(groups) == 1 else groups
+
+
+class CompiledFieldScanner:
+    """All field patterns of a configuration, compiled once.
+    
+    Every pattern is paired with the keywords any match must contain. A
+    scan folds the text once and records which keywords occur, and patterns
+    missing one of their keywords are never run. Precedence within each
+    field is the pattern order in `field_patterns`.
+    """
+    
+    def __init__(self, field_patterns):
+        self.patterns = {}
+        self.literals = set()
+        for field, patterns in field_patterns.items():
+            flags = 0 if field in CASE_SENSITIVE_FIELDS else re.IGNORECASE
+            compiled_patterns = []
+            for pattern in patterns:
+                literals = required_literals(pattern)
+                compiled_patterns.append((re.compile(pattern, flags), literals))
+                self.literals.update(literals)
+            self.patterns[field] = compiled_patterns
+    
+    def scan(self, text, pos=0, endpos=None, hardened=False, fields=None):
+        """Scan text[pos:endpos]; with `fields`, every other field is treated as absent."""
+        if endpos is None:
+            endpos = len(text)
+        literals = self.literals
+        if fields is not None:
+            literals = {literal for field in fields for _, pattern_literals in self.patterns.get(field, []) for literal in pattern_literals}
+        # casefold() covers every IGNORECASE equivalent of an ASCII letter except the dotless i
+        folded = text[pos:endpos].casefold().replace("ı", "i")
+        present = {literal for literal in literals if literal in folded}
+        return FieldScan(self, text, pos, endpos, present, hardened, fields)
+
+
+LIGATURES = {"ﬀ": "ff", "ﬁ": "fi", "ﬂ": "fl", "ﬃ": "ffi", "ﬄ": "ffl", "ﬅ": "st", "ﬆ": "st"}
+# Whitespace, dots, soft hyphens and ASCII/unicode hyphens and dashes: ignored by canonical matching
+SEPARATOR_PATTERN = re.compile(r"[\s.\-\u00ad\u2010-\u2015\u2212\ufe58\ufe63\uff0d]+")
+CANONICAL_PATTERN = re.compile(SEPARATOR_PATTERN.pattern + "|[" + "".join(LIGATURES) + "]")
+# A word hyphenated across a line break: "auxil-\niary"
+LINE_BREAK_HYPHEN_PATTERN = re.compile(r"[\-\u00ad][ \t]*\n")
+
+
+def fold(text):
+    """`text` with separators removed and ligatures expanded."""
+    return CANONICAL_PATTERN.sub(lambda match: LIGATURES.get(match.group(), ""), text)
+
+
+class CanonicalText:
+    """Text with separators folded away and ligatures expanded, mapped back to the original.
+    
+    "uns-1espw", "uns 1espw", "uns1espw", "uns‑1e spw" and "uns-\n1espw" (a
+    word hyphenated across a line break) all become "uns1espw", so a single
+    lookup of the canonical keyword replaces a scan per spelling variant.
+    The text is expected to be lowercased already.
+    """
+    
+    def __init__(self, text):
+        self.original_text = text
+        if any(ligature in text for ligature in LIGATURES):
+            self.text = fold(text)
+        else:
+            self.text = SEPARATOR_PATTERN.sub("", text)
+        # Offset map, extended only as far as original() is asked to look
+        self.canonical_starts = []  # canonical offset of each piece
+        self.original_starts = []   # original offset of each piece
+        self.verbatim = []          # False for expanded ligatures
+        self.mapped_length = 0      # canonical characters covered so far
+        self.position = 0           # original offset reached so far
+        self.separators = CANONICAL_PATTERN.finditer(text)
+    
+    def extend_offset_map(self, index):
+        """Record verbatim runs and expanded ligatures until canonical `index` is covered."""
+        for match in self.separators:
+            if match.start() > self.position:
+                self.add_piece(self.position, True, match.start() - self.position)
+            ligature = LIGATURES.get(match.group())
+            if ligature:
+                self.add_piece(match.start(), False, len(ligature))
+            self.position = match.end()
+            if self.mapped_length > index:
+                return
+        if self.position < len(self.original_text):
+            self.add_piece(self.position, True, len(self.original_text) - self.position)
+            self.position = len(self.original_text)
+    
+    def add_piece(self, original_start, verbatim, length):
+        self.canonical_starts.append(self.mapped_length)
+        self.original_starts.append(original_start)
+        self.verbatim.append(verbatim)
+        self.mapped_length += length
+    
+    def original(self, index):
+        """Offset in the original text of the character at canonical `index`."""
+        if index >= self.mapped_length:
+            self.extend_offset_map(index)
+        piece = bisect.bisect_right(self.canonical_starts, index) - 1
+        if self.verbatim[piece]:
+            return self.original_starts[piece] + index - self.canonical_starts[piece]
+        return self.original_starts[piece]
+    
+    def original_span(self, start, end):
+        """(start, end) in the original text of the canonical range [start, end)."""
+        return self.original(start), self.original(end - 1) + 1
+    
+    def separators_within(self, start, end):
+        """Offsets, relative to `start`, at which canonical [start, end) crosses a folded separator.
+        
+        Line-break hyphenation is not reported: "auxil-\niary" reads as one word.
+        """
+        original_start, original_end = self.original_span(start, end)
+        offsets = set()
+        for separator in SEPARATOR_PATTERN.finditer(self.original_text, original_start, original_end):
+            if not LINE_BREAK_HYPHEN_PATTERN.match(separator.group()):
+                offsets.add(len(fold(self.original_text[original_start:separator.start()])))
+        return offsets
+
+
+@functools.lru_cache(maxsize=16)
+def canonicalize(text):
+    """CanonicalText for `text`, cached so each document is canonicalized once."""
+    return CanonicalText(text)
+
+
+def canonical_keyword(keyword):
+    """A keyword in the same canonical form as CanonicalText.text."""
+    return fold(keyword.lower())
+
+
+def separator_offsets(keyword):
+    """Canonical offsets at which `keyword` has a separator ("heated window" -> {6})."""
+    keyword = keyword.lower()
+    return {len(fold(keyword[:separator.start()])) for separator in SEPARATOR_PATTERN.finditer(keyword)}
+
+
+class UpgradeMatcher:
+    """Finds every configured upgrade keyword (variations included) in one pass.
+    
+    Keywords and text are both canonicalized (see CanonicalText), so variations
+    that differ only in hyphens, spaces or dots collapse into one keyword.
+    A hit is a plain substring of the canonical text, like the `keyword in
+    pdf_text` test it replaces, except that the text may only have a
+    separator where one of the keyword's spellings has one: "auto throttle"
+    is found in "auto-throttles", but "apu" is not found in "a pu unit".
+    The keywords are folded into a trie and compiled into a single regex
+    shaped like that trie, so the regex engine walks the text once, the way
+    an Aho-Corasick automaton would, without re-testing each keyword. The
+    trie sits in a zero-width lookahead so keywords that overlap or contain
+    one another are all reported.
+    """
+    
+    def __init__(self, upgrades, generate_variations):
+        self.upgrade_names = list(upgrades)
+        self.owners = {}
+        self.spellings = {}  # canonical keyword -> the first variation it came from, for display
+        self.separators = {}  # canonical keyword -> offsets where a spelling has a separator
+        for upgrade_name, upgrade_config in upgrades.items():
+            for keyword in upgrade_config.get("keywords", []):
+                for variation in generate_variations(keyword):
+                    canonical = canonical_keyword(variation)
+                    if canonical:
+                        self.separators.setdefault(canonical, set()).update(separator_offsets(variation))
+                    if canonical and upgrade_name not in self.owners.setdefault(canonical, []):
+                        self.owners[canonical].append(upgrade_name)
+                        self.spellings.setdefault(canonical, variation)
+        
+        trie = {}
+        for keyword in self.owners:
+            node = trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node[""] = keyword
+        
+        # The regex reports the longest keyword at each offset; every shorter
+        # keyword that is a prefix of it matches at the same offset.
+        self.prefixes = {}
+        for keyword in self.owners:
+            node = trie
+            found = []
+            for ch in keyword:
+                node = node[ch]
+                if "" in node:
+                    found.append(node[""])
+            self.prefixes[keyword] = found
+        
+        self.regex = re.compile("(?=(" + self.trie_pattern(trie) + "))") if trie else None
+    
+    @staticmethod
+    def trie_pattern(node):
+        branches = [re.escape(ch) + UpgradeMatcher.trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A keyword ends here, longer ones are tried first
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+    
+    def find(self, text):
+        """Return {upgrade_name: (keyword, offset)} for the first hit of each upgrade found in `text`.
+        
+        Offsets are positions in `text` itself, not in its canonical form.
+        """
+        hits = {}
+        if not self.regex:
+            return hits
+        canonical = canonicalize(text)
+        for match in self.regex.finditer(canonical.text):
+            for keyword in self.prefixes[match.group(1)]:
+                if all(upgrade_name in hits for upgrade_name in self.owners[keyword]):
+                    continue
+                if not canonical.separators_within(match.start(), match.start() + len(keyword)) <= self.separators[keyword]:
+                    continue
+                for upgrade_name in self.owners[keyword]:
+                    if upgrade_name not in hits:
+                        hits[upgrade_name] = (self.spellings[keyword], canonical.original(match.start()))
+            if len(hits) == len(self.upgrade_names):
+                break
+        return hits
+
+
+# A heading starts a line and is followed by a separator or the end of the line:
+# "engines", "engines: 2x pw545a" and "engines - esp gold" are headings, "engine & apu status" is not
+SECTION_HEADING_PATTERN = re.compile(
+    r'^[ \t]*(' + '|'.join(sorted(map(re.escape, SECTION_HEADINGS), key=len, reverse=True)) + r')[ \t]*(?:[:\-–—]|$)',
+    re.MULTILINE
+)
+BLANK_LINE_PATTERN = re.compile(r'\n[ \t]*\n')
+LEADING_SPACE_PATTERN = re.compile(r'[\s:\-–—]*')
+
+
+class SectionIndex:
+    """Character ranges of the headed sections of one document's text."""
+    
+    def __init__(self, ranges):
+        self.ranges = ranges  # {section name: [(start, end), ...]} in document order
+    
+    def first(self, name):
+        """The first non-empty range of a section, or None."""
+        return next(((start, end) for start, end in self.ranges.get(name, []) if end > start), None)
+
+
+@functools.lru_cache(maxsize=16)
+def segment_sections(text):
+    """Split PDF text into sections in one pass over its headings.
+    
+    A section's body runs from after its heading to the next heading or
+    blank line. Cached on the text, so every extractor looking at the same
+    document shares one segmentation.
+    """
+    headings = list(SECTION_HEADING_PATTERN.finditer(text))
+    ranges = {}
+    for i, heading in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        start = min(LEADING_SPACE_PATTERN.match(text, heading.end()).end(), end)
+        blank_line = BLANK_LINE_PATTERN.search(text, start, end)
+        if blank_line:
+            end = blank_line.start()
+        ranges.setdefault(SECTION_HEADINGS[heading.group(1)], []).append((start, end))
+    return SectionIndex(ranges)
+
+
+# Operand-closing ")", "]" or ">" followed by Tj, TJ, ' or " - the only operators that paint text
+TEXT_SHOWING_OPERATOR = re.compile(rb"[)\]>]\s*(?:Tj|TJ|'|\")")
+
+
+def forms_have_text(resources, depth=0):
+    """True if any form XObject reachable from `resources` paints text."""
+    resources = resolve1(resources)
+    if depth > 8 or not isinstance(resources, dict):
+        return False
+    for xobject in (resolve1(resources.get("XObject")) or {}).values():
+        xobject = resolve1(xobject)
+        if not isinstance(xobject, PDFStream) or getattr(xobject.get("Subtype"), "name", None) != "Form":
+            continue
+        if TEXT_SHOWING_OPERATOR.search(xobject.get_data()) or forms_have_text(xobject.get("Resources"), depth + 1):
+            return True
+    return False
+
+
+def page_has_text_layer(page):
+    """Cheap check for a text layer: scan the page's content streams for text operators.
+    
+    This skips pdfplumber's layout analysis, which is the expensive part of
+    extract_text(). Image XObjects are never decoded. When the streams
+    cannot be read the page is assumed to have text.
+    """
+    try:
+        page_obj = page.page_obj
+        for stream in page_obj.contents:
+            if TEXT_SHOWING_OPERATOR.search(resolve1(stream).get_data()):
+                return True
+        return forms_have_text(page_obj.resources)
+    except Exception:
+        return True
+
+
+def extract_page_text(page):
+    """Text of one pdfplumber page, or None when it has no text layer and was skipped.
+    
+    The page's cached layout objects are released before returning.
+    """
+    try:
+        if not page_has_text_layer(page):
+            return None
+        return page.extract_text() or ''
+    finally:
+        page.close()
+
+
+def current_rss():
+    """Resident memory of this process in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_page(stats, page_text):
+    """Record one extracted page in the run stats and return its text ('' for skipped pages)."""
+    if stats is not None:
+        stats["pages"] = stats.get("pages", 0) + 1
+        if page_text is None:
+            stats["image_pages_skipped"] = stats.get("image_pages_skipped", 0) + 1
+        stats["document_peak_rss"] = max(stats.get("document_peak_rss", 0), current_rss())
+    return page_text or ''
+
+
+def merge_page_counts(stats, attempt_stats):
+    """Add the page counts of one extraction attempt to the run stats."""
+    for key in ("pages", "image_pages_skipped"):
+        if key in attempt_stats:
+            stats[key] = stats.get(key, 0) + attempt_stats[key]
+
+
+def iter_page_windows(pdf_bytes, start, end, window=PAGE_WINDOW):
+    """Yield extract_page_text for pages [start, end), reopening the document every `window` pages.
+    
+    pdfminer keeps every object it has resolved (including decoded content
+    streams) until the document is closed, so a single open document grows
+    with page count. Reopening per window keeps memory flat.
+    """
+    while start < end:
+        with pdfplumber.open(BytesIO(pdf_bytes), pages=list(range(start + 1, min(start + window, end) + 1))) as pdf:
+            for page in pdf.pages:
+                yield extract_page_text(page)
+        start += window
+
+
+def parse_region_value(field, text):
+    """Value of `field` read from the text of a cropped template region, or None.
+    
+    Applies the same sanity checks extract_data_from_pdf applies to its
+    regex matches, so a template cannot write a value the full-text path
+    would have rejected.
+    """
+    text = " ".join(text.split())
+    if not text:
+        return None
+    
+    if field == "serial_number":
+        return text if re.search(r'\d', text) and len(text) >= 3 else None
+    if field == "seat_configuration":
+        return text if 5 < len(text) < 200 else None
+    if field == "engine_program":
+        program = text.rstrip('.').rstrip(',')
+        for key, value in ENGINE_PROGRAM_MAPPING.items():
+            if key in program:
+                return value
+        return program.upper() if 2 < len(program) < 20 else None
+    if field in ("year_model", "paint_exterior_year", "interior_year"):
+        year_match = re.search(r'(19|20)\d{2}', text)
+        if not year_match:
+            return None
+        year = int(year_match.group(0))
+        return year if field == "year_model" or 1990 <= year <= 2030 else None
+    if field in ("total_hours", "engine_overhaul", "number_of_seats"):
+        number_match = re.search(r'\d[\d,.]*', text)
+        if not number_match:
+            return None
+        value = int(number_match.group(0).rstrip(',.').replace(",", "").replace(".", ""))
+        if field == "number_of_seats":
+            return f"{value} SEATS" if 1 <= value <= 20 else None
+        if field == "engine_overhaul" and not 100 <= value <= 50000:
+            return None
+        return value
+    return text
+
+
+def extract_page_range(pdf_path, start, end):
+    """Process-pool worker: extract_page_text for pages [start, end) of the PDF at pdf_path."""
+    with open(pdf_path, "rb") as pdf_file:
+        pdf_bytes = pdf_file.read()
+    return list(iter_page_windows(pdf_bytes, start, end))
+
+
+@st.cache_resource
+def extraction_pool(workers):
+    """The process pool for page-parallel extraction, one per worker count.
+    
+    Starting workers re-imports the app in each of them and takes seconds,
+    so the pool is started on first use and then shared by every document
+    and rerun. Workers are never forked from Streamlit's multithreaded
+    script runner (forkserver, or spawn where that is unavailable).
+    """
+    start_methods = multiprocessing.get_all_start_methods()
+    mp_context = multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context)
+
+
+class PdfplumberBackend:
+    """Layout-aware extraction with pdfplumber, optionally page-parallel."""
+    
+    name = "pdfplumber"
+    
+    def available(self):
+        return True
+    
+    def version(self):
+        return EXTRACTOR_VERSION
+    
+    def extract(self, pdf_bytes, workers=1, stats=None):
+        return "\n".join(self.iter_pages(pdf_bytes, workers, stats))
+    
+    def extract_page_list(self, pdf_bytes, indexes):
+        """extract_page_text for the given 0-based pages, opening the document once per PAGE_WINDOW of them."""
+        texts = []
+        for start in range(0, len(indexes), PAGE_WINDOW):
+            window = indexes[start:start + PAGE_WINDOW]
+            with pdfplumber.open(BytesIO(pdf_bytes), pages=[index + 1 for index in window]) as pdf:
+                texts.extend(extract_page_text(page) for page in pdf.pages)
+        return texts
+    
+    def iter_pages(self, pdf_bytes, workers=1, stats=None):
+        """Yield the text of each page in order, in bounded windows (see iter_page_windows).
+        
+        With several workers and at least PARALLEL_MIN_PAGES pages the
+        windows are extracted across the process pool instead.
+        """
+        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+            page_count = len(pdf.pages)
+        if workers > 1 and page_count >= PARALLEL_MIN_PAGES:
+            page_texts = self.iter_pages_parallel(pdf_bytes, page_count, workers)
+        else:
+            page_texts = iter_page_windows(pdf_bytes, 0, page_count)
         try:
-            with pdfplumber.open(pdf_file) as pdf:
-                full_text = "\n".join(page.extract_text() or '' for page in pdf.pages)
-            return full_text.lower()
+            for page_text in page_texts:
+                yield count_page(stats, page_text)
+        finally:
+            page_texts.close()
+    
+    def iter_pages_parallel(self, pdf_bytes, page_count, workers):
+        """Yield page text in page order, extracted across the process pool.
+        
+        Each task opens its own copy of the document and extracts one
+        contiguous range of at most PAGE_WINDOW pages, so the output is
+        exactly the serial output. The document is written to a temp file
+        once and workers are sent its path, not the bytes. The pool itself
+        is the long-lived one from extraction_pool, not started per
+        document. Closing the generator early cancels the ranges no worker
+        has started.
+        """
+        chunk = min(PAGE_WINDOW, -(-page_count // workers))
+        ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+        
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            tmp.write(pdf_bytes)
+            tmp_path = tmp.name
+        pool = None
+        futures = []
+        yielded = 0
+        try:
+            pool = extraction_pool(workers)
+            futures = [pool.submit(extract_page_range, tmp_path, start, end) for start, end in ranges]
+            for future in futures:
+                for page_text in future.result():
+                    yield page_text
+                    yielded += 1
         except Exception as e:
-            st.error(f"Error reading PDF: {e}")
-            return ""
+            st.warning(f"⚠️ Parallel extraction failed ({e}), extracting pages serially")
+            if pool is not None:
+                # A pool whose worker died stays broken; start a fresh one next time
+                pool.shutdown(wait=False, cancel_futures=True)
+                extraction_pool.clear(workers)
+            yield from iter_page_windows(pdf_bytes, yielded, page_count)
+        finally:
+            for future in futures:
+                future.cancel()
+            os.unlink(tmp_path)
+
+
+class PdftotextBackend:
+    """poppler's pdftotext (installed via packages.txt), run as a subprocess.
+    
+    Much faster than pdfplumber on PDFs with a text layer, but its line
+    layout differs, so it is only used when selected, directly or through
+    AutoBackend.
+    """
+    
+    name = "pdftotext"
+    timeout = 120
+    _version = None
+    
+    def available(self):
+        return shutil.which("pdftotext") is not None
+    
+    def version(self):
+        if PdftotextBackend._version is None:
+            try:
+                result = subprocess.run(["pdftotext", "-v"], capture_output=True, text=True, timeout=10)
+                banner = (result.stderr or result.stdout).splitlines()
+                PdftotextBackend._version = f"pdftotext-{banner[0].split()[-1] if banner else 'unknown'}-1"
+            except (OSError, subprocess.SubprocessError):
+                PdftotextBackend._version = "pdftotext-unknown-1"
+        return PdftotextBackend._version
+    
+    def extract(self, pdf_bytes, workers=1, stats=None):
+        return "\n".join(self.iter_pages(pdf_bytes, workers, stats))
+    
+    def iter_pages(self, pdf_bytes, workers=1, stats=None):
+        """Yield the text of each page in order; one pdftotext run reads them all up front."""
+        for page_text in self.extract_pages(pdf_bytes):
+            yield count_page(stats, page_text)
+    
+    def extract_pages(self, pdf_bytes):
+        """The text of each page, or [] when pdftotext fails."""
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            tmp.write(pdf_bytes)
+            tmp_path = tmp.name
+        try:
+            result = subprocess.run(
+                ["pdftotext", "-enc", "UTF-8", tmp_path, "-"],
+                capture_output=True, timeout=self.timeout
+            )
+        except (OSError, subprocess.SubprocessError):
+            return []
+        finally:
+            os.unlink(tmp_path)
+        if result.returncode != 0:
+            return []
+        # Pages end with a form feed
+        pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+        if pages and not pages[-1].strip():
+            pages.pop()
+        return pages
+
+
+class AutoBackend:
+    """pdftotext for speed, with pdfplumber reading only the pages pdftotext returns empty.
+    
+    When pdftotext finds no text anywhere (or fails) this yields no pages,
+    and the chain falls back to pdfplumber for the whole document.
+    """
+    
+    name = "auto"
+    
+    def available(self):
+        return TEXT_BACKENDS["pdftotext"].available()
+    
+    def version(self):
+        return f"auto-{TEXT_BACKENDS['pdftotext'].version()}-{TEXT_BACKENDS['pdfplumber'].version()}"
+    
+    def extract(self, pdf_bytes, workers=1, stats=None):
+        return "\n".join(self.iter_pages(pdf_bytes, workers, stats))
+    
+    def iter_pages(self, pdf_bytes, workers=1, stats=None):
+        pages = TEXT_BACKENDS["pdftotext"].extract_pages(pdf_bytes)
+        if not any(page.strip() for page in pages):
+            return
+        empty = [index for index, page in enumerate(pages) if not page.strip()]
+        if empty:
+            for index, page_text in zip(empty, TEXT_BACKENDS["pdfplumber"].extract_page_list(pdf_bytes, empty)):
+                pages[index] = page_text
+        for page_text in pages:
+            yield count_page(stats, page_text)
+
+
+TEXT_BACKENDS = {backend.name: backend for backend in (PdfplumberBackend(), PdftotextBackend(), AutoBackend())}
+
+
+def text_backend_chain(mode):
+    """Backends to try in order for a mode; pdfplumber is always the last resort.
+    
+    "pdftotext" uses pdftotext for the whole document; "auto" also has
+    pdfplumber read the pages pdftotext returns empty (see AutoBackend).
+    """
+    fallback = TEXT_BACKENDS["pdfplumber"]
+    if mode in ("pdftotext", "auto") and TEXT_BACKENDS[mode].available():
+        return [TEXT_BACKENDS[mode], fallback]
+    return [fallback]
+
+
+def text_looks_usable(text):
+    """Cheap check that extracted text is neither empty nor garbled."""
+    sample = text.strip()[:20000]
+    if not sample:
+        return False
+    if sample.count("\ufffd") + sample.count("(cid:") > len(sample) / 200:
+        return False
+    readable = sum(1 for ch in sample if ch.isalnum() or ch.isspace() or ch in ".,:;-/()&%$#'\"+*")
+    if readable < len(sample) * 0.85:
+        return False
+    # Letter-spaced output ("t o t a l  t i m e") defeats every keyword search
+    words = sample.split()
+    return sum(1 for word in words if len(word) == 1) < len(words) * 0.5
+
+
+class PdfTextCache:
+    """On-disk cache of extracted PDF text, keyed by content hash.
+    
+    Entries are plain UTF-8 files named after SHA-256(extractor version +
+    PDF bytes). A hit refreshes the file's mtime, and writes evict the least
+    recently used entries once the directory grows past `max_bytes`. Cache
+    I/O errors are swallowed; the caller just extracts again.
+    """
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+    
+    @staticmethod
+    def key(pdf_bytes, extractor_version):
+        digest = hashlib.sha256(extractor_version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(pdf_bytes)
+        return digest.hexdigest()
+    
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+    
+    def get(self, key):
+        """Return the cached text for `key`, or None on a miss."""
+        try:
+            with open(self.path(key), "r", encoding="utf-8", newline="") as f:
+                text = f.read()
+            os.utime(self.path(key))
+            return text
+        except OSError:
+            return None
+    
+    def put(self, key, text):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path(key))
+            self.evict()
+        except OSError:
+            pass
+    
+    def entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".txt"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+    
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    
+    def clear(self):
+        try:
+            for _, _, path in self.entries():
+                os.remove(path)
+        except OSError:
+            pass
+
+
+MINHASH_PRIME = 4294967311  # smallest prime above 2**32
+_minhash_random = random.Random(1119)
+MINHASH_A = np.array([_minhash_random.randrange(1, 2**31) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64)
+MINHASH_B = np.array([_minhash_random.randrange(0, 2**31) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64)
+
+
+def minhash_signature(text):
+    """MinHash signature of the word shingles of `text`, as a tuple of ints.
+    
+    Shingles are hashed with CRC-32 rather than hash() so signatures are
+    stable across processes and can be stored.
+    """
+    words = TOKEN_PATTERN.findall(text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    permuted = (MINHASH_A[:, None] * hashes[None, :] + MINHASH_B[:, None]) % MINHASH_PRIME
+    return tuple(int(value) for value in permuted.min(axis=1))
+
+
+class JsonJournal:
+    """Append-only JSON Lines file of [key, value] records; the last line for a key wins.
+    
+    Each write appends one line rather than rewriting the file, so saving
+    after every PDF costs the same however many entries there are. A crash
+    can at worst leave a torn last line, which loading skips. Once superseded
+    lines outnumber live entries, the live entries are written to a temp
+    file that is os.replace'd into place. Callers swallow OSError.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.lines = 0
+    
+    def load(self):
+        """Return the live {key: value} entries, compacting the file if it held a torn line."""
+        entries = {}
+        torn = False
+        self.lines = 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    self.lines += 1
+                    try:
+                        key, value = json.loads(line)
+                    except (ValueError, TypeError):
+                        torn = True
+                        continue
+                    entries[key] = value
+        except OSError:
+            return entries
+        if torn:
+            try:
+                self.rewrite(entries)
+            except OSError:
+                pass
+        return entries
+    
+    def append(self, key, entries):
+        """Save entries[key], the entry just written; `entries` holds every live entry."""
+        if self.lines >= max(2 * len(entries), JOURNAL_MIN_COMPACT_LINES):
+            self.rewrite(entries)
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps([key, entries[key]], default=str) + "\n")
+        self.lines += 1
+    
+    def rewrite(self, entries):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, value in entries.items():
+                f.write(json.dumps([key, value], default=str) + "\n")
+        os.replace(tmp_path, self.path)
+        self.lines = len(entries)
+    
+    def clear(self):
+        self.lines = 0
+        os.remove(self.path)
+
+
+class NearDuplicateIndex:
+    """Local index of MinHash signatures of processed PDFs, with LSH banding.
+    
+    Each record keeps what was extracted from the PDF so a near-duplicate
+    can reuse it. Records are saved one at a time to a JsonJournal, capped
+    at `max_records` (oldest dropped first). File errors are swallowed; the
+    index then only covers the current session.
+    """
     
-    def generate_keyword_variations(self, base_keyword):
-        """Generate common variations of a keyword"""
+    def __init__(self, path, max_records):
+        self.max_records = max_records
+        self.records = {}
+        self.buckets = {}
+        self.journal = JsonJournal(path)
+        records = self.journal.load()
+        for key in sorted(records, key=lambda k: records[k]["processed_at"])[-max_records:]:
+            self.index_record(key, records[key])
+    
+    @staticmethod
+    def bands(signature):
+        rows = len(signature) // LSH_BANDS
+        return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(LSH_BANDS)]
+    
+    def index_record(self, key, record):
+        self.records[key] = record
+        for band in self.bands(record["signature"]):
+            self.buckets.setdefault(band, set()).add(key)
+    
+    def query(self, signature, threshold=NEAR_DUPLICATE_THRESHOLD):
+        """Return [(similarity, record)] for records at or above `threshold`, most similar first."""
+        candidates = set()
+        for band in self.bands(signature):
+            candidates |= self.buckets.get(band, set())
+        matches = []
+        for key in candidates:
+            stored = self.records[key]["signature"]
+            similarity = sum(a == b for a, b in zip(signature, stored)) / len(signature)
+            if similarity >= threshold:
+                matches.append((similarity, self.records[key]))
+        matches.sort(key=lambda match: (-match[0], -match[1]["processed_at"]))
+        return matches
+    
+    def add(self, key, signature, **record):
+        if key in self.records:
+            for band in self.bands(self.records[key]["signature"]):
+                self.buckets.get(band, set()).discard(key)
+        self.index_record(key, dict(record, signature=list(signature), processed_at=time.time()))
+        
+        while len(self.records) > self.max_records:
+            oldest = min(self.records, key=lambda k: self.records[k]["processed_at"])
+            for band in self.bands(self.records[oldest]["signature"]):
+                self.buckets.get(band, set()).discard(oldest)
+            del self.records[oldest]
+        try:
+            self.journal.append(key, self.records)
+        except OSError:
+            pass
+    
+    def clear(self):
+        self.records = {}
+        self.buckets = {}
+        try:
+            self.journal.clear()
+        except OSError:
+            pass
+
+
+class ProcessingLedger:
+    """What was extracted from each PDF, keyed on PDF content hash, serial and broker.
+    
+    An entry also stores the model and that model's config fingerprint, and
+    is only replayed while both still match. Entries are saved one at a time
+    to a JsonJournal, capped at `max_entries` (oldest dropped first); file
+    errors are swallowed.
+    """
+    
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.journal = JsonJournal(path)
+        entries = self.journal.load()
+        self.entries = {key: entries[key] for key in sorted(entries, key=lambda k: entries[k]["processed_at"])[-max_entries:]}
+    
+    @staticmethod
+    def key(pdf_hash, serial_number, broker_name):
+        return f"{pdf_hash}:{serial_number.strip()}:{broker_name.strip().lower()}"
+    
+    def lookup(self, key, configurations):
+        """Return (aircraft_model, extracted_data) for `key` if its model config is unchanged, else None."""
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        config = configurations.get(entry["model"])
+        if not isinstance(config, dict) or entry["config_version"] != config_fingerprint(config):
+            return None
+        return entry["model"], dict(entry["extracted_data"])
+    
+    def record(self, key, aircraft_model, config, extracted_data):
+        self.entries[key] = {
+            "model": aircraft_model,
+            "config_version": config_fingerprint(config),
+            "extracted_data": dict(extracted_data),
+            "processed_at": time.time()
+        }
+        while len(self.entries) > self.max_entries:
+            del self.entries[min(self.entries, key=lambda k: self.entries[k]["processed_at"])]
+        try:
+            self.journal.append(key, self.entries)
+        except OSError:
+            pass
+    
+    def clear(self):
+        self.entries = {}
+        try:
+            self.journal.clear()
+        except OSError:
+            pass
+
+
+@functools.lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def translate_formula(formula, col_shift):
+    """
+    `formula` with its relative column references moved `col_shift` columns.
+    openpyxl's tokenizer leaves strings, function names (LOG10) and sheet names
+    alone; absolute ($P) columns stay put. A broker column's formulas repeat
+    up to a column offset, so most calls are cache hits.
+    """
+    return Translator(formula, origin="A1").translate_formula(col_delta=col_shift)
+
+
+def relative_column(col_str, origin_col):
+    """An absolute column ($P) as text, a relative one as its offset from origin_col."""
+    if col_str.startswith('$'):
+        return [col_str]
+    return [column_index_from_string(col_str.upper()) - origin_col]
+
+
+def relative_range(range_str, origin_col):
+    """One range token split like Translator.translate_range splits it, columns made relative."""
+    ws_part, range_str = Translator.strip_ws_name(range_str)
+    if Translator.ROW_RANGE_RE.match(range_str):  # e.g. `3:4`
+        return [ws_part, range_str]
+    match = Translator.COL_RANGE_RE.match(range_str)  # e.g. `A:BC`
+    if match:
+        return [ws_part, *relative_column(match.group(1), origin_col), ":", *relative_column(match.group(2), origin_col)]
+    parts = [ws_part]
+    for i, piece in enumerate(range_str.split(":")):
+        if i:
+            parts.append(":")
+        match = Translator.CELL_REF_RE.match(piece)
+        if match:
+            parts.extend(relative_column(match.group(1), origin_col))
+            parts.append(match.group(2))
+        else:  # a named range
+            parts.append(piece)
+    return parts
+
+
+def relative_formula(formula, origin_col):
+    """
+    A formula written in column `origin_col` in position-independent (R1C1-style)
+    form: a tuple of text pieces and relative column offsets. A formula the
+    tokenizer cannot read is kept as a single piece, so it copies verbatim.
+    """
+    try:
+        tokens = Tokenizer(formula).items
+    except TokenizerError:
+        return (formula,)
+    parts = ["="]
+    for token in tokens:
+        if token.type == Token.OPERAND and token.subtype == Token.RANGE:
+            parts.extend(relative_range(token.value, origin_col))
+        else:
+            parts.append(token.value)
+    # Merge neighbouring text so instantiating is one join
+    merged = []
+    for part in parts:
+        if merged and isinstance(part, str) and isinstance(merged[-1], str):
+            merged[-1] += part
+        else:
+            merged.append(part)
+    return tuple(merged)
+
+
+def instantiate_formula(parts, column):
+    """The A1 formula for relative_formula parts placed in `column`."""
+    return "".join(part if isinstance(part, str) else get_column_letter(column + part) for part in parts)
+
+
+# Shared by every Y/N cell the upgrade writers fill in, so the font is hashed
+# into the workbook's font table once rather than built for each cell
+UPGRADE_FONT = Font(name="Calibri", size=11, color="FFFFFF")
+
+
+def copy_style(source_cell, dest_cell):
+    """
+    Give dest_cell the full style of source_cell (same workbook). A cell holds
+    only indices into the workbook's shared font, fill, border, number format,
+    alignment and protection tables, so this copies those indices and creates
+    no style objects.
+    """
+    dest_cell._style = copy(source_cell._style)
+
+
+def config_fingerprint(config):
+    """Stable hash of an aircraft configuration, used to invalidate per-config caches."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=16)
+def document_tokens(text):
+    """The set of lowercase alphanumeric tokens in a document's text."""
+    return frozenset(TOKEN_PATTERN.findall(text.lower()))
+
+
+class ModelIndex:
+    """Inverted index from model-name tokens to configured aircraft models.
+    
+    Each model's signature is its name's tokens minus MODEL_STOPWORDS and
+    words of two letters or fewer. Like the word-by-word check it replaced,
+    partial matches need a name of at least two words, counted before that
+    filtering, so "Falcon 7X" is found on "falcon" alone. The short tokens
+    ("7x", "45") only break ties between models with the same score. A name
+    made only of such tokens ("G5", "LJ 35") has no signature and is only
+    found verbatim. Ranking a document looks every indexed token up in the
+    document's token set once, so the cost depends on the model vocabulary,
+    not on the document length or the number of models.
+    """
+    
+    def __init__(self, model_names):
+        self.signatures = {}  # model name -> its tokens, in name order
+        self.details = {}     # model name -> its short tokens, for breaking ties
+        self.word_counts = {}
+        self.postings = {}    # token -> models whose signature contains it
+        self.verbatim_only = []  # models with an empty signature
+        for model_name in sorted(model_names):
+            tokens = [t for t in TOKEN_PATTERN.findall(model_name.lower()) if t not in MODEL_STOPWORDS]
+            signature = tuple(dict.fromkeys(t for t in tokens if len(t) > 2))
+            self.signatures[model_name] = signature
+            self.details[model_name] = tuple(dict.fromkeys(t for t in tokens if len(t) <= 2))
+            self.word_counts[model_name] = len(model_name.split())
+            if not signature:
+                self.verbatim_only.append(model_name)
+            for token in signature:
+                self.postings.setdefault(token, []).append(model_name)
+    
+    def rank(self, pdf_text):
+        """Return [(model_name, score, reason)] for every model with any matching token, best first.
+        
+        The score is the fraction of the model's tokens found in the document.
+        A model whose whole name appears verbatim scores 2.0, and an "Excel"
+        model scores at least MODEL_MATCH_THRESHOLD when "excel" appears.
+        Ties go to the model with more of its short tokens in the document,
+        then to the one with more tokens, then by name.
+        """
+        return self.rank_tokens(document_tokens(pdf_text), lambda model_name: model_name.lower() in pdf_text)
+    
+    def rank_tokens(self, tokens, names_model):
+        """rank() for a document given as its token set and a test for "the model's name appears verbatim"."""
+        matched = {}
+        for token, model_names in self.postings.items():
+            if token in tokens:
+                for model_name in model_names:
+                    matched[model_name] = matched.get(model_name, 0) + 1
+        
+        ranked = []
+        for model_name, count in matched.items():
+            signature = self.signatures[model_name]
+            score = count / len(signature)
+            reason = f"Partial match found (matched {count}/{len(signature)} words)"
+            if count == len(signature) and names_model(model_name):
+                score, reason = 2.0, "Direct match found"
+            elif "excel" in signature and "excel" in tokens and score < MODEL_MATCH_THRESHOLD:
+                score, reason = MODEL_MATCH_THRESHOLD, "Excel match found"
+            elif self.word_counts[model_name] < 2:
+                continue
+            ranked.append((model_name, score, reason))
+        for model_name in self.verbatim_only:
+            if names_model(model_name):
+                ranked.append((model_name, 2.0, "Direct match found"))
+        ranked.sort(key=lambda entry: (
+            -entry[1], -sum(token in tokens for token in self.details[entry[0]]), -len(self.signatures[entry[0]]), entry[0]
+        ))
+        return ranked
+
+
+class SynonymTable:
+    """Abbreviation and synonym groups for keyword variations, {key: [variations]}.
+    
+    A keyword containing a group's key or any of its variations gets all of
+    that group's variations. Results are memoized per keyword in a bounded
+    cache that lives as long as the table.
+    """
+    
+    def __init__(self, synonyms):
+        self.synonyms = {key.lower(): [value.lower() for value in values] for key, values in synonyms.items()}
+        self.groups = tuple((key, tuple(values)) for key, values in self.synonyms.items())
+        self.variations = functools.lru_cache(maxsize=VARIATION_CACHE_SIZE)(self.compute_variations)
+    
+    def extended(self, extra_synonyms):
+        """A new table with `extra_synonyms` merged in, e.g. a model's "keyword_synonyms"."""
+        synonyms = {key: list(values) for key, values in self.synonyms.items()}
+        for key, values in extra_synonyms.items():
+            merged = synonyms.setdefault(key.lower(), [])
+            merged.extend(value.lower() for value in values if value.lower() not in merged)
+        return SynonymTable(synonyms)
+    
+    def compute_variations(self, base_keyword):
         variations = [base_keyword.lower()]
         base_lower = base_keyword.lower()  # Define base_lower at the beginning
         
@@ -64,47 +1495,1024 @@ class CompletePlatform:
             variations.append(base_keyword.lower().replace(".", ""))
             variations.append(base_keyword.lower().replace(".", " "))
         
-        # Handle common abbreviations
-        abbreviation_map = {
-            "prebuy": ["prebuy", "pre-buy", "pre buy", "prebuy inspection", "pre-buy inspection"],
-            "tcas": ["tcas", "t-cas", "traffic collision avoidance system"],
-            "waas": ["waas", "wide area augmentation system"],
-            "ahrs": ["ahrs", "attitude heading reference system"],
-            "fms": ["fms", "flight management system"],
-            "apu": ["apu", "auxiliary power unit"],
-            "gps": ["gps", "global positioning system"],
-            "ads-b": ["ads-b", "adsb", "ads b", "automatic dependent surveillance"],
-            "cpdlc": ["cpdlc", "controller pilot data link"],
-            "fans": ["fans", "future air navigation system"],
-            "taws": ["taws", "terrain awareness warning system"],
-            "egpws": ["egpws", "enhanced ground proximity warning system"],
-            "synthetic vision": ["synthetic vision", "svt", "synthetic vision technology"],
-            "belted lav": ["belted lav", "belted lavatory", "bltd lav", "blted lav"],
-            "external lav": ["external lav", "external lavatory", "ext lav", "ext lavatory"]
-        }
-        
         # Check if base keyword matches any known abbreviations
-        for key, values in abbreviation_map.items():
+        for key, values in self.groups:
             if key in base_lower or any(v in base_lower for v in values):
                 variations.extend(values)
         
         # Remove duplicates while preserving order
-        seen = set()
-        unique_variations = []
-        for v in variations:
-            if v not in seen:
-                seen.add(v)
-                unique_variations.append(v)
-        
-        return unique_variations
+        return tuple(dict.fromkeys(variations))
+
+
+@st.cache_resource
+def load_keyword_synonyms(path):
+    """The shared SynonymTable from a JSON file, loaded once per server process."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return SynonymTable(json.load(f))
+    except (OSError, ValueError) as e:
+        st.warning(f"⚠️ Could not load keyword synonyms from {path}: {e}")
+        return SynonymTable({})
+
+
+def plan_batch_inserts(serial_positions, new_serials):
+    """
+    Where a batch of new broker columns ends up, found by replaying
+    find_insertion_point and insert_new_row's shift one serial at a time on
+    column numbers alone.
+    
+    `serial_positions` is find_insertion_point's list for the sheet and
+    `new_serials` the numeric serials in batch order. Returns the final column
+    of every existing serial column, and for each new serial its final column,
+    the final column it copies formulas from (None if there is none), and
+    where the formatting a one-at-a-time insert would leave in its cells comes
+    from: ("column", final column of the column it pushed aside) or, when it
+    landed on an empty position, ("blank", that position in the original sheet).
+    """
+    entries = [{'column': pos['column'], 'serial': pos['serial'], 'source': ('existing', pos['column'])} for pos in serial_positions]
+    template_sources = []
+    vacated_sources = []
+    for i, new_serial in enumerate(new_serials):
+        ordered = sorted(entries, key=lambda e: (e['serial'], e['column']))
+        insert_col = next((e['column'] for e in ordered if new_serial < e['serial']), None)
+        if insert_col is None:
+            insert_col = ordered[-1]['column'] + 2 if ordered else 16
+        vacated_sources.append(next((e['source'] for e in entries if e['column'] == insert_col), ('blank', insert_col)))
+        for e in entries:
+            if e['column'] >= insert_col:
+                e['column'] += 2
+        
+        adjacent_col = None
+        if insert_col > 16:
+            adjacent_col = insert_col - 2
+        elif entries:
+            adjacent_col = insert_col + 2
+        template_sources.append(next((e['source'] for e in entries if e['column'] == adjacent_col), None))
+        entries.append({'column': insert_col, 'serial': new_serial, 'source': ('new', i)})
+    
+    final = {e['source']: e['column'] for e in entries}
+    destinations = {column: final[(kind, column)] for kind, column in final if kind == 'existing'}
+    placements = [
+        (final[('new', i)], final.get(template_source), vacated_source if vacated_source[0] == 'blank' else ('column', final[vacated_source]))
+        for i, (template_source, vacated_source) in enumerate(zip(template_sources, vacated_sources))
+    ]
+    return destinations, placements
+
+
+class RowPlan:
+    """
+    How insert_new_row treats each row of a sheet, worked out once per model
+    config and sheet: the serial and broker rows take data, avionics rows copy
+    the template column and set their Y/N, special-formula and plain formula
+    rows copy formulas, and data and upgrade rows are left for the extracted
+    values. `kinds[row]` is the row's class.
+    """
+    
+    SERIAL = "serial"
+    BROKER = "broker"
+    DATA = "data"
+    UPGRADE = "upgrade"
+    AVIONICS = "avionics"
+    AVIONICS_HEADER = "avionics_header"
+    SPECIAL_FORMULA = "special_formula"
+    FORMULA = "formula"
+    COPIES_FORMULAS = (SPECIAL_FORMULA, FORMULA)
+    
+    def __init__(self, ws, config, broker_row):
+        self.broker_row = broker_row
+        row_mappings = config.get("row_mappings", {})
+        upgrades = config.get("upgrades", {})
+        avionics_section = config.get("avionics_section", {})
+        avionics_start = avionics_section.get("start")
+        avionics_end = avionics_section.get("end")
+        
+        data_rows = set(row_mappings.values())
+        upgrade_rows = {upgrade_config.get("row") for upgrade_config in upgrades.values()}
+        
+        # Rows that should ALWAYS get formulas: APU, the lav/delivery/APU upgrades, and rows 34 and 29
+        special_formula_rows = {34, 29}
+        if row_mappings.get("apu_program"):
+            special_formula_rows.add(int(row_mappings["apu_program"]))
+        for upgrade_name, upgrade_config in upgrades.items():
+            if any(keyword in upgrade_name for keyword in ["BELTED_LAV", "EXTERNAL_LAV", "DELIVERY_TO_THE_US", "DELIVERY", "APU"]):
+                if upgrade_config.get("row"):
+                    special_formula_rows.add(int(upgrade_config["row"]))
+        
+        # Upgrades by row, in config order, for the avionics Y/N values
+        self.upgrades_by_row = {}
+        for upgrade_name, upgrade_config in upgrades.items():
+            self.upgrades_by_row.setdefault(upgrade_config.get("row"), []).append(upgrade_name)
+        
+        self.labeled_rows = set()
+        self.kinds = [None]
+        for row in range(1, ws.max_row + 1):
+            label = ws.cell(row=row, column=12).value
+            if label and isinstance(label, str) and label.strip():
+                self.labeled_rows.add(row)
+            
+            if row == 1:
+                kind = self.SERIAL
+            elif row == broker_row:
+                kind = self.BROKER
+            elif avionics_start and avionics_end and avionics_start <= row <= avionics_end:
+                is_header = isinstance(label, str) and "AVIONICS" in label.upper() and "UPGRADE" in label.upper()
+                kind = self.AVIONICS_HEADER if is_header else self.AVIONICS
+            elif row in special_formula_rows:
+                kind = self.SPECIAL_FORMULA
+            elif row in data_rows:
+                kind = self.DATA
+            elif row in upgrade_rows:
+                kind = self.UPGRADE
+            else:
+                kind = self.FORMULA
+            self.kinds.append(kind)
+    
+    def rows(self):
+        """(row, kind) for every row of the sheet."""
+        return enumerate(self.kinds[1:], start=1)
+
+
+class TemplateColumn:
+    """
+    What a new broker column copies from its template column, read once.
+    `rows` holds (row, kind, main, yn) for the avionics and formula rows of a
+    RowPlan; `main` and `yn` are (value, formula parts, style) snapshots or
+    None, with formulas in relative_formula form so the snapshot can be laid
+    down at any column without reading the template again.
+    """
+    
+    def __init__(self, ws, column, plan):
+        self.rows = []
+        for row, kind in plan.rows():
+            template_cell = ws.cell(row=row, column=column)
+            template_yn_cell = ws.cell(row=row, column=column + 1)
+            if kind == RowPlan.AVIONICS:
+                # Any value is copied; the Y/N value comes from the PDF, only its style is copied
+                main = self.snapshot(template_cell, column) if template_cell.value else None
+                yn = (None, None, copy(template_yn_cell._style)) if row in plan.labeled_rows else None
+            elif kind in RowPlan.COPIES_FORMULAS:
+                main = self.snapshot(template_cell, column) if self.is_formula(template_cell) else None
+                yn = self.snapshot(template_yn_cell, column) if self.is_formula(template_yn_cell) else None
+            else:
+                continue
+            if main or yn:
+                self.rows.append((row, kind, main, yn))
+    
+    @staticmethod
+    def is_formula(cell):
+        return isinstance(cell.value, str) and cell.value.startswith('=')
+    
+    @classmethod
+    def snapshot(cls, cell, column):
+        parts = relative_formula(cell.value, column) if cls.is_formula(cell) else None
+        return cell.value, parts, copy(cell._style)
+    
+    @staticmethod
+    def fill(snapshot, cell, column):
+        """Write a (value, parts, style) snapshot into `cell`, which sits in `column`."""
+        value, parts, style = snapshot
+        if parts:
+            try:
+                value = instantiate_formula(parts, column)
+            except ValueError as e:
+                # A reference would land left of column A
+                logger.warning("Copied formula %s to %s unshifted: %s", value, cell.coordinate, e)
+        cell.value = value
+        cell._style = copy(style)
+
+
+class XlsxPatchUnsupported(Exception):
+    """The workbook uses something the XML patch engine does not handle; load it with openpyxl instead."""
+
+
+SHEET_ROW_RE = re.compile(r'<row\b[^>]*>')
+SHEET_CELL_RE = re.compile(r'<c\b[^>]*?\sr="([A-Z]+)(\d+)"[^>]*?(?:/>|>.*?</c>)', re.S)
+STYLE_XF_RE = re.compile(r'<xf\b[^>]*?(?:/>|>.*?</xf>)', re.S)
+FONT_START_RE = re.compile(r'<font[\s>/]')
+# Workbook elements that follow calcPr, for placing one where none exists
+AFTER_CALC_PR_RE = re.compile(r'<(?:oleSize|customWorkbookViews|pivotCaches|smartTagPr|smartTagTypes|webPublishing|fileRecoveryPr|webPublishObjects|extLst)\b|</workbook>')
+
+
+def xml_attribute(tag, name):
+    """The value of attribute `name` in the start tag `tag`, or None."""
+    match = re.search(rf'\s{name}="([^"]*)"', tag[:tag.index('>') + 1])
+    return match.group(1) if match else None
+
+
+def set_xml_attribute(tag, name, value):
+    """`tag` (an element's text) with attribute `name` of its start tag set to `value`."""
+    end = tag.index('>')
+    start_tag = tag[:end + 1]
+    if re.search(rf'\s{name}="[^"]*"', start_tag):
+        start_tag = re.sub(rf'(\s{name}=)"[^"]*"', lambda m: f'{m.group(1)}"{value}"', start_tag, count=1)
+    else:
+        close = end - 1 if tag[end - 1] == '/' else end
+        start_tag = f'{tag[:close].rstrip()} {name}="{value}"{tag[close:end + 1]}'
+    return start_tag + tag[end + 1:]
+
+
+def text_xml(text):
+    """A <t> element holding `text`, keeping leading and trailing spaces."""
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f"<t{space}>{escape(text)}</t>"
+
+
+def numeric_value(text):
+    """A cell's stored number the way openpyxl reads it back."""
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+
+class XlsxCellValue:
+    __slots__ = ("value",)
+    
+    def __init__(self, value):
+        self.value = value
+
+
+class XlsxSheetView:
+    """Read-only cell access to one worksheet of an XlsxCellPatch.
+    
+    Rows are parsed from the sheet's XML only as far down as a lookup
+    reaches, so reading the serial row and the labels near the top costs
+    the same whatever the size of the workbook. Values already set on the
+    patch read back as written.
+    """
+    
+    def __init__(self, patch, title, path):
+        self.patch = patch
+        self.title = title
+        self.rows = {}
+        self.parsed_to = 0
+        self.parser = ET.iterparse(patch.zip.open(path), events=("end",))
+    
+    def parse_to(self, row):
+        while self.parser is not None and self.parsed_to < row:
+            try:
+                event, element = next(self.parser)
+            except StopIteration:
+                self.parser = None
+                break
+            if element.tag != f"{{{XlsxCellPatch.MAIN_NS}}}row":
+                continue
+            row_num = element.get("r")
+            if row_num is None:
+                raise XlsxPatchUnsupported(f"{self.title} has rows without row numbers")
+            self.parsed_to = int(row_num)
+            cells = {}
+            for cell in element:
+                ref = cell.get("r")
+                if ref is None:
+                    raise XlsxPatchUnsupported(f"{self.title} has cells without references")
+                cells[column_index_from_string(ref.rstrip("0123456789"))] = self.patch.cell_value(cell)
+            self.rows[self.parsed_to] = cells
+            element.clear()
+    
+    @property
+    def max_row(self):
+        # Lookups only scan the top of the sheet (find_broker_row stops at 50)
+        self.parse_to(50)
+        written = [row for row, column in self.patch.changes.get(self.title, {})]
+        return max([self.parsed_to, *written])
+    
+    @property
+    def max_column(self):
+        # Lookups only scan the serial row
+        self.parse_to(1)
+        columns = list(self.rows.get(1, {}))
+        columns += [column for row, column in self.patch.changes.get(self.title, {}) if row == 1]
+        return max(columns, default=1)
+    
+    def cell(self, row, column):
+        written = self.patch.changes.get(self.title, {}).get((row, column))
+        if written is not None:
+            return XlsxCellValue(written[0])
+        self.parse_to(row)
+        return XlsxCellValue(self.rows.get(row, {}).get(column))
+
+
+class XlsxCellPatch:
+    """Change individual cells of an xlsx file by editing its XML directly.
+    
+    openpyxl parses and re-serializes every part of a workbook, and drops
+    whatever it does not model, to change a column of cells. This reads
+    and writes the package itself: `save()` edits just the patched cells
+    in their sheet's XML, appends new strings to the shared strings and
+    any restyled cell formats to the styles, asks Excel to recalculate on
+    load, and copies every other part of the package through unchanged.
+    Anything it does not understand raises XlsxPatchUnsupported.
+    
+    For reading, `sheetnames` and `[sheet name]` mirror an openpyxl
+    workbook closely enough for the broker and serial lookups.
+    """
+    
+    MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+    
+    def __init__(self, xlsx_bytes):
+        self.source = xlsx_bytes
+        try:
+            self.zip = zipfile.ZipFile(BytesIO(xlsx_bytes))
+            self.read_workbook()
+        except (zipfile.BadZipFile, KeyError, ValueError, ET.ParseError) as e:
+            raise XlsxPatchUnsupported(f"cannot read the workbook package: {e}")
+        self.changes = {}  # sheet name -> {(row, column): (value, font)}
+        self.views = {}
+        self.strings = []
+        self.string_parser = None
+    
+    def relationships(self, part):
+        """{relationship id: (type, part path)} for the part at `part`."""
+        folder, name = posixpath.split(part)
+        rels_path = posixpath.join(folder, "_rels", f"{name}.rels")
+        relationships = {}
+        for rel in ET.fromstring(self.zip.read(rels_path)).iter(f"{{{self.PACKAGE_REL_NS}}}Relationship"):
+            if rel.get("TargetMode") == "External":
+                continue
+            target = rel.get("Target")
+            path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+            relationships[rel.get("Id")] = (rel.get("Type").rsplit("/", 1)[-1], path)
+        return relationships
+    
+    def read_workbook(self):
+        self.workbook_path = next(path for kind, path in self.relationships("").values() if kind == "officeDocument")
+        self.workbook_rels_path = posixpath.join(posixpath.dirname(self.workbook_path), "_rels", f"{posixpath.basename(self.workbook_path)}.rels")
+        relationships = self.relationships(self.workbook_path)
+        self.parts = {kind: path for kind, path in relationships.values()}
+        self.sheet_paths = {}
+        workbook = ET.fromstring(self.zip.read(self.workbook_path))
+        for sheet in workbook.iter(f"{{{self.MAIN_NS}}}sheet"):
+            kind, path = relationships[sheet.get(f"{{{self.REL_NS}}}id")]
+            if kind != "worksheet":
+                raise XlsxPatchUnsupported(f"sheet {sheet.get('name')} is a {kind}")
+            self.sheet_paths[sheet.get("name")] = path
+    
+    @property
+    def sheetnames(self):
+        return list(self.sheet_paths)
+    
+    def __getitem__(self, name):
+        if name not in self.views:
+            self.views[name] = XlsxSheetView(self, name, self.sheet_paths[name])
+        return self.views[name]
+    
+    def shared_string(self, index):
+        """Shared string `index`, parsing sharedStrings.xml only as far as needed."""
+        if self.string_parser is None and not self.strings:
+            self.string_parser = ET.iterparse(self.zip.open(self.parts["sharedStrings"]), events=("end",))
+        while len(self.strings) <= index and self.string_parser is not None:
+            try:
+                event, element = next(self.string_parser)
+            except StopIteration:
+                self.string_parser = None
+                break
+            if element.tag == f"{{{self.MAIN_NS}}}si":
+                self.strings.append(self.inline_text(element))
+                element.clear()
+        return self.strings[index]
+    
+    def inline_text(self, element):
+        """The text of an <si> or <is> element: plain, or its rich-text runs joined."""
+        text = element.find(f"{{{self.MAIN_NS}}}t")
+        if text is not None:
+            return text.text or ""
+        return "".join(run.findtext(f"{{{self.MAIN_NS}}}t", "") for run in element.iter(f"{{{self.MAIN_NS}}}r"))
+    
+    def cell_value(self, cell):
+        """A <c> element's value as openpyxl would load it (formulas as their "=..." text)."""
+        formula = cell.find(f"{{{self.MAIN_NS}}}f")
+        if formula is not None:
+            return f"={formula.text or ''}"
+        kind = cell.get("t", "n")
+        if kind == "inlineStr":
+            inline = cell.find(f"{{{self.MAIN_NS}}}is")
+            return self.inline_text(inline) if inline is not None else None
+        value = cell.findtext(f"{{{self.MAIN_NS}}}v")
+        if value is None:
+            return None
+        if kind == "s":
+            return self.shared_string(int(value))
+        if kind == "b":
+            return bool(int(value))
+        if kind == "n":
+            return numeric_value(value)
+        return value
+    
+    def set_value(self, sheet, row, column, value, font=None):
+        """Record `value` (and `font`, if given) for a cell; nothing is written until save()."""
+        if sheet not in self.sheet_paths:
+            raise KeyError(sheet)
+        if isinstance(value, str):
+            if ILLEGAL_CHARACTERS_RE.search(value) or len(value) > 32767:
+                raise XlsxPatchUnsupported(f"value for row {row} needs openpyxl's string handling")
+        elif isinstance(value, float):
+            if value != value or value in (float("inf"), float("-inf")):
+                raise XlsxPatchUnsupported(f"row {row} value {value} cannot be stored")
+        elif value is not None and not isinstance(value, (bool, int)):
+            raise XlsxPatchUnsupported(f"cannot write {type(value).__name__} values directly")
+        self.changes.setdefault(sheet, {})[row, column] = (value, font)
+    
+    def save(self):
+        """The package's bytes with every recorded cell written."""
+        if not self.changes:
+            return self.source
+        self.new_strings = {}  # text -> shared string index
+        self.string_references = 0
+        self.styles = None
+        self.font_ids = {}
+        self.restyled = {}
+        self.formulas_overwritten = False
+        replaced = {}
+        for sheet, cells in self.changes.items():
+            path = self.sheet_paths[sheet]
+            replaced[path] = self.patch_sheet(self.zip.read(path).decode("utf-8"), cells).encode("utf-8")
+        if self.new_strings:
+            replaced[self.parts["sharedStrings"]] = self.append_shared_strings().encode("utf-8")
+        if self.styles is not None:
+            replaced[self.parts["styles"]] = self.styles.encode("utf-8")
+        replaced[self.workbook_path] = self.full_calc_on_load(self.zip.read(self.workbook_path).decode("utf-8")).encode("utf-8")
+        
+        dropped = set()
+        if self.formulas_overwritten and "calcChain" in self.parts:
+            # The calculation chain lists formula cells; Excel rebuilds it when it is missing
+            dropped.add(self.parts["calcChain"])
+            rels = self.zip.read(self.workbook_rels_path).decode("utf-8")
+            replaced[self.workbook_rels_path] = re.sub(r'<Relationship\b[^>]*?calcChain"[^>]*?/>', '', rels).encode("utf-8")
+            content_types = self.zip.read("[Content_Types].xml").decode("utf-8")
+            part_name = re.escape(f'/{self.parts["calcChain"]}')
+            replaced["[Content_Types].xml"] = re.sub(rf'<Override\b[^>]*?PartName="{part_name}"[^>]*?/>', '', content_types).encode("utf-8")
+        
+        output = BytesIO()
+        with zipfile.ZipFile(output, "w") as package:
+            for info in self.zip.infolist():
+                if info.filename in dropped:
+                    continue
+                entry = zipfile.ZipInfo(info.filename, info.date_time)
+                entry.compress_type = info.compress_type
+                entry.external_attr = info.external_attr
+                package.writestr(entry, replaced.get(info.filename) or self.zip.read(info))
+        return output.getvalue()
+    
+    def patch_sheet(self, xml, cells):
+        data_start = xml.find("<sheetData")
+        if data_start < 0:
+            raise XlsxPatchUnsupported("worksheet XML without a plain <sheetData>")
+        if xml.startswith("<sheetData/>", data_start):
+            xml = f"{xml[:data_start]}<sheetData></sheetData>{xml[data_start + len('<sheetData/>'):]}"
+        data_end = xml.index("</sheetData>", data_start)
+        
+        starts = []  # (row number, offset of its start tag), in sheet order
+        for match in SHEET_ROW_RE.finditer(xml, data_start, data_end):
+            number = xml_attribute(match.group(0), "r")
+            if number is None:
+                raise XlsxPatchUnsupported("worksheet rows without row numbers")
+            starts.append((int(number), match.start()))
+        rows = dict(starts)
+        
+        by_row = {}
+        for (row, column), write in cells.items():
+            by_row.setdefault(row, {})[column] = write
+        
+        edits = []  # (start, end, replacement), applied back to front
+        for row, writes in by_row.items():
+            if row in rows:
+                start = rows[row]
+                end = xml.index(">", start) + 1
+                if xml[end - 2] != "/":
+                    end = xml.index("</row>", end) + len("</row>")
+                edits.append((start, end, row, self.patch_row(xml[start:end], row, writes)))
+            else:
+                later = next((start for number, start in starts if number > row), data_end)
+                edits.append((later, later, row, self.patch_row(f'<row r="{row}"/>', row, writes)))
+        # Back to front; new rows inserted at the same spot go highest first so they end up ascending
+        for start, end, row, replacement in sorted(edits, reverse=True):
+            xml = xml[:start] + replacement + xml[end:]
+        return xml
+    
+    def patch_row(self, row_xml, row, writes):
+        if row_xml.endswith("/>"):
+            row_xml = f"{row_xml[:-2].rstrip()}></row>"
+        start_tag_end = row_xml.index(">") + 1
+        cells = {column_index_from_string(match.group(1)): match for match in SHEET_CELL_RE.finditer(row_xml, start_tag_end)}
+        if len(cells) != len(re.findall(r'<c[\s>/]', row_xml[start_tag_end:])):
+            raise XlsxPatchUnsupported(f"row {row} has cells without references")
+        
+        edits = []
+        added = False
+        for column, (value, font) in writes.items():
+            ref = f"{get_column_letter(column)}{row}"
+            if column in cells:
+                old = cells[column].group(0)
+                start_tag = old[:old.index(">") + 1]
+                if "<f" in old:
+                    formula_tag = old[old.index("<f"):]
+                    if xml_attribute(formula_tag, "t") in ("shared", "array") and xml_attribute(formula_tag, "ref"):
+                        raise XlsxPatchUnsupported(f"{ref} anchors a shared or array formula")
+                    self.formulas_overwritten = True
+                style = int(xml_attribute(start_tag, "s") or 0)
+                edits.append((cells[column].start(), cells[column].end(), column, self.cell_xml(ref, value, self.restyle(style, font))))
+            else:
+                later = min((match.start() for number, match in cells.items() if number > column), default=len(row_xml) - len("</row>"))
+                edits.append((later, later, column, self.cell_xml(ref, value, self.restyle(0, font))))
+                added = True
+        for start, end, column, replacement in sorted(edits, reverse=True):
+            row_xml = row_xml[:start] + replacement + row_xml[end:]
+        if added:
+            # spans is only a hint; drop it rather than keep one that misses the new cell
+            row_xml = re.sub(r'^(<row\b[^>]*?)\sspans="[^"]*"', r'\1', row_xml)
+        return row_xml
+    
+    def cell_xml(self, ref, value, style):
+        attributes = f' r="{ref}"' + (f' s="{style}"' if style else "")
+        if value is None:
+            return f"<c{attributes}/>"
+        if isinstance(value, bool):
+            return f'<c{attributes} t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)):
+            return f"<c{attributes}><v>{value!r}</v></c>"
+        if len(value) > 1 and value.startswith("="):
+            return f"<c{attributes}><f>{escape(value[1:])}</f></c>"
+        if "sharedStrings" not in self.parts:
+            return f'<c{attributes} t="inlineStr"><is>{text_xml(value)}</is></c>'
+        self.string_references += 1
+        index = self.new_strings.setdefault(value, self.shared_string_count + len(self.new_strings))
+        return f'<c{attributes} t="s"><v>{index}</v></c>'
+    
+    @functools.cached_property
+    def shared_string_count(self):
+        strings = self.zip.read(self.parts["sharedStrings"]).decode("utf-8")
+        return len(re.findall(r'<si[\s>/]', strings))
+    
+    def append_shared_strings(self):
+        strings = self.zip.read(self.parts["sharedStrings"]).decode("utf-8")
+        end = strings.rfind("</sst>")
+        if end < 0:
+            raise XlsxPatchUnsupported("sharedStrings.xml without a plain <sst>")
+        strings = strings[:end] + "".join(f"<si>{text_xml(text)}</si>" for text in self.new_strings) + strings[end:]
+        header_end = strings.index("<sst")
+        header = strings[header_end:strings.index(">", header_end) + 1]
+        patched = set_xml_attribute(header, "uniqueCount", self.shared_string_count + len(self.new_strings))
+        count = xml_attribute(header, "count")
+        if count is not None:
+            patched = set_xml_attribute(patched, "count", int(count) + self.string_references)
+        return strings[:header_end] + patched + strings[header_end + len(header):]
+    
+    def restyle(self, style, font):
+        """The cellXfs index of format `style` with its font replaced by `font` (`style` itself if None)."""
+        if font is None:
+            return style
+        font_xml = tostring(font.to_tree()).decode("utf-8")
+        if (style, font_xml) in self.restyled:
+            return self.restyled[style, font_xml]
+        if self.styles is None:
+            self.styles = self.zip.read(self.parts["styles"]).decode("utf-8")
+        
+        fonts = re.search(r'<fonts\b[^>]*?>.*?</fonts>', self.styles, re.S)
+        formats = re.search(r'<cellXfs\b[^>]*?>.*?</cellXfs>', self.styles, re.S)
+        if fonts is None or formats is None:
+            raise XlsxPatchUnsupported("styles.xml without plain <fonts> and <cellXfs>")
+        xfs = STYLE_XF_RE.findall(formats.group(0))
+        if style >= len(xfs):
+            raise XlsxPatchUnsupported(f"cell format {style} is not in styles.xml")
+        new_fonts = fonts.group(0)
+        if font_xml not in self.font_ids:
+            self.font_ids[font_xml] = len(FONT_START_RE.findall(new_fonts))
+            new_fonts = set_xml_attribute(new_fonts.replace("</fonts>", f"{font_xml}</fonts>"), "count", self.font_ids[font_xml] + 1)
+        new_xf = set_xml_attribute(set_xml_attribute(xfs[style], "fontId", self.font_ids[font_xml]), "applyFont", 1)
+        
+        new_formats = set_xml_attribute(formats.group(0).replace("</cellXfs>", f"{new_xf}</cellXfs>"), "count", len(xfs) + 1)
+        # cellXfs follows fonts in the stylesheet
+        self.styles = (self.styles[:fonts.start()] + new_fonts + self.styles[fonts.end():formats.start()]
+                       + new_formats + self.styles[formats.end():])
+        self.restyled[style, font_xml] = len(xfs)
+        return len(xfs)
+    
+    def full_calc_on_load(self, workbook):
+        """workbook.xml asking Excel to recalculate every formula when the file is opened."""
+        calc = re.search(r'<calcPr\b[^>]*?/?>', workbook)
+        if calc:
+            return workbook[:calc.start()] + set_xml_attribute(calc.group(0), "fullCalcOnLoad", 1) + workbook[calc.end():]
+        position = AFTER_CALC_PR_RE.search(workbook)
+        if position is None:
+            raise XlsxPatchUnsupported("workbook.xml without a plain <workbook>")
+        return f'{workbook[:position.start()]}<calcPr fullCalcOnLoad="1"/>{workbook[position.start():]}'
+
+
+class WorkbookSession:
+    """The master workbook, shared by every PDF of a batch.
+    
+    Until something needs openpyxl the session works on an XlsxCellPatch:
+    lookups read through `reader` and `write_cells` records cell values,
+    so a batch of updates never loads or re-serializes the whole workbook.
+    The first insert (or anything the patch engine cannot handle) loads
+    `wb` with the patched cells already in it, and from then on every
+    write goes through openpyxl; `save()` serializes once at the end
+    either way. `original` keeps the uploaded bytes as the backup. Each
+    successful write is recorded so a write that fails halfway can be
+    undone by starting over from the original and replaying the writes
+    before it.
+    
+    Nothing touches the disk: the workbook is parsed straight from the
+    upload's buffer and saved into a buffer the session reuses.
+    """
+    
+    def __init__(self, excel_file):
+        # An uploaded file's getvalue() hands back its bytes without copying them
+        self.original = excel_file.getvalue() if hasattr(excel_file, "getvalue") else excel_file.read()
+        self.writes = []
+        self.buffer = BytesIO()
+        self.start()
+    
+    def start(self):
+        self.row_plans = {}
+        self.templates = {}  # (sheet, column, config fingerprint) -> TemplateColumn
+        self._wb = None
+        try:
+            self.patch = XlsxCellPatch(self.original)
+            # Reading the first sheet's top rows now sends odd files to openpyxl before any lookup
+            if self.patch.sheetnames:
+                self.patch[self.patch.sheetnames[0]].max_row
+        except (XlsxPatchUnsupported, KeyError, ValueError, ET.ParseError):
+            self.patch = None
+            self._wb = self.load(self.original)
+    
+    @staticmethod
+    def load(excel_content):
+        return load_workbook(BytesIO(excel_content))
+    
+    @property
+    def wb(self):
+        """The openpyxl workbook, loaded (with any patched cells) on first use."""
+        if self._wb is None:
+            self.use_openpyxl()
+        return self._wb
+    
+    @property
+    def reader(self):
+        """What lookups read: the patch engine's sheets until `wb` is loaded, then `wb`."""
+        return self.patch if self.patch is not None else self.wb
+    
+    def use_openpyxl(self):
+        """Move from cell patching to an openpyxl workbook holding the same changes."""
+        try:
+            content = self.patch.save()
+        except (XlsxPatchUnsupported, KeyError, ValueError) as e:
+            st.write(f"⚠️ **Loading the full workbook**: {e}")
+            content = None
+        self.patch = None
+        self._wb = self.load(self.original if content is None else content)
+        if content is None:
+            for write, args in self.writes:
+                write(self, *args)
+    
+    def write_cells(self, sheet, cells):
+        """Set [(row, column, value, font or None)] on `sheet`, patching the XML while no openpyxl workbook is loaded."""
+        if self.patch is not None:
+            try:
+                for row, column, value, font in cells:
+                    self.patch.set_value(sheet, row, column, value, font)
+                return
+            except XlsxPatchUnsupported as e:
+                st.write(f"⚠️ **Loading the full workbook**: {e}")
+                self.use_openpyxl()
+        ws = self.wb[sheet]
+        for row, column, value, font in cells:
+            cell = ws.cell(row=row, column=column)
+            cell.value = value
+            if font is not None:
+                cell.font = font
+    
+    def apply(self, write, *args):
+        """Run write(self, *args), which returns its list of updates or None on failure."""
+        updates = write(self, *args)
+        if updates is None:
+            self.rollback()
+        else:
+            self.writes.append((write, args))
+        return updates
+    
+    def columns_moved(self, sheet, destinations):
+        """Keep template snapshots keyed on where their columns moved to ({old column: new column})."""
+        self.templates = {
+            (name, destinations.get(column, column) if name == sheet else column, version): template
+            for (name, column, version), template in self.templates.items()
+        }
+    
+    def column_changed(self, sheet, column):
+        """Drop template snapshots of a column that was just written to."""
+        self.templates = {key: template for key, template in self.templates.items() if key[:2] != (sheet, column)}
+    
+    def rollback(self):
+        self.start()
+        writes, self.writes = self.writes, []
+        for write, args in writes:
+            self.apply(write, *args)
+    
+    def save(self):
+        """The workbook's bytes with every write applied (the original bytes if there were none)."""
+        if not self.writes:
+            return self.original
+        if self.patch is not None:
+            try:
+                return self.patch.save()
+            except (XlsxPatchUnsupported, KeyError, ValueError):
+                self.use_openpyxl()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.wb.save(self.buffer)
+        return self.buffer.getvalue()
+
+
+class StreamingProgress:
+    """What extract_text_streaming has resolved so far, updated one page at a time.
+    
+    Each new page is looked at once, on its own: its tokens and verbatim
+    model names feed model identification, and only the core fields and
+    upgrades still missing are searched for in it. A field counts only when
+    a pattern matched it, never when it was filled in by default. Should a
+    later page change the identified model, the pages read so far are
+    searched again for the new model's fields.
+    """
+    
+    def __init__(self, platform):
+        self.platform = platform
+        self.index = platform.get_model_index()
+        self.pages = []
+        self.tokens = set()
+        self.named = set()  # models whose whole name appears verbatim
+        self.aircraft_model = None
+        self.fields = set()
+        self.upgrades = set()
+    
+    def config(self):
+        config = st.session_state.configurations.get(self.aircraft_model)
+        return config if isinstance(config, dict) else None
+    
+    def core_fields(self, config):
+        return {field for field in config.get("row_mappings", {}) if field in FIELD_PATTERNS}
+    
+    def add_page(self, page_text):
+        """Record one more page of lowercased text."""
+        self.pages.append(page_text)
+        self.tokens |= document_tokens(page_text)
+        # Model names hold no newline, so one never spans two pages
+        self.named.update(model_name for model_name in self.index.signatures if model_name.lower() in page_text)
+        ranked = self.index.rank_tokens(self.tokens, self.named.__contains__)
+        aircraft_model = ranked[0][0] if ranked and ranked[0][1] >= MODEL_MATCH_THRESHOLD else None
+        if aircraft_model == self.aircraft_model:
+            self.search(page_text)
+            return
+        self.aircraft_model = aircraft_model
+        self.fields = set()
+        self.upgrades = set()
+        for text in self.pages:
+            self.search(text)
+    
+    def search(self, page_text):
+        config = self.config()
+        if config is None:
+            return
+        missing = self.core_fields(config) - self.fields
+        if missing:
+            extracted_data = self.platform.extract_data_from_pdf(page_text, self.aircraft_model, verbose=False, fields=missing)
+            self.fields.update(field for field in missing if field in extracted_data)
+        if len(self.upgrades) < len(config.get("upgrades", {})):
+            self.upgrades.update(self.platform.get_upgrade_matcher(self.aircraft_model, config).find(page_text))
+    
+    def complete(self):
+        """True when reading more pages cannot change what gets written for this PDF."""
+        config = self.config()
+        if config is None or self.core_fields(config) - self.fields:
+            return False
+        if self.upgrades >= set(config.get("upgrades", {})):
+            return True
+        page_budget = config.get("page_budget")
+        return bool(page_budget) and len(self.pages) >= page_budget
+
+
+class CompletePlatform:
+    def __init__(self):
+        if 'configurations' not in st.session_state:
+            st.session_state.configurations = {}
+        if 'custom_upgrades' not in st.session_state:
+            st.session_state.custom_upgrades = []
+        if 'config_caches' not in st.session_state:
+            st.session_state.config_caches = {}
+        if 'extraction_stats' not in st.session_state:
+            st.session_state.extraction_stats = {}
+        if 'processing_ledger' not in st.session_state:
+            st.session_state.processing_ledger = ProcessingLedger(PROCESSING_LEDGER_PATH, PROCESSING_LEDGER_MAX_ENTRIES)
+        if 'duplicate_index' not in st.session_state:
+            st.session_state.duplicate_index = NearDuplicateIndex(NEAR_DUPLICATE_INDEX_PATH, NEAR_DUPLICATE_MAX_RECORDS)
+        self.text_cache = PdfTextCache(TEXT_CACHE_DIR, TEXT_CACHE_MAX_BYTES)
+    
+    def extract_text_from_pdf(self, pdf_file, workers=None, backend=None):
+        if workers is None:
+            workers = st.session_state.get('pdf_extract_workers', PDF_EXTRACT_WORKERS)
+        if backend is None:
+            backend = st.session_state.get('pdf_text_backend', PDF_TEXT_BACKEND)
         try:
-            with pdfplumber.open(pdf_file) as pdf:
-                full_text = "\n".join(page.extract_text() or '' for page in pdf.pages)
-            return full_text.lower()
+            pdf_bytes = pdf_file.read()
+            pdf_file.seek(0)
+            
+            chain = text_backend_chain(backend)
+            cache_key = self.text_cache.key(pdf_bytes, "|".join(b.version() for b in chain))
+            cached_text = self.text_cache.get(cache_key)
+            if cached_text is not None:
+                return cached_text
+            
+            # Each backend counts its pages into its own stats; only the pages
+            # behind the returned text are added to the run stats
+            stats = self.start_document_stats()
+            attempts = {}
+            result = None
+            for position, text_backend in enumerate(chain):
+                attempt_stats = {"document_peak_rss": stats["document_peak_rss"]}
+                text = text_backend.extract(pdf_bytes, workers, attempt_stats)
+                stats["document_peak_rss"] = attempt_stats["document_peak_rss"]
+                attempts[text_backend.name] = (text, attempt_stats)
+                if text_looks_usable(text):
+                    result = attempts[text_backend.name]
+                    break
+                if position + 1 < len(chain):
+                    st.write(f"⚠️ **{text_backend.name} text unusable, falling back to {chain[position + 1].name}**")
+            full_text, attempt_stats = result or attempts["pdfplumber"]
+            merge_page_counts(stats, attempt_stats)
+            self.report_document_memory(stats)
+            
+            full_text = full_text.lower()
+            self.text_cache.put(cache_key, full_text)
+            return full_text
         except Exception as e:
             st.error(f"Error reading PDF: {e}")
             return ""
     
+    def pinned_text_backend(self, pdf_file):
+        """The "text_backend" pinned by the model identified from the PDF's first page, or None.
+        
+        Lets a model's own backend be used for the one extraction, streaming
+        or not. Only probes when some configured model pins a backend.
+        """
+        configurations = st.session_state.configurations
+        pinned = {model for model, config in configurations.items() if isinstance(config, dict) and config.get("text_backend")}
+        if not pinned:
+            return None
+        try:
+            pdf_bytes = pdf_file.read()
+            pdf_file.seek(0)
+            first_page = next(iter_page_windows(pdf_bytes, 0, 1), None) or ''
+        except Exception:
+            return None
+        aircraft_model = self.identify_aircraft_from_pdf(first_page.lower(), verbose=False)
+        return configurations[aircraft_model]["text_backend"] if aircraft_model in pinned else None
+    
+    def extract_text_streaming(self, pdf_file, workers=None, backend=None):
+        """Extract text page by page, stopping as soon as nothing more is needed; return (text, complete).
+        
+        Uses the same backend chain and worker setting as extract_text_from_pdf.
+        Each page is looked at once, on its own (see StreamingProgress).
+        Reading stops once every configured core field has a pattern match and
+        either every upgrade has been found or the model's "page_budget" is
+        spent. `complete` is False when pages were left unread; only complete
+        documents are written to the text cache.
+        """
+        if workers is None:
+            workers = st.session_state.get('pdf_extract_workers', PDF_EXTRACT_WORKERS)
+        if backend is None:
+            backend = st.session_state.get('pdf_text_backend', PDF_TEXT_BACKEND)
+        try:
+            pdf_bytes = pdf_file.read()
+            pdf_file.seek(0)
+            
+            chain = text_backend_chain(backend)
+            cache_key = self.text_cache.key(pdf_bytes, "|".join(b.version() for b in chain))
+            cached_text = self.text_cache.get(cache_key)
+            if cached_text is not None:
+                return cached_text, True
+            
+            stats = self.start_document_stats()
+            pages = self.streaming_pages(chain, pdf_bytes, workers, stats)
+            progress = StreamingProgress(self)
+            try:
+                for page_text in pages:
+                    progress.add_page(page_text.lower())
+                    if progress.complete():
+                        st.write(f"⏩ **Stopped reading after page {len(progress.pages)}**: all configured fields resolved")
+                        return "\n".join(progress.pages), False
+            finally:
+                pages.close()
+                self.report_document_memory(stats)
+            
+            full_text = "\n".join(progress.pages)
+            self.text_cache.put(cache_key, full_text)
+            return full_text, True
+        except Exception as e:
+            st.error(f"Error reading PDF: {e}")
+            return "", False
+    
+    def streaming_pages(self, chain, pdf_bytes, workers, stats):
+        """Yield pages for extract_text_streaming from the first backend in the chain whose text is usable.
+        
+        Only pdftotext-based backends come before pdfplumber, and they read
+        the whole document in one run anyway, so their pages are checked with
+        text_looks_usable before any is handed out. The last backend is never
+        checked and streams lazily.
+        """
+        for position, text_backend in enumerate(chain[:-1]):
+            attempt_stats = {"document_peak_rss": stats["document_peak_rss"]}
+            page_texts = list(text_backend.iter_pages(pdf_bytes, workers, attempt_stats))
+            stats["document_peak_rss"] = attempt_stats["document_peak_rss"]
+            if text_looks_usable("\n".join(page_texts)):
+                merge_page_counts(stats, attempt_stats)
+                yield from page_texts
+                return
+            st.write(f"⚠️ **{text_backend.name} text unusable, falling back to {chain[position + 1].name}**")
+        yield from chain[-1].iter_pages(pdf_bytes, workers, stats)
+    
+    def start_document_stats(self):
+        """Reset the per-document memory peak in the run stats and return the stats dict."""
+        stats = st.session_state.extraction_stats
+        stats["document_peak_rss"] = current_rss()
+        return stats
+    
+    def report_document_memory(self, stats):
+        """Show the peak resident memory seen while extracting the current document."""
+        peak = stats.get("document_peak_rss", 0)
+        stats["peak_rss"] = max(stats.get("peak_rss", 0), peak)
+        st.write(f"🧠 **Peak memory during extraction**: {peak / 2**20:.0f} MB")
+    
+    def find_near_duplicate(self, pdf_text):
+        """Flag a PDF whose text nearly matches one processed before; return (signature, best match or None)."""
+        signature = minhash_signature(pdf_text)
+        matches = st.session_state.duplicate_index.query(signature)
+        if not matches:
+            return signature, None
+        
+        similarity, record = matches[0]
+        st.warning(
+            f"♻️ **Near-duplicate ({similarity:.0%} similar)** of {record['pdf_name']} "
+            f"(S/N {record['serial']}, {record['broker']}, {record['model']})"
+        )
+        return signature, record
+    
+    def reusable_extraction(self, record):
+        """The record's (aircraft_model, extracted_data) if its model config is unchanged since, else None."""
+        config = st.session_state.configurations.get(record.get("model"))
+        if not isinstance(config, dict) or record.get("config_version") != config_fingerprint(config):
+            return None
+        return record["model"], dict(record["extracted_data"])
+    
+    def remember_extraction(self, pdf_text, signature, detail, aircraft_model, extracted_data):
+        """Add a processed PDF to the near-duplicate index."""
+        st.session_state.duplicate_index.add(
+            hashlib.sha256(pdf_text.encode("utf-8")).hexdigest(), signature,
+            pdf_name=detail.get('name', detail['pdf'].name),
+            serial=detail["serial"],
+            broker=detail["broker"],
+            model=aircraft_model,
+            config_version=config_fingerprint(st.session_state.configurations[aircraft_model]),
+            extracted_data=dict(extracted_data)
+        )
+    
+    def ledger_key(self, detail):
+        """The processing ledger key for one PDF entry of a batch."""
+        pdf_bytes = detail['pdf'].read()
+        detail['pdf'].seek(0)
+        return ProcessingLedger.key(hashlib.sha256(pdf_bytes).hexdigest(), detail["serial"], detail["broker"])
+    
+    def already_applied(self, workbook, extracted_data, aircraft_model, broker_info):
+        """True if the serial's existing column already holds exactly what update_existing_row would write."""
+        if broker_info['mode'] != 'update':
+            return False
+        try:
+            ws = workbook.reader[broker_info['sheet']]
+            target_col = broker_info['column']
+            config = st.session_state.configurations[aircraft_model]
+            
+            broker_row = self.find_broker_row(ws)
+            if ws.cell(row=broker_row, column=target_col).value != broker_info['broker'].upper():
+                return False
+            for field, row_num in config.get("row_mappings", {}).items():
+                if field in extracted_data and row_num != 1 and ws.cell(row=row_num, column=target_col).value != extracted_data[field]:
+                    return False
+            for upgrade_name, upgrade_config in config.get("upgrades", {}).items():
+                upgrade_key = f"upgrade_{upgrade_name}"
+                row_num = upgrade_config.get("row")
+                if upgrade_key in extracted_data and row_num and row_num != 1:
+                    if ws.cell(row=row_num, column=target_col + 1).value != extracted_data[upgrade_key]:
+                        return False
+            return True
+        except Exception:
+            return False
+    
+    def generate_keyword_variations(self, base_keyword, synonyms=None):
+        """Generate common variations of a keyword (memoized per synonym table)"""
+        if synonyms is None:
+            synonyms = load_keyword_synonyms(KEYWORD_SYNONYMS_FILE)
+        return list(synonyms.variations(base_keyword))
+    
     def analyze_excel_for_new_model(self, excel_file):
         try:
             wb = load_workbook(excel_file)
@@ -399,6 +2807,15 @@ class CompletePlatform:
                 )
                 field_mappings[field_key] = int(row_input)
         
+        st.session_state.temp_page_budget = st.number_input(
+            "Upgrade page budget (0 = search every page):",
+            min_value=0,
+            max_value=500,
+            value=0,
+            key="page_budget",
+            help="When streaming, stop looking for missing upgrades after this many pages"
+        )
+        
         st.write("## 🔧 Upgrades Mapping")
         
         # Display avionics section info if found
@@ -503,44 +2920,193 @@ class CompletePlatform:
                 "avionics_section": st.session_state.get('temp_avionics_section', {})
             }
         }
+        if st.session_state.get('temp_page_budget'):
+            config[aircraft_model]["page_budget"] = int(st.session_state.temp_page_budget)
         return config
     
-    def identify_aircraft_from_pdf(self, pdf_text):
-        st.write(f"🔍 **Aircraft Model Debug**: Looking for matches in PDF")
-        st.write(f"📋 **Configured models**: {list(st.session_state.configurations.keys())}")
+    def get_model_index(self):
+        """Return the ModelIndex for the configured models, rebuilt only when the set of models changes."""
+        model_names = tuple(sorted(st.session_state.configurations))
+        cached = st.session_state.config_caches.get("model_index")
+        if cached and cached[0] == model_names:
+            return cached[1]
+        model_index = ModelIndex(model_names)
+        st.session_state.config_caches["model_index"] = (model_names, model_index)
+        return model_index
+    
+    def identify_aircraft_from_pdf(self, pdf_text, verbose=True):
+        write = st.write if verbose else (lambda *args, **kwargs: None)
+        
+        write(f"🔍 **Aircraft Model Debug**: Looking for matches in PDF")
+        write(f"📋 **Configured models**: {list(st.session_state.configurations.keys())}")
+        
+        ranked = self.get_model_index().rank(pdf_text)
+        if len(ranked) > 1:
+            write("🏁 **Model scores**: " + ", ".join(f"{model_name} {score:.2f}" for model_name, score, _ in ranked[:5]))
+        
+        if ranked and ranked[0][1] >= MODEL_MATCH_THRESHOLD:
+            model_name, _, reason = ranked[0]
+            write(f"✅ **{reason}**: {model_name}")
+            return model_name
+        
+        write("❌ **No aircraft model matches found**")
+        return None
+    
+    def get_cached_for_config(self, cache_name, aircraft_model, config, build):
+        """Return build(config) from the named per-model cache, rebuilding it only when the config changes."""
+        fingerprint = config_fingerprint(config)
+        cache = st.session_state.config_caches.setdefault(cache_name, {})
+        cached = cache.get(aircraft_model)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        
+        value = build(config)
+        cache[aircraft_model] = (fingerprint, value)
+        return value
+    
+    def get_field_scanner(self, aircraft_model, config):
+        """Return the compiled field scanner for a model.
+        
+        Configs may add their own patterns under "field_patterns" ({field: [regex, ...]});
+        these are tried after the built-in ones.
+        """
+        def build(config):
+            field_patterns = {field: list(patterns) for field, patterns in FIELD_PATTERNS.items()}
+            for field, patterns in config.get("field_patterns", {}).items():
+                field_patterns.setdefault(field, []).extend(patterns)
+            return CompiledFieldScanner(field_patterns)
+        
+        return self.get_cached_for_config("field_scanner", aircraft_model, config, build)
+    
+    def get_keyword_synonyms(self, aircraft_model, config):
+        """Return the synonym table for a model: the shared file plus the config's "keyword_synonyms"."""
+        synonyms = load_keyword_synonyms(KEYWORD_SYNONYMS_FILE)
+        if not config.get("keyword_synonyms"):
+            return synonyms
+        return self.get_cached_for_config(
+            "keyword_synonyms", aircraft_model, config,
+            lambda config: synonyms.extended(config["keyword_synonyms"])
+        )
+    
+    def get_upgrade_matcher(self, aircraft_model, config):
+        """Return the keyword matcher for a model's upgrades, keyword variations included."""
+        synonyms = self.get_keyword_synonyms(aircraft_model, config)
+        return self.get_cached_for_config(
+            "upgrade_matcher", aircraft_model, config,
+            lambda config: UpgradeMatcher(
+                config.get("upgrades", {}), lambda keyword: self.generate_keyword_variations(keyword, synonyms)
+            )
+        )
+    
+    def get_region_template(self, config, broker_name):
+        """The config's region template for a broker ("*" matches any broker), or None."""
+        templates = config.get("region_templates") or {}
+        broker_key = (broker_name or "").strip().lower()
+        for name, regions in templates.items():
+            if name.strip().lower() == broker_key:
+                return regions
+        return templates.get("*")
+    
+    def extract_with_template(self, pdf_file, broker_name):
+        """Read fields straight from the cropped regions of a per-model, per-broker template.
+        
+        Templates live in the model configuration under "region_templates",
+        keyed by broker name ("*" for any broker), e.g.
+        
+            "region_templates": {"FlyAlliance": [
+                {"page": 0, "bbox": [40, 30, 560, 60], "field": "model"},
+                {"page": 0, "bbox": [380, 96, 560, 112], "field": "serial_number"},
+                {"page": 1, "bbox": [40, 200, 560, 240], "field": "total_hours", "pattern": "ttaf[:\\s]*([\\d,]+)"},
+                {"page": 2, "bbox": null, "field": "upgrades"}
+            ]}
+        
+        "page" is 0-based and "bbox" is (x0, top, x1, bottom) in PDF points, or
+        null for the whole page; only characters entirely inside the box are
+        read. An optional "pattern" picks group 1 out of the region text.
+        "model" regions must identify this model, and "upgrades" regions are
+        searched for the upgrade keywords (one is required when the model has
+        upgrades).
+        
+        Returns (aircraft_model, extracted_data) on a hit, or None when no
+        template applies or any region misses, so the caller can fall back to
+        full-text extraction.
+        """
+        candidates = []
+        for aircraft_model, config in st.session_state.configurations.items():
+            regions = self.get_region_template(config, broker_name) if isinstance(config, dict) else None
+            if regions:
+                candidates.append((aircraft_model, config, regions))
+        if not candidates:
+            return None
+        
+        try:
+            pdf_bytes = pdf_file.read()
+            pdf_file.seek(0)
+            with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+                for aircraft_model, config, regions in candidates:
+                    extracted_data = self.read_template_regions(pdf, aircraft_model, config, regions)
+                    if extracted_data is not None:
+                        st.write(f"📐 **Template hit**: {aircraft_model} / {broker_name} ({len(regions)} regions read)")
+                        stats = st.session_state.extraction_stats
+                        stats["template_hits"] = stats.get("template_hits", 0) + 1
+                        return aircraft_model, extracted_data
+        except Exception as e:
+            st.warning(f"⚠️ Template extraction failed ({e}), using full-text extraction")
+            return None
+        
+        st.write(f"📐 **No template matched for {broker_name}**, using full-text extraction")
+        return None
+    
+    def read_template_regions(self, pdf, aircraft_model, config, regions):
+        """Extracted data for one template, or None as soon as a region misses."""
+        if config.get("upgrades") and not any(region.get("field") == "upgrades" for region in regions):
+            return None
         
-        for model_name in st.session_state.configurations.keys():
-            
-            if model_name.lower() in pdf_text:
-                st.write(f"✅ **Direct match found**: {model_name}")
-                return model_name
-            
-            model_words = model_name.lower().split()
+        extracted_data = {}
+        upgrade_texts = []
+        for region in regions:
+            page_index = region.get("page", 0)
+            if not 0 <= page_index < len(pdf.pages):
+                return None
+            page = pdf.pages[page_index]
+            bbox = region.get("bbox")
+            text = ((page.within_bbox(tuple(bbox)) if bbox else page).extract_text() or "").lower()
             
-            if "excel" in model_name.lower():
-                if "citation" in pdf_text and "excel" in pdf_text:
-                    st.write(f"✅ **Citation Excel match found**: {model_name}")
-                    return model_name
-                elif "excel" in pdf_text:
-                    st.write(f"✅ **Excel match found**: {model_name}")
-                    return model_name
+            if region.get("pattern"):
+                match = re.search(region["pattern"], text)
+                if not match:
+                    return None
+                text = match.group(1) if match.groups() else match.group(0)
             
-            if len(model_words) >= 2:
-                matches = []
-                for word in model_words:
-                    if word not in ["-", "master", "for", "sale"] and len(word) > 2:
-                        if word in pdf_text:
-                            matches.append(word)
-                
-                important_words = [w for w in model_words if w not in ["-", "master", "for", "sale"] and len(w) > 2]
-                if len(matches) >= len(important_words) * 0.6:
-                    st.write(f"✅ **Partial match found**: {model_name} (matched {len(matches)}/{len(important_words)} words)")
-                    return model_name
+            field = region.get("field")
+            if field == "model":
+                if self.identify_aircraft_from_pdf(text, verbose=False) != aircraft_model:
+                    return None
+            elif field == "upgrades":
+                upgrade_texts.append(text)
+            else:
+                value = parse_region_value(field, text)
+                if value is None:
+                    return None
+                extracted_data[field] = value
         
-        st.write("❌ **No aircraft model matches found**")
-        return None
+        if "engine_overhaul" not in extracted_data and "total_hours" in extracted_data:
+            extracted_data["engine_overhaul"] = extracted_data["total_hours"]
+        
+        upgrade_hits = self.get_upgrade_matcher(aircraft_model, config).find("\n".join(upgrade_texts))
+        for upgrade_name in config.get("upgrades", {}):
+            extracted_data[f"upgrade_{upgrade_name}"] = "Y" if upgrade_name in upgrade_hits else "N"
+        return extracted_data
     
-    def extract_data_from_pdf(self, pdf_text, aircraft_model):
+    def extract_data_from_pdf(self, pdf_text, aircraft_model, verbose=True, fields=None):
+        """Extract the configured fields and upgrades from PDF text.
+        
+        With `fields`, only those fields are looked for, upgrades are skipped
+        and nothing is filled in by default, so every value returned comes
+        from a pattern match (extract_text_streaming relies on this).
+        """
+        write = st.write if verbose else (lambda *args, **kwargs: None)
+        
         config = st.session_state.configurations.get(aircraft_model)
         if not config or not isinstance(config, dict):
             st.error(f"❌ Invalid or missing configuration for {aircraft_model}")
@@ -549,364 +3115,199 @@ class CompletePlatform:
         extracted_data = {}
         row_mappings = config.get("row_mappings", {})
         
-        st.write("🔍 **Starting PDF data extraction...**")
-        st.write(f"📋 **Configured fields**: {list(row_mappings.keys())}")
+        write("🔍 **Starting PDF data extraction...**")
+        write(f"📋 **Configured fields**: {list(row_mappings.keys())}")
+        
+        scanner = self.get_field_scanner(aircraft_model, config)
+        hardened = st.session_state.get('regex_hardened', True)
+        if fields is not None:
+            fields = set(fields) | ({"engine_total_hours"} if "total_hours" in fields else set())
+        scan = scanner.scan(pdf_text, hardened=hardened, fields=fields)
+        sections = segment_sections(pdf_text)
+        write(f"🗂️ **Sections found**: {', '.join(sections.ranges) or 'none'}")
         
         # Extract Serial Number
-        serial_patterns = [
-            r'serial\s+number[:\s]*([A-Z0-9\-]+)',
-            r'sn[:\s]*([A-Z0-9\-]+)',
-            r's/n[:\s]*([A-Z0-9\-]+)', 
-            r'serial[:\s]*([A-Z0-9\-]+)',
-            r'(\d{2,4}[A-Z]*\-?\d{3,4})',
-            r'airframe[:\s]*([A-Z0-9\-]+)',
-            r'aircraft[:\s]*([A-Z0-9\-]+)',
-            r'msn[:\s]*([A-Z0-9\-]+)'
-        ]
-        
-        for pattern in serial_patterns:
-            match = re.search(pattern, pdf_text, re.IGNORECASE)
-            if match:
-                serial_candidate = match.group(1).strip()
-                if re.search(r'\d', serial_candidate) and len(serial_candidate) >= 3:
-                    extracted_data["serial_number"] = serial_candidate
-                    st.write(f"✅ **SERIAL NUMBER FOUND**: {serial_candidate}")
-                    break
+        for _, match in scan.search("serial_number"):
+            serial_candidate = match.group(1).strip()
+            if re.search(r'\d', serial_candidate) and len(serial_candidate) >= 3:
+                extracted_data["serial_number"] = serial_candidate
+                write(f"✅ **SERIAL NUMBER FOUND**: {serial_candidate}")
+                break
         
         # Extract other data
-        year_patterns = [r'(19|20)\d{2}.*?(lear|citation|phenom|model)']
-        for pattern in year_patterns:
-            match = re.search(pattern, pdf_text)
-            if match:
-                year_match = re.search(r'(19|20)\d{2}', match.group(0))
-                if year_match:
-                    extracted_data["year_model"] = int(year_match.group(0))
-                    break
+        for _, match in scan.search("year_model"):
+            year_match = re.search(r'(19|20)\d{2}', match.group(0))
+            if year_match:
+                extracted_data["year_model"] = int(year_match.group(0))
+                break
         
         # Total Hours - Look specifically in ENGINE section
         total_hours_found = False
         
         # First try to find total hours in ENGINE section
-        engines_section_match = re.search(r'engines?\s*[:\-\s]*([\s\S]{0,800}?)(?=\n\n|\navionics|\ninterior|\nexterior|$)', pdf_text, re.IGNORECASE)
+        engines_range = sections.first("engines")
         
-        if engines_section_match:
-            engines_text = engines_section_match.group(1)
+        if engines_range:
+            engines_scan = scanner.scan(pdf_text, *engines_range, hardened=hardened, fields=fields)
             
             # Look for total time patterns within engine section
-            engine_total_patterns = [
-                r'engine\s*time\s*since\s*new[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'engine\s*ttsn[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'engine\s*total\s*time[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'total\s*time[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'(\d{1,2}[,\.]?\d{3})\s*hours?\s*total',
-                r'(\d{1,2}[,\.]?\d{3})\s*total\s*hours?'
-            ]
-            
-            for pattern in engine_total_patterns:
-                match = re.search(pattern, engines_text, re.IGNORECASE)
-                if match:
-                    hours_str = match.group(1).replace(",", "").replace(".", "")
-                    hours_value = int(hours_str)
-                    extracted_data["total_hours"] = hours_value
-                    st.write(f"✅ **TOTAL HOURS FOUND IN ENGINE SECTION**: {hours_value}")
-                    total_hours_found = True
-                    break
+            for _, match in engines_scan.search("engine_total_hours"):
+                hours_str = match.group(1).replace(",", "").replace(".", "")
+                hours_value = int(hours_str)
+                extracted_data["total_hours"] = hours_value
+                write(f"✅ **TOTAL HOURS FOUND IN ENGINE SECTION**: {hours_value}")
+                total_hours_found = True
+                break
         
         # If not found in engine section, fall back to general patterns
         if not total_hours_found:
-            total_hours_patterns = [
-                r'(\d{1,2}[,\.]?\d{3})\s*airframe\s*hours\s*since\s*new',
-                r'airframe\s*hours\s*since\s*new[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'total\s+time\s+since\s+new[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'(\d{1,2}[,\.]?\d{3})\s*hours\s*since\s*new',
-                r'hours\s*since\s*new[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'hours\s*/?\s*new[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'ttsn[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'total\s+hours[:\s]*(\d{1,2}[,\.]?\d{3})',
-                r'total\s+time[:\s]*(\d{1,2}[,\.]?\d{3})',  # Added: catches "TOTAL TIME: 7,677"
-                r'total\s+time\s+(\d{1,2}[,\.]?\d{3})',      # Added: catches "TOTAL TIME 7,677"
-                r'tt[:\s]*(\d{1,2}[,\.]?\d{3})',             # Added: catches "TT: 7,677"
-                r'airframe\s+total[:\s]*(\d{1,2}[,\.]?\d{3})', # Added: catches "AIRFRAME TOTAL: 7,677"
-                r'aftt[:\s]*(\d{1,2}[,\.]?\d{3})'            # Added: catches "AFTT: 7,677"
-            ]
-            
-            for pattern in total_hours_patterns:
-                match = re.search(pattern, pdf_text, re.IGNORECASE)
-                if match:
-                    hours_str = match.group(1).replace(",", "").replace(".", "")
-                    hours_value = int(hours_str)
-                    extracted_data["total_hours"] = hours_value
-                    st.write(f"✅ **TOTAL HOURS FOUND**: {hours_value} (pattern: {pattern})")
-                    break
+            for _, match in scan.search("total_hours"):
+                hours_str = match.group(1).replace(",", "").replace(".", "")
+                hours_value = int(hours_str)
+                extracted_data["total_hours"] = hours_value
+                write(f"✅ **TOTAL HOURS FOUND**: {hours_value} (pattern: {match.re.pattern})")
+                break
         
         # Engine Overhaul - Look for various patterns
-        engine_overhaul_patterns = [
-            r'engine\s*time\s*since\s*overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
-            r'engine\s*tsoh[:\s]*(\d{1,2}[,\.]?\d{3})',
-            r'hours?\s*since\s*overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
-            r'time\s*since\s*overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
-            r'overhaul\s*hours?[:\s]*(\d{1,2}[,\.]?\d{3})',
-            r'tsoh[:\s]*(\d{1,2}[,\.]?\d{3})',
-            r'since\s*overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
-            r'(\d{1,2}[,\.]?\d{3})\s*hours?\s*since\s*overhaul',
-            r'(\d{1,2}[,\.]?\d{3})\s*tsoh',
-            r'(\d{1,2}[,\.]?\d{3})\s*since\s*overhaul',
-            r'overhaul[:\s]*(\d{1,2}[,\.]?\d{3})',
-            r'soh[:\s]*(\d{1,2}[,\.]?\d{3})'  # Sometimes abbreviated as SOH
-        ]
-        
         engine_overhaul_found = False
         
         # First try to find in ENGINE section if we have it
-        if engines_section_match:
-            engines_text = engines_section_match.group(1)
-            
-            for pattern in engine_overhaul_patterns:
-                matches = re.findall(pattern, engines_text, re.IGNORECASE)
-                if matches:
-                    # Try each match to find a reasonable value
-                    for match in matches:
-                        hours_str = match.replace(",", "").replace(".", "")
-                        hours_value = int(hours_str)
-                        # Only accept reasonable overhaul hours (typically less than total hours)
-                        if 100 <= hours_value <= 50000:  # Reasonable range
-                            extracted_data["engine_overhaul"] = hours_value
-                            st.write(f"✅ **ENGINE OVERHAUL FOUND IN ENGINE SECTION**: {hours_value}")
-                            engine_overhaul_found = True
-                            break
+        if engines_range:
+            for _, matches in engines_scan.findall("engine_overhaul"):
+                # Try each match to find a reasonable value
+                for match in matches:
+                    hours_str = match.replace(",", "").replace(".", "")
+                    hours_value = int(hours_str)
+                    # Only accept reasonable overhaul hours (typically less than total hours)
+                    if 100 <= hours_value <= 50000:  # Reasonable range
+                        extracted_data["engine_overhaul"] = hours_value
+                        write(f"✅ **ENGINE OVERHAUL FOUND IN ENGINE SECTION**: {hours_value}")
+                        engine_overhaul_found = True
+                        break
                 if engine_overhaul_found:
                     break
         
         # If not found in engine section, try the whole document
         if not engine_overhaul_found:
-            for pattern in engine_overhaul_patterns:
-                matches = re.findall(pattern, pdf_text, re.IGNORECASE)
-                if matches:
-                    for match in matches:
-                        hours_str = match.replace(",", "").replace(".", "")
-                        hours_value = int(hours_str)
-                        # Only accept reasonable overhaul hours
-                        if 100 <= hours_value <= 50000:
-                            extracted_data["engine_overhaul"] = hours_value
-                            st.write(f"✅ **ENGINE OVERHAUL FOUND**: {hours_value}")
-                            engine_overhaul_found = True
-                            break
+            for _, matches in scan.findall("engine_overhaul"):
+                for match in matches:
+                    hours_str = match.replace(",", "").replace(".", "")
+                    hours_value = int(hours_str)
+                    # Only accept reasonable overhaul hours
+                    if 100 <= hours_value <= 50000:
+                        extracted_data["engine_overhaul"] = hours_value
+                        write(f"✅ **ENGINE OVERHAUL FOUND**: {hours_value}")
+                        engine_overhaul_found = True
+                        break
                 if engine_overhaul_found:
                     break
         
         # If still not found, default to total hours
-        if not engine_overhaul_found and "total_hours" in extracted_data:
+        if not engine_overhaul_found and "total_hours" in extracted_data and fields is None:
             extracted_data["engine_overhaul"] = extracted_data["total_hours"]
-            st.write(f"⚠️ **ENGINE OVERHAUL not found, defaulting to TOTAL HOURS**: {extracted_data['total_hours']}")
+            write(f"⚠️ **ENGINE OVERHAUL not found, defaulting to TOTAL HOURS**: {extracted_data['total_hours']}")
         
         # Engine Program - Look for specific phrases near "engine"
         engine_program_found = False
         
-        # First, look specifically for engine program mentions
-        engine_context_patterns = [
-            r'engines?\s*(?:are\s*)?enrolled\s*in\s*([A-Za-z\s\-&]+?)(?:\s*full|\s*engine|\s*program|\.|\n|$)',
-            r'both\s*engines?\s*(?:are\s*)?enrolled\s*in\s*([A-Za-z\s\-&]+?)(?:\s*full|\s*engine|\s*program|\.|\n|$)',
-            r'engines?\s*(?:are\s*)?(?:on|under)\s*([A-Za-z\s\-&]+?)\s*(?:program|warranty|plan|coverage)',
-            r'([A-Za-z\s\-&]+?)\s*full\s*engine\s*program',
-            r'engines?\s*program[:\s]*([A-Za-z\s\-&]+?)(?:\n|$|\.)',
-            r'engines?\s*warranty[:\s]*([A-Za-z\s\-&]+?)(?:\n|$|\.)',
-            r'engines?\s*-\s*([A-Za-z\s\-&]+?)(?:\n|$|\.)',
-            r'engine\s*maintenance[:\s]*([A-Za-z\s\-&]+?)(?:\n|$|\.)',
-            r'program[:\s]*([A-Za-z\s\-&]+?)(?:\s*\d+%|\s|$|\n)',  # Added: catches "Program: JSSI 100%"
-            r'engine\s*&\s*apu\s*status[^\\n]*program[:\s]*([A-Za-z\s\-&]+?)(?:\s*\d+%|\s|$|\n)',  # Added: catches under ENGINE & APU STATUS
-            r'engine\s*status[^\\n]*program[:\s]*([A-Za-z\s\-&]+?)(?:\s|$|\n)',  # Added: catches under ENGINE STATUS
-            r'maintenance\s*program[:\s]*([A-Za-z\s\-&]+?)(?:\s|$|\n)'  # Added: general maintenance program
-        ]
-        
         # If we have an engine section, search there first
-        if engines_section_match:
-            engines_text = engines_section_match.group(1)
-            
-            for pattern in engine_context_patterns:
-                match = re.search(pattern, engines_text, re.IGNORECASE)
-                if match:
-                    program = match.group(1).strip()
-                    st.write(f"🔍 **Found potential engine program in engine section**: {program}")
-                    
-                    # Clean up the program name
-                    program = program.strip().rstrip('.').rstrip(',')
-                    
-                    # Map to standard abbreviations
-                    program_mapping = {
-                        'jssi': 'JSSI',
-                        'power advantage': 'PWR ADV',
-                        'poweradvantage': 'PWR ADV',
-                        'esp gold lite': 'ESP GOLD LITE',
-                        'esp gold': 'ESP GOLD',
-                        'esp': 'ESP',
-                        'msp': 'MSP',
-                        'csp': 'CSP',
-                        'tap': 'TAP',
-                        'tap blue': 'TAP BLUE',
-                        'smart parts': 'SMART PARTS'
-                    }
-                    
-                    program_lower = program.lower()
-                    for key, value in program_mapping.items():
-                        if key in program_lower:
-                            extracted_data["engine_program"] = value
-                            st.write(f"✅ **ENGINE PROGRAM FOUND**: {value}")
-                            engine_program_found = True
-                            break
-                    
-                    if engine_program_found:
+        if engines_range:
+            for _, match in engines_scan.search("engine_program"):
+                program = match.group(1).strip()
+                write(f"🔍 **Found potential engine program in engine section**: {program}")
+                
+                # Clean up the program name
+                program = program.strip().rstrip('.').rstrip(',')
+                
+                # Map to standard abbreviations
+                program_lower = program.lower()
+                for key, value in ENGINE_PROGRAM_MAPPING.items():
+                    if key in program_lower:
+                        extracted_data["engine_program"] = value
+                        write(f"✅ **ENGINE PROGRAM FOUND**: {value}")
+                        engine_program_found = True
                         break
+                
+                if engine_program_found:
+                    break
         
         # If not found in engine section, search the whole document
         if not engine_program_found:
-            for pattern in engine_context_patterns:
-                match = re.search(pattern, pdf_text, re.IGNORECASE)
-                if match:
-                    program = match.group(1).strip()
-                    
-                    # Skip if it contains "avionics"
-                    if "avionics" in program.lower():
-                        continue
-                    
-                    st.write(f"🔍 **Found potential engine program**: {program}")
-                    
-                    # Clean up
-                    program = program.strip().rstrip('.').rstrip(',')
-                    
-                    # Map to standard abbreviations
-                    program_mapping = {
-                        'jssi': 'JSSI',
-                        'power advantage': 'PWR ADV',
-                        'poweradvantage': 'PWR ADV',
-                        'esp gold lite': 'ESP GOLD LITE',
-                        'esp gold': 'ESP GOLD',
-                        'esp': 'ESP',
-                        'msp': 'MSP',
-                        'csp': 'CSP',
-                        'tap': 'TAP',
-                        'tap blue': 'TAP BLUE',
-                        'smart parts': 'SMART PARTS'
-                    }
-                    
-                    program_lower = program.lower()
-                    for key, value in program_mapping.items():
-                        if key in program_lower:
-                            extracted_data["engine_program"] = value
-                            st.write(f"✅ **ENGINE PROGRAM FOUND**: {value}")
-                            engine_program_found = True
-                            break
-                    
-                    if engine_program_found:
-                        break
-                    
-                    # If no mapping but seems valid, use it
-                    if len(program) > 2 and len(program) < 20 and not any(skip in program.lower() for skip in ['avionics', 'triple', 'dual', 'honeywell']):
-                        extracted_data["engine_program"] = program.upper()
+            for _, match in scan.search("engine_program"):
+                program = match.group(1).strip()
+                
+                # Skip if it contains "avionics"
+                if "avionics" in program.lower():
+                    continue
+                
+                write(f"🔍 **Found potential engine program**: {program}")
+                
+                # Clean up
+                program = program.strip().rstrip('.').rstrip(',')
+                
+                # Map to standard abbreviations
+                program_lower = program.lower()
+                for key, value in ENGINE_PROGRAM_MAPPING.items():
+                    if key in program_lower:
+                        extracted_data["engine_program"] = value
+                        write(f"✅ **ENGINE PROGRAM FOUND**: {value}")
                         engine_program_found = True
                         break
+                
+                if engine_program_found:
+                    break
+                
+                # If no mapping but seems valid, use it
+                if len(program) > 2 and len(program) < 20 and not any(skip in program.lower() for skip in ['avionics', 'triple', 'dual', 'honeywell']):
+                    extracted_data["engine_program"] = program.upper()
+                    engine_program_found = True
+                    break
         
         # Number of Seats - Append " SEATS" to the number
-        seats_patterns = [
-            r'(\d+)\s*passenger\s*seat(?:ing|s)?',
-            r'number\s*of\s*seats[:\s]*(\d+)',
-            r'seats[:\s]*(\d+)',
-            r'(\d+)\s*seat(?:s)?\s*(?:configuration|config)',
-            r'seating\s*for\s*(\d+)',
-            r'(\d+)\s*pax'
-        ]
-        
-        for pattern in seats_patterns:
-            match = re.search(pattern, pdf_text, re.IGNORECASE)
-            if match:
-                seats = int(match.group(1))
-                if 1 <= seats <= 20:
-                    extracted_data["number_of_seats"] = f"{seats} SEATS"
-                    st.write(f"✅ **NUMBER OF SEATS FOUND**: {seats} SEATS")
-                    break
+        for _, match in scan.search("number_of_seats"):
+            seats = int(match.group(1))
+            if 1 <= seats <= 20:
+                extracted_data["number_of_seats"] = f"{seats} SEATS"
+                write(f"✅ **NUMBER OF SEATS FOUND**: {seats} SEATS")
+                break
         
         # Seat Configuration
-        config_patterns = [
-            r'(?:seat(?:ing)?\s*)?config(?:uration)?[:\s]*([^\n]+)',
-            r'cabin\s*config(?:uration)?[:\s]*([^\n]+)',
-            r'interior\s*(?:features|has|with)[:\s]*([^\n]*(?:club|divan|forward facing|aft facing)[^\n]*)',
-            r'(\d+\s*place\s*(?:club|divan)|forward\s*facing|aft\s*facing|center\s*club|double\s*club)[^\n]*'
-        ]
-        
-        for pattern in config_patterns:
-            match = re.search(pattern, pdf_text, re.IGNORECASE)
-            if match:
-                seat_config = match.group(1).strip()
-                if len(seat_config) > 5 and len(seat_config) < 200:
-                    extracted_data["seat_configuration"] = seat_config
-                    break
+        for _, match in scan.search("seat_configuration"):
+            seat_config = match.group(1).strip()
+            if len(seat_config) > 5 and len(seat_config) < 200:
+                extracted_data["seat_configuration"] = seat_config
+                break
         
         # Paint Exterior Year
-        paint_patterns = [
-            r'paint(?:ed)?\s*(?:in\s*)?(\d{4})',
-            r'exterior\s*paint(?:ed)?\s*(?:in\s*)?(\d{4})',
-            r'(\d{4})\s*(?:exterior\s*)?paint',
-            r'paint\s*completed[:\s]*(\d{4})',
-            r'new\s*paint[:\s]*(\d{4})',
-            r'paint\s*exterior[:\s]*(\d{4})',  # Added: catches "Paint Exterior: 2023"
-            r'exterior[:\s]*(\d{4})',          # Added: catches "Exterior: 2023"
-            r'paint[^\\n]*(\d{4})',            # Added: catches any paint mention with year
-            r'exterior[^\\n]*paint[^\\n]*(\d{4})', # Added: catches "Exterior... Paint... 2023"
-            r'paint[^\\n]*exterior[^\\n]*(\d{4})'  # Added: catches "Paint... Exterior... 2023"
-        ]
-        
-        for pattern in paint_patterns:
-            match = re.search(pattern, pdf_text, re.IGNORECASE)
-            if match:
-                year = int(match.group(1))
-                if 1990 <= year <= 2030:
-                    extracted_data["paint_exterior_year"] = year
-                    break
+        for _, match in scan.search("paint_exterior_year"):
+            year = int(match.group(1))
+            if 1990 <= year <= 2030:
+                extracted_data["paint_exterior_year"] = year
+                break
         
         # Interior Year
-        interior_patterns = [
-            r'interior\s*(?:refurb(?:ished)?|completed|done|new)\s*(?:in\s*)?(\d{4})',
-            r'(\d{4})\s*interior\s*(?:refurb|refresh|update)',
-            r'new\s*interior[:\s]*(\d{4})',
-            r'interior\s*year[:\s]*(\d{4})',
-            r'refurb(?:ished)?\s*in\s*(\d{4})',
-            r'interior\s*paint[:\s]*(\d{4})',      # Added: catches "Interior Paint: 2023"
-            r'paint\s*interior[:\s]*(\d{4})',      # Added: catches "Paint Interior: 2023"
-            r'interior[:\s]*(\d{4})',              # Added: catches "Interior: 2023"
-            r'interior[^\\n]*(\d{4})',             # Added: catches any interior mention with year
-            r'cabin\s*(?:refurb|refresh|update)[:\s]*(\d{4})', # Added: catches cabin updates
-            r'cabin[^\\n]*(\d{4})'                 # Added: catches cabin with year
-        ]
-        
-        for pattern in interior_patterns:
-            match = re.search(pattern, pdf_text, re.IGNORECASE)
-            if match:
-                year = int(match.group(1))
-                if 1990 <= year <= 2030:
-                    extracted_data["interior_year"] = year
-                    break
+        for _, match in scan.search("interior_year"):
+            year = int(match.group(1))
+            if 1990 <= year <= 2030:
+                extracted_data["interior_year"] = year
+                break
+        
+        slow_patterns = scan.slow_patterns + (engines_scan.slow_patterns if engines_range else [])
+        for field, pattern, elapsed in slow_patterns:
+            write(f"⏱️ **Pattern for {field} stopped after {elapsed * 1000:.0f} ms**: `{pattern}`")
+        
+        if fields is not None:
+            return extracted_data
         
         # Extract Upgrades
         upgrades = config.get("upgrades", {})
-        for upgrade_name, upgrade_config in upgrades.items():
-            keywords = upgrade_config.get("keywords", [])
-            
-            # Generate variations for all keywords
-            all_keywords = []
-            for keyword in keywords:
-                all_keywords.extend(self.generate_keyword_variations(keyword))
-            
-            # Remove duplicates
-            all_keywords = list(set(all_keywords))
-            
-            found = False
-            for keyword in all_keywords:
-                if keyword and keyword in pdf_text:
-                    extracted_data[f"upgrade_{upgrade_name}"] = "Y"
-                    found = True
-                    st.write(f"✅ **Upgrade found**: {upgrade_name} (keyword: {keyword})")
-                    break
-            
-            if not found:
+        upgrade_hits = self.get_upgrade_matcher(aircraft_model, config).find(pdf_text)
+        for upgrade_name in upgrades:
+            if upgrade_name in upgrade_hits:
+                keyword, offset = upgrade_hits[upgrade_name]
+                extracted_data[f"upgrade_{upgrade_name}"] = "Y"
+                write(f"✅ **Upgrade found**: {upgrade_name} (keyword: {keyword}, offset: {offset})")
+            else:
                 extracted_data[f"upgrade_{upgrade_name}"] = "N"
         
         return extracted_data
@@ -931,53 +3332,84 @@ class CompletePlatform:
         if not cell.value.startswith('='):
             return
         
-        formula = cell.value
-        
-        # Pattern to match column references, including absolute ones
-        # This will match: A1, $A1, $A$1, A$1
-        pattern = r'(\$?)([A-Z]+)(\$?)(\d+)'
+        try:
+            cell.value = translate_formula(cell.value, shift_amount)
+        except (TranslatorError, TokenizerError) as e:
+            # A reference shifted past column A, or a formula the tokenizer cannot read
+            logger.warning("Left formula %s in %s unshifted: %s", cell.value, cell.coordinate, e)
+    
+    def move_broker_columns(self, ws, destinations):
+        """
+        Move broker columns and their Y/N columns right in one pass, each to its
+        column in `destinations` ({column: new column}, order-preserving).
+        Values, full cell styles and column widths move and formulas are shifted.
+        Only stored cells are visited, so the cost follows how many cells the
+        columns hold rather than max_row. Vacated cells keep their formatting.
+        """
+        offsets = {}
+        for col, dest_col in destinations.items():
+            offsets[col] = offsets[col + 1] = dest_col - col
         
-        def replace_ref(match):
-            dollar1 = match.group(1)  # $ before column (if any)
-            col_letters = match.group(2)  # Column letters
-            dollar2 = match.group(3)  # $ before row (if any)
-            row_num = match.group(4)  # Row number
-            
-            # If column is absolute (has $ before it), do not shift
-            if dollar1 == '$':
-                return match.group(0)  # Return unchanged
-            
-            # Otherwise, shift the column
-            col_num = 0
-            for char in col_letters:
-                col_num = col_num * 26 + (ord(char) - ord('A') + 1)
-            
-            new_col_num = col_num + shift_amount
+        # openpyxl keeps a sheet's stored cells in ws._cells keyed by (row, column);
+        # rightmost columns go first so nothing is overwritten before it moves
+        stored = sorted((key for key in ws._cells if key[1] in offsets), key=lambda key: key[1], reverse=True)
+        for row, col in stored:
+            offset = offsets[col]
+            source_cell = ws._cells[row, col]
+            dest_cell = ws.cell(row=row, column=col + offset)
+            copy_style(source_cell, dest_cell)
             
-            new_col_ref = ""
-            while new_col_num > 0:
-                new_col_num -= 1
-                new_col_ref = chr(new_col_num % 26 + ord('A')) + new_col_ref
-                new_col_num //= 26
-            
-            return f"{dollar1}{new_col_ref}{dollar2}{row_num}"
+            if source_cell.value is not None:
+                dest_cell.value = source_cell.value
+                if isinstance(source_cell.value, str) and source_cell.value.startswith('='):
+                    self.shift_formulas_in_cell(dest_cell, offset)
+                source_cell.value = None
         
-        new_formula = re.sub(pattern, replace_ref, formula)
+        for col in sorted(offsets, reverse=True):
+            source_letter = get_column_letter(col)
+            if source_letter in ws.column_dimensions:
+                ws.column_dimensions[get_column_letter(col + offsets[col])].width = ws.column_dimensions[source_letter].width
         
-        if new_formula != formula:
-            cell.value = new_formula
+        return len(stored)
+    
+    def get_row_plan(self, workbook, ws, config):
+        """The RowPlan for this sheet and config, built once per batch (inserts never touch column 12)."""
+        key = (ws.title, ws.max_row, config_fingerprint(config))
+        if key not in workbook.row_plans:
+            workbook.row_plans[key] = RowPlan(ws, config, self.find_broker_row(ws))
+        return workbook.row_plans[key]
+    
+    def get_template_column(self, workbook, ws, config, plan, column):
+        """The TemplateColumn snapshot of `column`, read once until that column is written to."""
+        key = (ws.title, column, config_fingerprint(config))
+        if key not in workbook.templates:
+            workbook.templates[key] = TemplateColumn(ws, column, plan)
+        return workbook.templates[key]
+    
+    def column_formatting(self, ws, col):
+        """The cell styles ({(row, 0 or 1): style}) and widths of a broker column and its Y/N column."""
+        styles = {}
+        widths = {}
+        for offset in (0, 1):
+            for row in range(1, ws.max_row + 1):
+                if (row, col + offset) in ws._cells:
+                    styles[row, offset] = copy(ws._cells[row, col + offset]._style)
+            letter = get_column_letter(col + offset)
+            if letter in ws.column_dimensions:
+                widths[offset] = ws.column_dimensions[letter].width
+        return styles, widths
     
-    def find_insertion_point(self, excel_file, serial_number):
+    def apply_column_formatting(self, ws, formatting, col):
+        styles, widths = formatting
+        for (row, offset), style in styles.items():
+            ws.cell(row=row, column=col + offset)._style = copy(style)
+        for offset, width in widths.items():
+            ws.column_dimensions[get_column_letter(col + offset)].width = width
+    
+    def find_insertion_point(self, workbook, serial_number):
         """Find the correct column position to insert a new broker based on serial number order."""
         try:
-            excel_content = excel_file.read()
-            excel_file.seek(0)
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-                tmp.write(excel_content)
-                tmp_path = tmp.name
-            
-            wb = load_workbook(tmp_path)
+            wb = workbook.reader
             
             try:
                 if '-' in serial_number:
@@ -1035,31 +3467,23 @@ class CompletePlatform:
                 st.write(f"✅ **Insertion point found**: Column {insert_col}")
                 st.write(f"📋 **Current serials**: {[p['original'] for p in serial_positions]}")
                 
-                os.unlink(tmp_path)
                 return {
                     'column': insert_col,
                     'sheet': sheet_name,
                     'serial_positions': serial_positions,
+                    'serial_num': new_serial_num,
                     'display_serial': display_serial
                 }
             
-            os.unlink(tmp_path)
             return None
             
         except Exception as e:
             st.error(f"Error finding insertion point: {e}")
             return None
     
-    def find_broker_column(self, excel_file, serial_number, broker_name):
+    def find_broker_column(self, workbook, serial_number, broker_name):
         try:
-            excel_content = excel_file.read()
-            excel_file.seek(0)
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-                tmp.write(excel_content)
-                tmp_path = tmp.name
-            
-            wb = load_workbook(tmp_path)
+            wb = workbook.reader
             
             for sheet_name in wb.sheetnames:
                 ws = wb[sheet_name]
@@ -1068,7 +3492,6 @@ class CompletePlatform:
                     cell_value = ws.cell(row=1, column=col).value
                     if cell_value and str(cell_value).strip() == serial_number:
                         st.write(f"✅ **Serial number {serial_number} found in existing column {col}**")
-                        os.unlink(tmp_path)
                         return {
                             'column': col,
                             'sheet': sheet_name,
@@ -1077,41 +3500,25 @@ class CompletePlatform:
                             'mode': 'update'
                         }
                 
-                insertion_info = self.find_insertion_point(excel_file, serial_number)
+                insertion_info = self.find_insertion_point(workbook, serial_number)
                 if insertion_info:
                     insertion_info['broker'] = broker_name
                     insertion_info['matched_serial'] = serial_number
                     insertion_info['mode'] = 'insert'
-                    os.unlink(tmp_path)
                     return insertion_info
             
-            os.unlink(tmp_path)
             return None
             
         except Exception as e:
             st.error(f"Error finding broker column: {e}")
             return None
     
-    def insert_new_row(self, excel_file, extracted_data, aircraft_model, insertion_info, serial_number):
+    def insert_new_row(self, workbook, extracted_data, aircraft_model, insertion_info, serial_number):
         try:
-            excel_file.seek(0)
-            excel_content = excel_file.read()
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-                tmp.write(excel_content)
-                tmp_path = tmp.name
-            
-            backup_path = tmp_path.replace(".xlsx", "_BACKUP.xlsx")
-            shutil.copy(tmp_path, backup_path)
-            
-            wb = load_workbook(tmp_path)
+            wb = workbook.wb
             ws = wb[insertion_info['sheet']]
             target_col = insertion_info['column']
             
-            config = st.session_state.configurations[aircraft_model]
-            row_mappings = config.get("row_mappings", {})
-            updates = []
-            
             st.write("🔍 **Row Insertion Debug**: Starting new row insertion")
             st.write(f"🔍 **Target column**: {target_col}")
             
@@ -1122,57 +3529,12 @@ class CompletePlatform:
                     if pos['column'] >= target_col:
                         columns_to_shift.append(pos['column'])
                 
-                columns_to_shift.sort(reverse=True)
-                
-                for source_col in columns_to_shift:
-                    dest_col = source_col + 2
-                    st.write(f"📋 **Shifting column {source_col} to {dest_col}**")
-                    
-                    for row in range(1, ws.max_row + 1):
-                        source_cell = ws.cell(row=row, column=source_col)
-                        dest_cell = ws.cell(row=row, column=dest_col)
-                        
-                        if source_cell.value is not None:
-                            dest_cell.value = source_cell.value
-                            
-                            if isinstance(source_cell.value, str) and source_cell.value.startswith('='):
-                                self.shift_formulas_in_cell(dest_cell, 2)
-                            
-                            try:
-                                if source_cell.font:
-                                    dest_cell.font = Font(
-                                        name=source_cell.font.name,
-                                        size=source_cell.font.size,
-                                        bold=source_cell.font.bold,
-                                        italic=source_cell.font.italic,
-                                        color=source_cell.font.color
-                                    )
-                            except:
-                                pass
-                        
-                        source_yn_cell = ws.cell(row=row, column=source_col + 1)
-                        dest_yn_cell = ws.cell(row=row, column=dest_col + 1)
-                        
-                        if source_yn_cell.value is not None:
-                            dest_yn_cell.value = source_yn_cell.value
-                            
-                            if isinstance(source_yn_cell.value, str) and source_yn_cell.value.startswith('='):
-                                self.shift_formulas_in_cell(dest_yn_cell, 2)
-                            
-                            try:
-                                if source_yn_cell.font:
-                                    dest_yn_cell.font = Font(
-                                        name=source_yn_cell.font.name,
-                                        size=source_yn_cell.font.size,
-                                        bold=source_yn_cell.font.bold,
-                                        italic=source_yn_cell.font.italic,
-                                        color=source_yn_cell.font.color
-                                    )
-                            except:
-                                pass
-                        
-                        source_cell.value = None
-                        source_yn_cell.value = None
+                if columns_to_shift:
+                    st.write(f"📋 **Shifting columns {min(columns_to_shift)}-{max(columns_to_shift) + 1} right by 2**")
+                    destinations = {col: col + 2 for col in columns_to_shift}
+                    cells_moved = self.move_broker_columns(ws, destinations)
+                    workbook.columns_moved(ws.title, destinations)
+                    st.write(f"✅ **Moved {cells_moved} cells**")
             
             # Step 2: Find adjacent broker column to copy formulas from
             adjacent_col = None
@@ -1183,294 +3545,204 @@ class CompletePlatform:
                 # Use the next column as template
                 adjacent_col = target_col + 2
             
-            # Step 3: Copy formulas from adjacent column (including avionics section)
-            formulas_copied = 0
-            avionics_copied = 0
+            updates = self.fill_new_column(workbook, ws, extracted_data, aircraft_model, insertion_info, serial_number, target_col, adjacent_col)
             
-            if adjacent_col and adjacent_col <= ws.max_column:
-                st.write(f"📋 **Copying formulas from column {adjacent_col}**")
-                
-                # Get avionics section info if available
-                avionics_section = config.get("avionics_section", {})
-                avionics_start = avionics_section.get("start")
-                avionics_end = avionics_section.get("end")
-                
-                for row in range(1, ws.max_row + 1):
-                    # Skip certain rows that should have data, not formulas
-                    if row == 1 or row == self.find_broker_row(ws):  # Serial number and broker rows
-                        continue
-                    
-                    # Check if this row is in the avionics section
-                    is_avionics_row = False
-                    if avionics_start and avionics_end and avionics_start <= row <= avionics_end:
-                        is_avionics_row = True
-                    
-                    # Check if this row is in our configured fields (these get data, not formulas)
-                    is_data_row = any(row == row_num for row_num in row_mappings.values())
-                    
-                    # Also check if this is an upgrade row (but NOT in avionics section)
-                    upgrades = config.get("upgrades", {})
-                    is_upgrade_row = any(row == upgrade_config.get("row") for upgrade_config in upgrades.values()) and not is_avionics_row
-                    
-                    # Special handling for certain rows that should ALWAYS get formulas
-                    # Get the actual row numbers from configuration
-                    special_formula_rows = []
-                    
-                    # APU row (if configured)
-                    apu_row = config.get("row_mappings", {}).get("apu_program")
-                    if apu_row:
-                        special_formula_rows.append(apu_row)
-                    
-                    # Check upgrades for rows that need formulas
-                    for upgrade_name, upgrade_config in upgrades.items():
-                        # Add any upgrade that typically has formulas
-                        if any(keyword in upgrade_name for keyword in ["BELTED_LAV", "EXTERNAL_LAV", "DELIVERY_TO_THE_US", "DELIVERY", "APU"]):
-                            upgrade_row = upgrade_config.get("row")
-                            if upgrade_row:
-                                special_formula_rows.append(upgrade_row)
-                    
-                    # Also add row 34 explicitly for APU if not already included
-                    if 34 not in special_formula_rows:
-                        special_formula_rows.append(34)
-                    
-                    # Add row 29 for DELIVERY TO THE US
-                    if 29 not in special_formula_rows:
-                        special_formula_rows.append(29)
-                    
-                    # Remove None values and ensure we have integers
-                    special_formula_rows = [int(r) for r in special_formula_rows if r is not None]
-                    
-                    is_special_formula_row = row in special_formula_rows
-                    
-                    # For avionics rows, always copy formulas regardless of whether they're configured upgrades
-                    if is_avionics_row:
-                        # Check if this is just the header row (contains "AVIONICS" in the label)
-                        label_cell = ws.cell(row=row, column=12).value
-                        if label_cell and isinstance(label_cell, str) and "AVIONICS" in label_cell.upper() and "UPGRADE" in label_cell.upper():
-                            # Skip the header row
-                            continue
-                        
-                        # Copy main column
-                        template_cell = ws.cell(row=row, column=adjacent_col)
-                        new_cell = ws.cell(row=row, column=target_col)
-                        
-                        if template_cell.value:
-                            new_cell.value = template_cell.value
-                            
-                            # If it's a formula, adjust references
-                            if isinstance(template_cell.value, str) and template_cell.value.startswith('='):
-                                col_shift = target_col - adjacent_col
-                                self.shift_formulas_in_cell(new_cell, col_shift)
-                            
-                            # Copy formatting
-                            try:
-                                if template_cell.font:
-                                    new_cell.font = Font(
-                                        name=template_cell.font.name,
-                                        size=template_cell.font.size,
-                                        bold=template_cell.font.bold,
-                                        italic=template_cell.font.italic,
-                                        color=template_cell.font.color
-                                    )
-                            except:
-                                pass
-                            
-                            avionics_copied += 1
-                        
-                        # Only handle Y/N column if there's actually an avionic item in this row
-                        item_label = ws.cell(row=row, column=12).value
-                        if item_label and isinstance(item_label, str) and item_label.strip():
-                            # Copy Y/N column - set to N by default unless we found it in PDF
-                            template_yn_cell = ws.cell(row=row, column=adjacent_col + 1)
-                            new_yn_cell = ws.cell(row=row, column=target_col + 1)
-                            
-                            # Check if this avionic item was found in PDF
-                            avionic_found = False
-                            for upgrade_name, upgrade_config in upgrades.items():
-                                if upgrade_config.get("row") == row:
-                                    upgrade_key = f"upgrade_{upgrade_name}"
-                                    if upgrade_key in extracted_data:
-                                        new_yn_cell.value = extracted_data[upgrade_key]
-                                        avionic_found = True
-                                        break
-                            
-                            if not avionic_found:
-                                # Default to N for avionics not found in PDF
-                                new_yn_cell.value = "N"
-                            
-                            # Copy Y/N cell formatting
-                            try:
-                                if template_yn_cell.font:
-                                    new_yn_cell.font = Font(
-                                        name=template_yn_cell.font.name,
-                                        size=template_yn_cell.font.size,
-                                        bold=template_yn_cell.font.bold,
-                                        italic=template_yn_cell.font.italic,
-                                        color=template_yn_cell.font.color
-                                    )
-                            except:
-                                pass
-                    
-                    elif not is_data_row and not is_upgrade_row or is_special_formula_row:
-                        # Copy formula from adjacent column for non-data, non-upgrade rows OR special formula rows
-                        template_cell = ws.cell(row=row, column=adjacent_col)
-                        new_cell = ws.cell(row=row, column=target_col)
-                        
-                        if template_cell.value and isinstance(template_cell.value, str) and template_cell.value.startswith('='):
-                            # Copy the formula
-                            new_cell.value = template_cell.value
-                            
-                            # Adjust the formula references
-                            col_shift = target_col - adjacent_col
-                            self.shift_formulas_in_cell(new_cell, col_shift)
-                            
-                            # Copy formatting
-                            try:
-                                if template_cell.font:
-                                    new_cell.font = Font(
-                                        name=template_cell.font.name,
-                                        size=template_cell.font.size,
-                                        bold=template_cell.font.bold,
-                                        italic=template_cell.font.italic,
-                                        color=template_cell.font.color
-                                    )
-                            except:
-                                pass
-                            
-                            formulas_copied += 1
-                        
-                        # Also check Y/N column for formulas
-                        template_yn_cell = ws.cell(row=row, column=adjacent_col + 1)
-                        new_yn_cell = ws.cell(row=row, column=target_col + 1)
-                        
-                        if template_yn_cell.value and isinstance(template_yn_cell.value, str) and template_yn_cell.value.startswith('='):
-                            new_yn_cell.value = template_yn_cell.value
-                            self.shift_formulas_in_cell(new_yn_cell, col_shift)
-                            
-                            try:
-                                if template_yn_cell.font:
-                                    new_yn_cell.font = Font(
-                                        name=template_yn_cell.font.name,
-                                        size=template_yn_cell.font.size,
-                                        bold=template_yn_cell.font.bold,
-                                        italic=template_yn_cell.font.italic,
-                                        color=template_yn_cell.font.color
-                                    )
-                            except:
-                                pass
-                            
-                            formulas_copied += 1
-                
-                if formulas_copied > 0:
-                    st.write(f"✅ **Copied {formulas_copied} formulas from adjacent column**")
-                
-                if avionics_copied > 0:
-                    st.write(f"✅ **Copied {avionics_copied} avionic items with formulas**")
+            self.set_full_calc_on_load(wb)
+            st.write("✅ **New row inserted successfully with formulas copied**")
             
-            # Step 4: Add serial number (last 4 digits only) and broker name
-            display_serial = insertion_info.get('display_serial', serial_number[-4:])
+            return updates
             
-            ws.cell(row=1, column=target_col).value = display_serial
-            updates.append(f"Serial Number - Row 1: {display_serial}")
+        except Exception as e:
+            st.error(f"Error inserting new row: {e}")
+            return None
+    
+    def set_full_calc_on_load(self, wb):
+        try:
+            # Force automatic calculation and full recalculation on open
+            wb.calculation.calcMode = "automatic"
+            wb.calculation.calcOnSave = True
+            wb.calculation.fullCalcOnLoad = True
+            st.write("✅ **Set calculation mode to automatic with full calc on load**")
+        except:
+            st.write("⚠️ **Could not set calculation mode**")
+    
+    def fill_new_column(self, workbook, ws, extracted_data, aircraft_model, insertion_info, serial_number, target_col, adjacent_col):
+        """Steps 3-6 of an insert: formulas from the adjacent column, then serial, broker and extracted data."""
+        config = st.session_state.configurations[aircraft_model]
+        row_mappings = config.get("row_mappings", {})
+        updates = []
+        
+        # Step 3: Copy formulas from adjacent column (including avionics section)
+        formulas_copied = 0
+        avionics_copied = 0
+        
+        if adjacent_col and adjacent_col <= ws.max_column:
+            st.write(f"📋 **Copying formulas from column {adjacent_col}**")
             
-            broker_row = self.find_broker_row(ws)
-            if "broker_name" in extracted_data:
-                broker_cell = ws.cell(row=broker_row, column=target_col)
-                broker_cell.value = extracted_data["broker_name"].upper()  # Convert to uppercase
-                updates.append(f"Broker Name - Row {broker_row}: {extracted_data['broker_name'].upper()}")
-            else:
-                broker_cell = ws.cell(row=broker_row, column=target_col)
-                broker_cell.value = insertion_info.get('broker', 'Unknown Broker').upper()  # Convert to uppercase
-                updates.append(f"Broker Name - Row {broker_row}: {insertion_info.get('broker', 'Unknown Broker').upper()}")
+            # Serial, broker, data and upgrade rows get data, not formulas (see RowPlan)
+            plan = self.get_row_plan(workbook, ws, config)
+            template = self.get_template_column(workbook, ws, config, plan, adjacent_col)
             
-            # Step 5: Add extracted data
-            for field, row_num in row_mappings.items():
-                if field in extracted_data and row_num != 1 and row_num != broker_row:
-                    new_value = extracted_data[field]
-                    ws.cell(row=row_num, column=target_col).value = new_value
-                    updates.append(f"{field} - Row {row_num}: {new_value}")
+            for row, kind, main, yn in template.rows:
+                # Copy main column (value or formula, with its formatting)
+                if main:
+                    template.fill(main, ws.cell(row=row, column=target_col), target_col)
+                
+                # For avionics rows, always copy formulas regardless of whether they're configured upgrades
+                # (the avionics header row is skipped)
+                if kind == RowPlan.AVIONICS:
+                    if main:
+                        avionics_copied += 1
+                    
+                    # Only handle Y/N column if there's actually an avionic item in this row
+                    if yn:
+                        # Copy Y/N column - set to N by default unless we found it in PDF
+                        value = "N"
+                        for upgrade_name in plan.upgrades_by_row.get(row, []):
+                            upgrade_key = f"upgrade_{upgrade_name}"
+                            if upgrade_key in extracted_data:
+                                value = extracted_data[upgrade_key]
+                                break
+                        template.fill((value, None, yn[2]), ws.cell(row=row, column=target_col + 1), target_col)
+                
+                else:
+                    # Formula rows: copy main and Y/N formulas
+                    if main:
+                        formulas_copied += 1
+                    if yn:
+                        template.fill(yn, ws.cell(row=row, column=target_col + 1), target_col)
+                        formulas_copied += 1
             
-            # Step 6: Add upgrade data
-            upgrades = config.get("upgrades", {})
-            for upgrade_name, upgrade_config in upgrades.items():
-                upgrade_key = f"upgrade_{upgrade_name}"
-                if upgrade_key in extracted_data:
-                    row_num = upgrade_config.get("row")
-                    if row_num and row_num != 1:
-                        yn_col = target_col + 1
-                        cell = ws.cell(row=row_num, column=yn_col)
-                        cell.value = extracted_data[upgrade_key]
-                        try:
-                            cell.font = Font(name="Calibri", size=11, color="FFFFFF")
-                        except:
-                            cell.font = Font(name="Calibri", size=11)
-                        updates.append(f"{upgrade_name} - Row {row_num}: {extracted_data[upgrade_key]}")
+            if formulas_copied > 0:
+                st.write(f"✅ **Copied {formulas_copied} formulas from adjacent column**")
             
-            try:
-                # Force automatic calculation and full recalculation on open
-                wb.calculation.calcMode = "automatic"
-                wb.calculation.calcOnSave = True
-                wb.calculation.fullCalcOnLoad = True
-                st.write("✅ **Set calculation mode to automatic with full calc on load**")
-            except:
-                st.write("⚠️ **Could not set calculation mode**")
+            if avionics_copied > 0:
+                st.write(f"✅ **Copied {avionics_copied} avionic items with formulas**")
+        
+        # Step 4: Add serial number (last 4 digits only) and broker name
+        display_serial = insertion_info.get('display_serial', serial_number[-4:])
+        
+        ws.cell(row=1, column=target_col).value = display_serial
+        updates.append(f"Serial Number - Row 1: {display_serial}")
+        
+        broker_row = self.get_row_plan(workbook, ws, config).broker_row
+        if "broker_name" in extracted_data:
+            broker_cell = ws.cell(row=broker_row, column=target_col)
+            broker_cell.value = extracted_data["broker_name"].upper()  # Convert to uppercase
+            updates.append(f"Broker Name - Row {broker_row}: {extracted_data['broker_name'].upper()}")
+        else:
+            broker_cell = ws.cell(row=broker_row, column=target_col)
+            broker_cell.value = insertion_info.get('broker', 'Unknown Broker').upper()  # Convert to uppercase
+            updates.append(f"Broker Name - Row {broker_row}: {insertion_info.get('broker', 'Unknown Broker').upper()}")
+        
+        # Step 5: Add extracted data
+        for field, row_num in row_mappings.items():
+            if field in extracted_data and row_num != 1 and row_num != broker_row:
+                new_value = extracted_data[field]
+                ws.cell(row=row_num, column=target_col).value = new_value
+                updates.append(f"{field} - Row {row_num}: {new_value}")
+        
+        # Step 6: Add upgrade data
+        upgrades = config.get("upgrades", {})
+        for upgrade_name, upgrade_config in upgrades.items():
+            upgrade_key = f"upgrade_{upgrade_name}"
+            if upgrade_key in extracted_data:
+                row_num = upgrade_config.get("row")
+                if row_num and row_num != 1:
+                    yn_col = target_col + 1
+                    cell = ws.cell(row=row_num, column=yn_col)
+                    cell.value = extracted_data[upgrade_key]
+                    cell.font = UPGRADE_FONT
+                    updates.append(f"{upgrade_name} - Row {row_num}: {extracted_data[upgrade_key]}")
+        
+        workbook.column_changed(ws.title, target_col)
+        return updates
+    
+    def insert_new_rows(self, workbook, inserts):
+        """
+        Insert several new broker columns at once: (extracted_data, aircraft_model,
+        insertion_info) per serial, in batch order. plan_batch_inserts works out
+        where every column ends up, existing columns move there in one pass, and
+        each new column is filled exactly as insert_new_row would have filled it.
+        Returns the list of updates for each insert, or None on failure.
+        """
+        try:
+            wb = workbook.wb
+            first_info = inserts[0][2]
+            ws = wb[first_info['sheet']]
             
-            wb.save(tmp_path)
-            st.write("✅ **New row inserted successfully with formulas copied**")
+            st.write(f"🔍 **Batch Insertion**: Planning {len(inserts)} new columns")
+            destinations, placements = plan_batch_inserts(
+                first_info['serial_positions'], [insertion_info['serial_num'] for _, _, insertion_info in inserts]
+            )
+            
+            # Formatting of the empty positions new columns land on, read before anything moves
+            blank_formatting = {
+                col: self.column_formatting(ws, col) for _, _, (kind, col) in placements if kind == 'blank'
+            }
             
-            with open(tmp_path, "rb") as f:
-                updated_excel_data = f.read()
+            destinations = {col: dest_col for col, dest_col in destinations.items() if dest_col != col}
+            if destinations:
+                cells_moved = self.move_broker_columns(ws, destinations)
+                workbook.columns_moved(ws.title, destinations)
+                st.write(f"✅ **Moved {len(destinations)} existing columns ({cells_moved} cells) in one pass**")
             
-            with open(backup_path, "rb") as f:
-                backup_excel_data = f.read()
+            all_updates = []
+            for (extracted_data, aircraft_model, insertion_info), (target_col, adjacent_col, (kind, col)) in zip(inserts, placements):
+                st.write(f"📋 **Filling column {target_col} for serial {insertion_info['matched_serial']}**")
+                formatting = blank_formatting[col] if kind == 'blank' else self.column_formatting(ws, col)
+                self.apply_column_formatting(ws, formatting, target_col)
+                all_updates.append(self.fill_new_column(
+                    workbook, ws, extracted_data, aircraft_model, insertion_info, insertion_info['matched_serial'], target_col, adjacent_col
+                ))
             
-            os.unlink(tmp_path)
-            os.unlink(backup_path)
+            self.set_full_calc_on_load(wb)
+            st.write(f"✅ **{len(inserts)} new rows inserted successfully with formulas copied**")
             
-            return updated_excel_data, backup_excel_data, updates
+            return all_updates
             
         except Exception as e:
-            st.error(f"Error inserting new row: {e}")
-            return None, None, []
+            st.error(f"Error inserting new rows: {e}")
+            return None
     
-    def update_excel(self, excel_file, extracted_data, aircraft_model, broker_info):
+    def update_excel(self, workbook, extracted_data, aircraft_model, broker_info):
+        """Apply one PDF's data to the batch workbook; returns the list of updates, or None on failure."""
         try:
             # Add broker name to extracted data
             extracted_data["broker_name"] = broker_info['broker']
             
             if broker_info['mode'] == 'insert':
-                return self.insert_new_row(excel_file, extracted_data, aircraft_model, broker_info, broker_info['matched_serial'])
+                return workbook.apply(self.insert_new_row, dict(extracted_data), aircraft_model, broker_info, broker_info['matched_serial'])
             else:
-                return self.update_existing_row(excel_file, extracted_data, aircraft_model, broker_info)
+                return workbook.apply(self.update_existing_row, dict(extracted_data), aircraft_model, broker_info)
         except Exception as e:
             st.error(f"Error in update_excel: {e}")
-            return None, None, []
+            return None
     
-    def update_existing_row(self, excel_file, extracted_data, aircraft_model, broker_info):
+    def insert_excel_batch(self, workbook, inserts):
+        """insert_new_rows for queued (extracted_data, aircraft_model, broker_info) inserts, as one write."""
         try:
-            excel_file.seek(0)
-            excel_content = excel_file.read()
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-                tmp.write(excel_content)
-                tmp_path = tmp.name
-            
-            backup_path = tmp_path.replace(".xlsx", "_BACKUP.xlsx")
-            shutil.copy(tmp_path, backup_path)
-            
-            wb = load_workbook(tmp_path)
-            ws = wb[broker_info['sheet']]
+            for extracted_data, aircraft_model, broker_info in inserts:
+                extracted_data["broker_name"] = broker_info['broker']
+            return workbook.apply(self.insert_new_rows, [(dict(extracted_data), aircraft_model, broker_info) for extracted_data, aircraft_model, broker_info in inserts])
+        except Exception as e:
+            st.error(f"Error in insert_excel_batch: {e}")
+            return None
+    
+    def update_existing_row(self, workbook, extracted_data, aircraft_model, broker_info):
+        try:
+            ws = workbook.reader[broker_info['sheet']]
             target_col = broker_info['column']
             
             config = st.session_state.configurations[aircraft_model]
             row_mappings = config.get("row_mappings", {})
             updates = []
+            cells = []  # (row, column, value, font)
             
             # Update broker name (convert to uppercase)
             broker_row = self.find_broker_row(ws)
             if "broker_name" in extracted_data:
-                broker_cell = ws.cell(row=broker_row, column=target_col)
-                broker_cell.value = extracted_data["broker_name"].upper()
+                cells.append((broker_row, target_col, extracted_data["broker_name"].upper(), None))
                 updates.append(f"Broker Name - Row {broker_row}: {extracted_data['broker_name'].upper()}")
             
             for field, row_num in row_mappings.items():
@@ -1479,10 +3751,7 @@ class CompletePlatform:
                         st.error(f"🚨 **PROTECTION**: Refusing to update Row 1 ({field}) - this is the serial number row!")
                         continue
                     
-                    current_value = ws.cell(row=row_num, column=target_col).value
-                    new_value = extracted_data[field]
-                    
-                    ws.cell(row=row_num, column=target_col).value = new_value
+                    cells.append((row_num, target_col, extracted_data[field], None))
                     updates.append(f"{field} - Row {row_num}: {extracted_data[field]}")
             
             upgrades = config.get("upgrades", {})
@@ -1491,31 +3760,17 @@ class CompletePlatform:
                 if upgrade_key in extracted_data:
                     row_num = upgrade_config.get("row")
                     if row_num and row_num != 1:
-                        yn_col = target_col + 1
-                        cell = ws.cell(row=row_num, column=yn_col)
-                        cell.value = extracted_data[upgrade_key]
-                        try:
-                            cell.font = Font(name="Calibri", size=11, color="FFFFFF")
-                        except:
-                            cell.font = Font(name="Calibri", size=11)
+                        cells.append((row_num, target_col + 1, extracted_data[upgrade_key], UPGRADE_FONT))
                         updates.append(f"{upgrade_name} - Row {row_num}: {extracted_data[upgrade_key]}")
             
-            wb.save(tmp_path)
-            
-            with open(tmp_path, "rb") as f:
-                updated_excel_data = f.read()
-            
-            with open(backup_path, "rb") as f:
-                backup_excel_data = f.read()
-            
-            os.unlink(tmp_path)
-            os.unlink(backup_path)
+            workbook.write_cells(broker_info['sheet'], cells)
+            workbook.column_changed(broker_info['sheet'], target_col)
             
-            return updated_excel_data, backup_excel_data, updates
+            return updates
             
         except Exception as e:
             st.error(f"Error updating existing row: {e}")
-            return None, None, []
+            return None
 
 def main():
     st.set_page_config(page_title="Aircraft Data Platform", page_icon="✈️", layout="wide")
@@ -1553,9 +3808,57 @@ def main():
             st.session_state.configurations = {}
             st.session_state.custom_upgrades = []
             st.rerun()
+
     else:
         st.sidebar.warning("⚠️ No models configured")
     
+    backend_options = ["pdfplumber", "pdftotext", "auto"]
+    st.session_state.pdf_text_backend = st.sidebar.selectbox(
+        "PDF text backend:",
+        backend_options,
+        index=backend_options.index(PDF_TEXT_BACKEND) if PDF_TEXT_BACKEND in backend_options else 0,
+        help="pdftotext is much faster on text PDFs and falls back to pdfplumber when its output looks unusable; "
+             "auto also reads the pages pdftotext returns empty with pdfplumber"
+    )
+    if st.session_state.pdf_text_backend != "pdfplumber" and not TEXT_BACKENDS["pdftotext"].available():
+        st.sidebar.warning("⚠️ pdftotext not installed, using pdfplumber")
+    
+    st.session_state.pdf_extract_workers = st.sidebar.number_input(
+        "PDF extraction workers:",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=min(PDF_EXTRACT_WORKERS, os.cpu_count() or 1),
+        help="Split large PDFs across this many processes"
+    )
+    
+    st.session_state.regex_hardened = st.sidebar.checkbox(
+        "Hardened field matching",
+        value=True,
+        help="Search each field pattern only near its keywords, with a per-pattern time budget, so huge PDFs cannot stall extraction"
+    )
+    
+    st.session_state.pdf_streaming = st.sidebar.checkbox(
+        "Stream pages and stop early",
+        help="Stop reading a PDF once every configured field is found and the model's upgrade page budget is spent"
+    )
+    
+    st.session_state.reuse_near_duplicates = st.sidebar.checkbox(
+        "Reuse extraction for near-duplicate PDFs",
+        help="When a PDF's text nearly matches one processed before with the same model configuration, reuse its extracted data"
+    )
+    
+    if st.sidebar.button("🧹 Clear Processing Ledger"):
+        st.session_state.processing_ledger.clear()
+        st.sidebar.success("✅ Processing ledger cleared")
+    
+    if st.sidebar.button("🧹 Clear Duplicate History"):
+        st.session_state.duplicate_index.clear()
+        st.sidebar.success("✅ Duplicate history cleared")
+    
+    if st.sidebar.button("🧹 Clear PDF Text Cache"):
+        platform.text_cache.clear()
+        st.sidebar.success("✅ PDF text cache cleared")
+    
     tab1, tab2 = st.tabs(["🚀 Quick Process", "🔧 Create New Model"])
     
     with tab1:
@@ -1677,28 +3980,107 @@ def main():
             if pdf_details and excel_file and all(d["serial"] and d["broker"] for d in pdf_details):
                 if st.button("🚀 Process Aircraft Data", type="primary", key="process_btn"):
                     results = []
-                    current_excel = excel_file
+                    st.session_state.extraction_stats = {}
+                    try:
+                        workbook = WorkbookSession(excel_file)
+                    except Exception as e:
+                        st.error(f"Error loading Excel file: {e}")
+                        st.stop()
+                    
+                    # Multiple PDFs: new serials are queued and inserted together after the loop
+                    batch_inserts = process_mode == "Multiple PDFs"
+                    pending_inserts = []
+                    deferred_updates = []
+                    
+                    def apply_to_workbook(detail, extracted_data, aircraft_model, broker_info):
+                        """Write one PDF's data (unless its column is already up to date) and record the result."""
+                        if platform.already_applied(workbook, extracted_data, aircraft_model, broker_info):
+                            st.info(f"⏭️ Column {broker_info['column']} already up to date for {detail['serial']}, skipping write")
+                            results.append({
+                                "serial": detail["serial"],
+                                "broker": detail["broker"],
+                                "pdf_name": detail.get('name', detail['pdf'].name),
+                                "updates": [],
+                                "mode": "unchanged"
+                            })
+                            return
+                        
+                        updates = platform.update_excel(
+                            workbook, extracted_data, aircraft_model, broker_info
+                        )
+                        
+                        if updates is not None:
+                            mode_text = "updated" if broker_info['mode'] == 'update' else "inserted"
+                            st.success(f"✅ Excel {mode_text} successfully for {detail['serial']}!")
+                            
+                            # Save the result
+                            results.append({
+                                "serial": detail["serial"],
+                                "broker": detail["broker"],
+                                "pdf_name": detail.get('name', detail['pdf'].name),
+                                "updates": updates,
+                                "mode": broker_info['mode']
+                            })
+                        else:
+                            st.error(f"❌ Failed to update Excel for {detail['serial']}")
                     
                     for idx, detail in enumerate(pdf_details):
                         st.write(f"\n### Processing PDF {idx + 1} of {len(pdf_details)}: {detail.get('name', detail['pdf'].name)}")
                         
                         with st.spinner(f"Processing {detail.get('name', detail['pdf'].name)}..."):
-                            pdf_text = platform.extract_text_from_pdf(detail['pdf'])
+                            # Unchanged PDF, serial, broker and model config: replay the stored extraction
+                            ledger_key = platform.ledger_key(detail)
+                            replayed = st.session_state.processing_ledger.lookup(ledger_key, st.session_state.configurations)
+                            template_result = None if replayed else platform.extract_with_template(detail['pdf'], detail['broker'])
+                            if replayed:
+                                aircraft_model, extracted_data = replayed
+                                st.success(f"📒 Unchanged since last run, replaying stored extraction: **{aircraft_model}**")
+                            elif template_result:
+                                aircraft_model, extracted_data = template_result
+                                st.success(f"✅ Identified: **{aircraft_model}**")
+                            else:
+                                # A model's config can pin its own text backend ("text_backend")
+                                model_backend = platform.pinned_text_backend(detail['pdf'])
+                                # A streamed PDF may stop early; only whole documents go in the near-duplicate index
+                                document_complete = True
+                                if st.session_state.get('pdf_streaming'):
+                                    pdf_text, document_complete = platform.extract_text_streaming(detail['pdf'], backend=model_backend)
+                                else:
+                                    pdf_text = platform.extract_text_from_pdf(detail['pdf'], backend=model_backend)
+                            
+                                if not pdf_text:
+                                    st.error(f"Could not extract text from {detail.get('name', detail['pdf'].name)}")
+                                    continue
                             
-                            if not pdf_text:
-                                st.error(f"Could not extract text from {detail.get('name', detail['pdf'].name)}")
-                                continue
+                                signature, duplicate = platform.find_near_duplicate(pdf_text)
+                                reused = None
+                                if duplicate and st.session_state.get('reuse_near_duplicates'):
+                                    reused = platform.reusable_extraction(duplicate)
+                                    if not reused:
+                                        st.info("ℹ️ Model configuration changed since then, extracting again")
                             
-                            aircraft_model = platform.identify_aircraft_from_pdf(pdf_text)
+                                if reused:
+                                    aircraft_model, extracted_data = reused
+                                    st.success(f"✅ Reusing extraction from {duplicate['pdf_name']}: **{aircraft_model}**")
+                                else:
+                                    aircraft_model = platform.identify_aircraft_from_pdf(pdf_text)
+                            
+                                    if not aircraft_model:
+                                        st.error(f"❌ Could not identify aircraft model in {detail.get('name', detail['pdf'].name)}")
+                                        st.info("Available: " + ", ".join(st.session_state.configurations.keys()))
+                                        continue
                             
-                            if not aircraft_model:
-                                st.error(f"❌ Could not identify aircraft model in {detail.get('name', detail['pdf'].name)}")
-                                st.info("Available: " + ", ".join(st.session_state.configurations.keys()))
-                                continue
+                                    st.success(f"✅ Identified: **{aircraft_model}**")
                             
-                            st.success(f"✅ Identified: **{aircraft_model}**")
+                                    extracted_data = platform.extract_data_from_pdf(pdf_text, aircraft_model)
+                                    
+                                    if extracted_data and document_complete:
+                                        platform.remember_extraction(pdf_text, signature, detail, aircraft_model, extracted_data)
                             
-                            extracted_data = platform.extract_data_from_pdf(pdf_text, aircraft_model)
+                            if extracted_data and not replayed:
+                                st.session_state.processing_ledger.record(
+                                    ledger_key, aircraft_model, st.session_state.configurations[aircraft_model], extracted_data
+                                )
                             
                             if extracted_data:
                                 st.subheader("📊 Extracted Data")
@@ -1718,45 +4100,65 @@ def main():
                                             icon = "✅" if value == "Y" else "❌"
                                             st.write(f"• {icon} **{upgrade_name}**: {value}")
                                 
-                                broker_info = platform.find_broker_column(current_excel, detail["serial"], detail["broker"])
+                                broker_info = platform.find_broker_column(workbook, detail["serial"], detail["broker"])
                                 
                                 if not broker_info:
                                     st.error(f"❌ Could not find broker column or insertion point for {detail['serial']}")
                                     continue
                                 
+                                if broker_info['mode'] == 'insert' and batch_inserts:
+                                    if any(queued["serial"] == detail["serial"] for queued, _, _, _ in pending_inserts):
+                                        # Its column only exists once the batch is inserted
+                                        st.info(f"⏳ {detail['serial']} is already queued for insertion - will update it after the batch insert")
+                                        deferred_updates.append((detail, extracted_data, aircraft_model))
+                                    else:
+                                        st.success(f"✅ Queued {detail['serial']} for batch insertion")
+                                        pending_inserts.append((detail, extracted_data, aircraft_model, broker_info))
+                                    continue
+                                
                                 if broker_info['mode'] == 'update':
                                     st.success(f"✅ Found existing entry in Column {broker_info['column']} - will update")
                                 else:
                                     st.success(f"✅ Will insert new row at Column {broker_info['column']}")
                                 
-                                updated_excel, backup_excel, updates = platform.update_excel(
-                                    current_excel, extracted_data, aircraft_model, broker_info
-                                )
-                                
-                                if updated_excel:
-                                    mode_text = "updated" if broker_info['mode'] == 'update' else "inserted"
-                                    st.success(f"✅ Excel {mode_text} successfully for {detail['serial']}!")
-                                    
-                                    # Save the result
-                                    results.append({
-                                        "serial": detail["serial"],
-                                        "broker": detail["broker"],
-                                        "pdf_name": detail.get('name', detail['pdf'].name),
-                                        "updates": updates,
-                                        "mode": broker_info['mode']
-                                    })
-                                    
-                                    # Use the updated Excel for the next iteration
-                                    if idx < len(pdf_details) - 1:
-                                        # Create a file-like object for the next iteration
-                                        current_excel = io.BytesIO(updated_excel)
-                                        current_excel.name = "temp.xlsx"
-                                else:
-                                    st.error(f"❌ Failed to update Excel for {detail['serial']}")
+                                apply_to_workbook(detail, extracted_data, aircraft_model, broker_info)
+                    
+                    if pending_inserts:
+                        st.write(f"\n### Inserting {len(pending_inserts)} new serials")
+                        all_updates = platform.insert_excel_batch(
+                            workbook, [(extracted_data, aircraft_model, broker_info) for _, extracted_data, aircraft_model, broker_info in pending_inserts]
+                        )
+                        
+                        if all_updates is not None:
+                            for (detail, _, _, broker_info), updates in zip(pending_inserts, all_updates):
+                                st.success(f"✅ Excel inserted successfully for {detail['serial']}!")
+                                results.append({
+                                    "serial": detail["serial"],
+                                    "broker": detail["broker"],
+                                    "pdf_name": detail.get('name', detail['pdf'].name),
+                                    "updates": updates,
+                                    "mode": broker_info['mode']
+                                })
+                        else:
+                            st.error(f"❌ Failed to insert {len(pending_inserts)} new serials")
+                        
+                        for detail, extracted_data, aircraft_model in deferred_updates:
+                            broker_info = platform.find_broker_column(workbook, detail["serial"], detail["broker"])
+                            if broker_info:
+                                apply_to_workbook(detail, extracted_data, aircraft_model, broker_info)
                     
                     # Show summary and download
                     if results:
+                        # One save for the whole batch; the upload itself is the backup
+                        updated_excel = workbook.save()
+                        backup_excel = workbook.original
                         st.write("\n## 📊 Processing Summary")
+                        stats = st.session_state.extraction_stats
+                        if stats.get("pages"):
+                            st.write(f"📄 **Pages extracted**: {stats['pages']} ({stats.get('image_pages_skipped', 0)} image-only pages skipped)")
+                            st.write(f"🧠 **Peak memory**: {stats.get('peak_rss', 0) / 2**20:.0f} MB")
+                        if stats.get("template_hits"):
+                            st.write(f"📐 **Template hits**: {stats['template_hits']} of {len(pdf_details)} PDFs")
                         for result in results:
                             st.write(f"• **{result['serial']}** ({result['broker']}): {result['mode']} - {len(result['updates'])} fields updated")
                         
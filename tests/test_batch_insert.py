@@ -0,0 +1,153 @@
+"""insert_new_rows (one pass for a batch) against inserting the same serials one at a time."""
+import random
+from io import BytesIO
+
+import pytest
+import streamlit as st
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+import Enhanced_aircraft_app as app
+
+CONFIGS = [
+    {"row_mappings": {"total_hours": 20, "engine_program": 21, "apu_program": 34},
+     "upgrades": {"TCAS": {"row": 40}, "WIFI": {"row": 41}, "BELTED_LAV": {"row": 45}},
+     "avionics_section": {"start": 38, "end": 47}},
+    {"row_mappings": {"total_hours": 20, "interior": 22},
+     "upgrades": {"DELIVERY_TO_THE_US": {"row": 29}, "A": {"row": 16}}},
+]
+LABELS = {1: "SERIAL", 5: "BROKER", 20: "TOTAL HOURS", 21: "ENGINE PROGRAM", 22: "INTERIOR YEAR",
+          29: "DELIVERY TO THE US", 34: "APU", 38: "AVIONICS UPGRADES"}
+
+
+def make_master(brokers, rows=60):
+    """A master sheet: labels in column 12, broker columns (with Y/N columns) from column 16."""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+    for row in range(1, rows + 1):
+        ws.cell(row=row, column=12).value = LABELS.get(row, f"ITEM {row}")
+    thin = Side(style="thin")
+    for i in range(max(brokers, 1)):
+        col = 16 + 2 * i
+        letter, yn = get_column_letter(col), get_column_letter(col + 1)
+        for row in range(1, rows + 1):
+            cell = ws.cell(row=row, column=col)
+            cell.font = Font(name="Arial", size=9, bold=(row == 1), color="FFFF0000" if row == 5 else None)
+            cell.fill = PatternFill("solid", fgColor="FFDDEEFF" if row % 2 else "FFFFFFFF")
+            cell.border = Border(left=thin, right=thin)
+            cell.number_format = "#,##0" if row == 20 else "General"
+            cell.alignment = Alignment(horizontal="center")
+        ws.column_dimensions[letter].width = 12 + (i % 3)
+        ws.column_dimensions[yn].width = 4
+        if i >= brokers:
+            # An empty master still carries the first column's formatting
+            continue
+        ws.cell(row=1, column=col).value = str(5000 + 10 * i)
+        ws.cell(row=5, column=col).value = f"BROKER{i}"
+        ws.cell(row=20, column=col).value = 3000 + i
+        ws.cell(row=21, column=col).value = "JSSI"
+        ws.cell(row=22, column=col).value = 2015
+        for row in range(10, 16):
+            ws.cell(row=row, column=col).value = f"={letter}20*{row}+{letter}$22-${letter}1"
+        ws.cell(row=16, column=col).value = f"=SUM({letter}20:{letter}25)"
+        ws.cell(row=17, column=col).value = f'=IF({yn}40="Y",LOG10({letter}20),"n/a {letter}20")'
+        ws.cell(row=18, column=col).value = f"='Other Sheet'!{letter}3+Sheet1!{letter}20"
+        ws.cell(row=29, column=col).value = f"={letter}20/2"
+        ws.cell(row=34, column=col).value = f"={letter}21"
+        for row in range(39, 48):
+            ws.cell(row=row, column=col + 1).value = "Y" if (row + i) % 2 else "N"
+            ws.cell(row=row, column=col).value = f'=IF({yn}{row}="Y",100,0)'
+    last = get_column_letter(16 + 2 * max(brokers, 1) - 1)
+    ws.cell(row=20, column=2).value = f"=AVERAGE(P20:{last}20)"
+    ws.cell(row=21, column=2).value = f'=COUNTIF(P21:{last}21,"JSSI")'
+    ws.merge_cells("A1:K1")
+    ws.merge_cells("L38:M38")
+    other = wb.create_sheet("Other Sheet")
+    for row in range(1, 10):
+        other.cell(row=row, column=1).value = row
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def snapshot(content):
+    """Every valued cell's value and style, the column widths and the merged ranges of each sheet."""
+    wb = load_workbook(BytesIO(content))
+    result = {}
+    for ws in wb:
+        for row in ws.iter_rows():
+            for cell in row:
+                if cell.value is not None:
+                    font = cell.font
+                    result[ws.title, cell.coordinate] = (
+                        cell.value, font.name, font.sz, font.b, font.i, font.color.rgb if font.color is not None else None,
+                        cell.fill.fgColor.rgb, cell.number_format, cell.border.left.style, cell.alignment.horizontal,
+                    )
+        result[ws.title, "widths"] = {letter: dim.width for letter, dim in ws.column_dimensions.items() if dim.width}
+        result[ws.title, "merged"] = sorted(str(merged) for merged in ws.merged_cells.ranges)
+    return result
+
+
+def extracted(rng):
+    return {
+        "total_hours": rng.randint(1, 9999), "engine_program": "ESP", "interior": 2001, "apu_program": "MSP",
+        "upgrade_TCAS": rng.choice("YN"), "upgrade_WIFI": rng.choice("YN"), "upgrade_BELTED_LAV": rng.choice("YN"),
+        "upgrade_DELIVERY_TO_THE_US": "Y", "upgrade_A": "N",
+    }
+
+
+@pytest.fixture
+def platform():
+    st.session_state.config_caches = {}
+    return app.CompletePlatform.__new__(app.CompletePlatform)
+
+
+def one_at_a_time(platform, content, serials, data):
+    workbook = app.WorkbookSession(BytesIO(content))
+    for serial, extracted_data in zip(serials, data):
+        broker_info = platform.find_broker_column(workbook, serial, f"B{serial}")
+        assert broker_info["mode"] == "insert"
+        assert platform.update_excel(workbook, dict(extracted_data), "M", broker_info) is not None
+    return workbook.save()
+
+
+def batched(platform, content, serials, data):
+    workbook = app.WorkbookSession(BytesIO(content))
+    inserts = [(dict(extracted_data), "M", platform.find_broker_column(workbook, serial, f"B{serial}"))
+               for serial, extracted_data in zip(serials, data)]
+    assert all(broker_info["mode"] == "insert" for _, _, broker_info in inserts)
+    assert platform.insert_excel_batch(workbook, inserts) is not None
+    return workbook.save()
+
+
+@pytest.mark.parametrize("brokers, serials", [
+    (6, ["5025", "4990", "5035", "5026", "6000", "4000"]),  # between, before and after existing columns
+    (6, ["6000", "6001", "5999"]),                           # all past the last column
+    (4, ["4990", "4980", "4970"]),                           # all before the first column
+    (0, ["5100", "5050", "5200"]),                           # empty master
+    (5, ["SN-5005", "750-5015", "5022"]),                    # serials with prefixes
+])
+def test_batch_matches_one_at_a_time(platform, brokers, serials):
+    st.session_state.configurations = {"M": CONFIGS[0]}
+    rng = random.Random(len(serials))
+    data = [extracted(rng) for _ in serials]
+    content = make_master(brokers)
+    assert snapshot(batched(platform, content, serials, data)) == snapshot(one_at_a_time(platform, content, serials, data))
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_random_batches_match_one_at_a_time(platform, seed):
+    rng = random.Random(seed)
+    brokers = rng.choice([0, 5, 12])
+    st.session_state.configurations = {"M": CONFIGS[seed % 2]}
+    existing = {str(5000 + 10 * i) for i in range(brokers)}
+    serials = []
+    while len(serials) < 4 + seed:
+        serial = str(rng.randint(4900, 5000 + 10 * brokers + 50))
+        if serial not in existing and serial not in serials:
+            serials.append(serial)
+    data = [extracted(rng) for _ in serials]
+    content = make_master(brokers)
+    assert snapshot(batched(platform, content, serials, data)) == snapshot(one_at_a_time(platform, content, serials, data))
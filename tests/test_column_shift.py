@@ -0,0 +1,102 @@
+"""move_broker_columns against the cell-by-cell shift insert_new_row used to do."""
+import random
+
+import pytest
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+import Enhanced_aircraft_app as app
+
+FIRST_BROKER = 3
+FORMULAS = ["={c}{r}+{y}{r}", "=SUM({c}2:{c}{r})", "=$C$1*2", "={c}$4-{n}{r}", "=IF({y}{r}=\"Y\",{c}{r},0)"]
+
+
+def make_sheet(seed, brokers, far_row=None):
+    rng = random.Random(seed)
+    ws = Workbook().active
+    ws.cell(row=1, column=1).value = "Field"
+    last_col = FIRST_BROKER + 2 * brokers + 1
+    for col in range(FIRST_BROKER, last_col + 1, 2):
+        letter, yn, right = (get_column_letter(c) for c in (col, col + 1, col + 2))
+        ws.column_dimensions[letter].width = rng.choice([9, 12.5, 18, 22])
+        for row in range(1, 41):
+            if rng.random() < 0.3:
+                continue
+            cell = ws.cell(row=row, column=col)
+            kind = rng.random()
+            if kind < 0.4:
+                cell.value = rng.randint(0, 20000)
+            elif kind < 0.7:
+                cell.value = rng.choice(FORMULAS).format(c=letter, y=yn, n=right, r=row)
+            else:
+                cell.value = f"text {row}-{col}"
+            cell.font = Font(name=rng.choice(["Calibri", "Arial"]), size=rng.choice([9, 11]),
+                             bold=rng.random() < 0.3, italic=rng.random() < 0.2,
+                             color=rng.choice([None, "FFFF0000", "FF0000FF"]))
+            if rng.random() < 0.2:
+                cell.fill = PatternFill("solid", fgColor="FFFFFF00")
+                cell.number_format = "#,##0"
+            if rng.random() < 0.5:
+                ws.cell(row=row, column=col + 1).value = rng.choice(["Y", "N", "=IF({c}{r}>0,\"Y\",\"N\")".format(c=letter, r=row)])
+    if far_row:
+        ws.cell(row=far_row, column=1).value = "note"
+    return ws
+
+
+def reference_shift(platform, ws, destinations):
+    """The cell-by-cell shift insert_new_row did before move_broker_columns (values, fonts, formulas)."""
+    for source_col in sorted(destinations, reverse=True):
+        offset = destinations[source_col] - source_col
+        for row in range(1, ws.max_row + 1):
+            for col in (source_col, source_col + 1):
+                source_cell = ws.cell(row=row, column=col)
+                dest_cell = ws.cell(row=row, column=col + offset)
+                if source_cell.value is not None:
+                    dest_cell.value = source_cell.value
+                    if isinstance(source_cell.value, str) and source_cell.value.startswith('='):
+                        platform.shift_formulas_in_cell(dest_cell, offset)
+                    font = source_cell.font
+                    dest_cell.font = Font(name=font.name, size=font.size, bold=font.bold, italic=font.italic, color=font.color)
+                source_cell.value = None
+
+
+def snapshot(ws):
+    cells = {}
+    for (row, col), cell in ws._cells.items():
+        if cell.value is not None:
+            font = cell.font
+            color = font.color.rgb if font.color is not None else None
+            cells[row, col] = (cell.value, font.name, font.sz, font.b, font.i, color)
+    return cells
+
+
+# Single inserts move every column after the insertion point by 2; a batch of
+# inserts moves the columns past the second insertion point by 4
+@pytest.mark.parametrize("seed, brokers, far_row, moved, offsets", [
+    (1, 6, None, range(0, 6), (2, 2)),
+    (2, 6, None, range(3, 6), (2, 2)),
+    (3, 20, 3000, range(10, 20), (2, 2)),
+    (4, 8, None, range(2, 8), (2, 4)),
+])
+def test_matches_cell_by_cell_shift(seed, brokers, far_row, moved, offsets):
+    platform = app.CompletePlatform.__new__(app.CompletePlatform)
+    columns = [FIRST_BROKER + 2 * broker for broker in moved]
+    split = len(columns) // 2
+    destinations = {col: col + offsets[index >= split] for index, col in enumerate(columns)}
+    
+    expected, actual = make_sheet(seed, brokers, far_row), make_sheet(seed, brokers, far_row)
+    styles = {key: (cell.fill.fgColor.rgb, cell.number_format) for key, cell in actual._cells.items()}
+    widths = {col: actual.column_dimensions[get_column_letter(col)].width for col in columns}
+    
+    reference_shift(platform, expected, destinations)
+    moved_cells = platform.move_broker_columns(actual, destinations)
+    
+    assert snapshot(actual) == snapshot(expected)
+    assert moved_cells <= len(styles)
+    for col, dest_col in destinations.items():
+        assert actual.column_dimensions[get_column_letter(dest_col)].width == widths[col]
+        for row in range(1, 41):
+            if (row, col) in styles:
+                dest = actual.cell(row=row, column=dest_col)
+                assert (dest.fill.fgColor.rgb, dest.number_format) == styles[row, col]
@@ -0,0 +1,72 @@
+"""Hardened FieldScan against plain search/finditer over the whole text."""
+import random
+
+import pytest
+
+import Enhanced_aircraft_app as app
+
+SNIPPETS = [
+    "Total Time: 7,677 hours", "TTSN 4,512", "engine time since overhaul: 1,234", "TSOH 2,100",
+    "Serial Number: 560-5123", "S/N 750-0123", "2008 Citation Excel", "Engines enrolled in JSSI full program.",
+    "Engine & APU Status", "Program: ESP Gold 100%", "seating configuration: eight passenger double club",
+    "8 passenger seating", "Seats: 9", "Paint: Matterhorn White with blue stripes", "Interior: new leather",
+    "Avionics: Collins Pro Line 21", "maintenance program: CAMP", "number of seats 12", "APU: Honeywell",
+    "Exterior paint 2019", "Painted 2021 by Duncan", "Interior features: double club", "aft facing divan 2020",
+]
+# Plain search of this pattern is cubic on space-padded lines, which is what hardening bounds
+TOO_SLOW_UNHARDENED = {r'([A-Za-z\s\-&]+?)\s*full\s*engine\s*program'}
+WORDS = ["leather", "club", "seat", "divan", "galley", "lavatory", "white", "gray", "stripe", "with", "and",
+         "hours", "new", "since", "program", "engine", "time", "-", "&", "8", "1,200", "total"]
+
+
+def document(seed, long_lines):
+    """A spec sheet of bulleted lines; the bullets keep letter runs from spanning lines."""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(rng.randint(10, 30)):
+        parts = [rng.choice(SNIPPETS) if rng.random() < 0.3 else rng.choice(WORDS) for _ in range(rng.randint(1, 8))]
+        if long_lines and rng.random() < 0.4:
+            # pdftotext -layout style: columns padded far apart on one line
+            parts = [part + " " * rng.randint(100, 200) for part in parts]
+        lines.append("• " + " ".join(parts))
+    return "\n".join(lines)
+
+
+def test_documents_have_lines_longer_than_the_window():
+    assert any(len(line) > 2 * app.SCAN_WINDOW for seed in range(20) for line in document(seed, True).splitlines())
+
+
+def plain(compiled, text):
+    first = compiled.search(text)
+    return (first.span(), first.groups()) if first else None, [app.findall_value(m) for m in compiled.finditer(text)]
+
+
+@pytest.fixture(autouse=True)
+def no_time_budget(monkeypatch):
+    monkeypatch.setattr(app, "PATTERN_TIME_BUDGET", float("inf"))
+
+
+@pytest.mark.parametrize("long_lines", [False, True])
+def test_hardened_matches_plain_search(long_lines):
+    scanner = app.CompiledFieldScanner({
+        field: [pattern for pattern in patterns if pattern not in TOO_SLOW_UNHARDENED]
+        for field, patterns in app.FIELD_PATTERNS.items()
+    })
+    for seed in range(60):
+        text = document(seed, long_lines)
+        for field, patterns in scanner.patterns.items():
+            scan = scanner.scan(text, hardened=True)
+            searched = dict(scan.search(field))
+            found = dict(scan.findall(field))
+            for priority, (compiled, _) in enumerate(patterns):
+                first, values = plain(compiled, text)
+                match = searched.get(priority)
+                assert ((match.span(), match.groups()) if match else None) == first, (seed, compiled.pattern)
+                assert found.get(priority, []) == values, (seed, compiled.pattern)
+
+
+def test_capture_longer_than_the_window():
+    scanner = app.CompiledFieldScanner({"seat_configuration": [r'configuration[:\s]*([^\n]+)']})
+    text = "x" * 210 + "configuration: " + "club seating " * 60 + "\nnext line"
+    match = next(scanner.scan(text, hardened=True).search("seat_configuration"))[1]
+    assert match.span() == (210, text.index("\n"))
@@ -0,0 +1,64 @@
+"""JsonJournal persistence, as used by the near-duplicate index and the processing ledger."""
+import json
+
+import Enhanced_aircraft_app as app
+
+
+def signature(seed):
+    return [seed * 1000 + i for i in range(app.MINHASH_PERMUTATIONS)]
+
+
+def test_each_record_appends_one_line_and_reloads(tmp_path):
+    path = tmp_path / "signatures.jsonl"
+    index = app.NearDuplicateIndex(str(path), 100)
+    for seed in range(5):
+        index.add(f"pdf{seed}", signature(seed), pdf_name=f"{seed}.pdf")
+        assert len(path.read_text(encoding="utf-8").splitlines()) == seed + 1
+    
+    reloaded = app.NearDuplicateIndex(str(path), 100)
+    assert reloaded.records == index.records
+    assert reloaded.query(signature(3))[0][1]["pdf_name"] == "3.pdf"
+
+
+def test_torn_last_line_is_skipped_and_compacted(tmp_path):
+    path = tmp_path / "signatures.jsonl"
+    index = app.NearDuplicateIndex(str(path), 100)
+    index.add("pdf0", signature(0), pdf_name="0.pdf")
+    index.add("pdf1", signature(1), pdf_name="1.pdf")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('["pdf2", {"signature": [1, 2')
+    
+    reloaded = app.NearDuplicateIndex(str(path), 100)
+    assert set(reloaded.records) == {"pdf0", "pdf1"}
+    reloaded.add("pdf3", signature(3), pdf_name="3.pdf")
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [key for key, _ in lines] == ["pdf0", "pdf1", "pdf3"]
+
+
+def test_superseded_lines_are_compacted_and_cap_survives_reload(tmp_path):
+    path = tmp_path / "signatures.jsonl"
+    index = app.NearDuplicateIndex(str(path), 10)
+    for seed in range(200):
+        index.add(f"pdf{seed % 30}", signature(seed % 30), pdf_name=f"{seed}.pdf")
+    
+    assert len(path.read_text(encoding="utf-8").splitlines()) <= app.JOURNAL_MIN_COMPACT_LINES
+    reloaded = app.NearDuplicateIndex(str(path), 10)
+    assert reloaded.records == index.records
+    assert len(reloaded.records) == 10
+    
+    reloaded.clear()
+    assert not path.exists()
+    assert app.NearDuplicateIndex(str(path), 10).records == {}
+
+
+def test_ledger_appends_entries_and_replays_after_reload(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    config = {"row_mappings": {"serial_number": 1}}
+    ledger = app.ProcessingLedger(str(path), 100)
+    for serial in range(3):
+        ledger.record(f"hash:{serial}:broker", "Citation Excel", config, {"serial_number": str(serial)})
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 3
+    
+    reloaded = app.ProcessingLedger(str(path), 2)
+    assert set(reloaded.entries) == {"hash:1:broker", "hash:2:broker"}
+    assert reloaded.lookup("hash:2:broker", {"Citation Excel": config}) == ("Citation Excel", {"serial_number": "2"})
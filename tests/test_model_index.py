@@ -0,0 +1,73 @@
+"""ModelIndex against the first-match, word-by-word identification it replaced."""
+import random
+
+import pytest
+
+import Enhanced_aircraft_app as app
+
+MODELS = [
+    "Falcon 7X", "Falcon 900EX", "Falcon 2000", "Learjet 45", "Learjet 60XR", "Citation Excel",
+    "Citation XLS", "Citation Sovereign", "Challenger 300", "Challenger 604", "Gulfstream G450",
+    "Gulfstream G550", "King Air 350", "Hawker 800XP", "Phenom", "Global Express - Master", "Legacy 600 for sale",
+]
+FILLER = ["aircraft", "model", "year", "serial", "offered", "price", "hours", "engines", "2004", "maintenance"]
+
+
+def old_accepts(model_name, pdf_text):
+    """One iteration of the old identify_aircraft_from_pdf loop."""
+    if model_name.lower() in pdf_text:
+        return True
+    model_words = model_name.lower().split()
+    if "excel" in model_name.lower() and "excel" in pdf_text:
+        return True
+    if len(model_words) >= 2:
+        important_words = [w for w in model_words if w not in ["-", "master", "for", "sale"] and len(w) > 2]
+        matches = [w for w in important_words if w in pdf_text]
+        return len(matches) >= len(important_words) * 0.6
+    return False
+
+
+def identify(pdf_text):
+    ranked = app.ModelIndex(MODELS).rank(pdf_text)
+    return ranked[0][0] if ranked and ranked[0][1] >= app.MODEL_MATCH_THRESHOLD else None
+
+
+def documents(count=400):
+    rng = random.Random(14)
+    vocabulary = sorted({word for model in MODELS for word in model.lower().split()}) + FILLER
+    for _ in range(count):
+        words = rng.sample(vocabulary, rng.randint(2, 8))
+        text = " ".join(words)
+        # Whole words only: the old check was a substring test, the index compares tokens
+        if all((word in text) == (word in words) for word in vocabulary):
+            yield text
+
+
+def test_identifies_whenever_the_old_check_did():
+    for text in documents():
+        accepted = [model for model in MODELS if old_accepts(model, text)]
+        found = identify(text)
+        if accepted:
+            assert found in accepted, (text, found, accepted)
+        else:
+            assert found is None, (text, found)
+
+
+@pytest.mark.parametrize("text, model", [
+    ("dassault falcon model 7x for sale", "Falcon 7X"),
+    ("2004 learjet model 45 for sale, low hours", "Learjet 45"),
+    ("learjet 60xr", "Learjet 60XR"),
+    ("falcon 2000 with new paint", "Falcon 2000"),
+])
+def test_short_model_tokens(text, model):
+    assert identify(text) == model
+
+
+@pytest.mark.parametrize("text, model", [
+    ("2010 gulfstream g5 for sale", "G5"),
+    ("1999 lj 35 learjet", "LJ 35"),
+])
+def test_names_of_short_tokens_only_match_verbatim(text, model):
+    index = app.ModelIndex(MODELS + ["G5", "LJ 35"])
+    assert index.rank(text)[0] == (model, 2.0, "Direct match found")
+    assert all(name != model for name, _, _ in index.rank("gulfstream lj g 5 35"))
@@ -0,0 +1,67 @@
+"""PdfplumberBackend: page-parallel extraction matches the serial output."""
+import glob
+import os
+import tempfile
+from io import BytesIO
+
+import pytest
+
+import Enhanced_aircraft_app as app
+
+canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+
+
+def make_pdf(page_count):
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for page in range(page_count):
+        pdf.drawString(72, 720, f"Page {page + 1} of the Citation Excel spec sheet")
+        pdf.drawString(72, 700, f"Total time: {1000 + page},{page:03d} hours")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def test_parallel_matches_serial_and_removes_temp_file(monkeypatch):
+    monkeypatch.setattr(app.st, "warning", lambda message: pytest.fail(message))
+    pdf_bytes = make_pdf(app.PARALLEL_MIN_PAGES + 3)
+    backend = app.PdfplumberBackend()
+    before = set(glob.glob(os.path.join(tempfile.gettempdir(), "*.pdf")))
+    
+    serial = backend.extract(pdf_bytes, 1, {})
+    stats = {}
+    parallel = backend.extract(pdf_bytes, 3, stats)
+    
+    assert parallel == serial
+    assert "Page 11 of the Citation Excel" in parallel
+    assert stats["pages"] == app.PARALLEL_MIN_PAGES + 3
+    assert set(glob.glob(os.path.join(tempfile.gettempdir(), "*.pdf"))) == before
+
+
+def test_worker_reads_the_document_from_a_path(tmp_path):
+    pdf_path = tmp_path / "spec.pdf"
+    pdf_path.write_bytes(make_pdf(3))
+    assert app.extract_page_range(str(pdf_path), 1, 3) == list(app.iter_page_windows(pdf_path.read_bytes(), 1, 3))
+
+
+def test_documents_share_one_running_pool(monkeypatch):
+    monkeypatch.setattr(app.st, "warning", lambda message: pytest.fail(message))
+    backend = app.PdfplumberBackend()
+    
+    backend.extract(make_pdf(app.PARALLEL_MIN_PAGES), 2, {})
+    pool = app.extraction_pool(2)
+    workers = set(pool._processes)
+    backend.extract(make_pdf(app.PARALLEL_MIN_PAGES + 1), 2, {})
+    
+    assert app.extraction_pool(2) is pool
+    assert set(pool._processes) == workers
+
+
+def test_closing_parallel_pages_early_removes_temp_file(monkeypatch):
+    monkeypatch.setattr(app.st, "warning", lambda message: pytest.fail(message))
+    before = set(glob.glob(os.path.join(tempfile.gettempdir(), "*.pdf")))
+    pages = app.PdfplumberBackend().iter_pages(make_pdf(3 * app.PAGE_WINDOW), 2)
+    
+    assert "Page 1 of the Citation Excel" in next(pages)
+    pages.close()
+    assert set(glob.glob(os.path.join(tempfile.gettempdir(), "*.pdf"))) == before
@@ -0,0 +1,57 @@
+"""StreamingProgress: when extract_text_streaming may stop reading pages."""
+import pytest
+import streamlit as st
+
+import Enhanced_aircraft_app as app
+
+CONFIG = {
+    "row_mappings": {"serial_number": 1, "total_hours": 20, "engine_overhaul": 21},
+    "upgrades": {"TCAS": {"keywords": ["tcas"], "row": 40}},
+}
+
+
+@pytest.fixture
+def platform():
+    st.session_state.configurations = {"Citation Excel": CONFIG}
+    st.session_state.config_caches = {}
+    return app.CompletePlatform.__new__(app.CompletePlatform)
+
+
+def test_defaulted_overhaul_does_not_complete(platform):
+    progress = app.StreamingProgress(platform)
+    progress.add_page("cessna citation excel for sale\nserial number: 560-5123\ntotal time: 7,677 hours\ntcas ii")
+    assert progress.aircraft_model == "Citation Excel"
+    assert "engine_overhaul" not in progress.fields
+    assert not progress.complete()
+    
+    progress.add_page("engines\nengine time since overhaul: 1,234")
+    assert progress.complete()
+    pdf_text = "\n".join(progress.pages)
+    assert platform.extract_data_from_pdf(pdf_text, "Citation Excel", verbose=False)["engine_overhaul"] == 1234
+
+
+def test_pages_are_searched_once_for_missing_fields_only(platform, monkeypatch):
+    calls = []
+    extract = platform.extract_data_from_pdf
+    
+    def recording(pdf_text, aircraft_model, verbose=True, fields=None):
+        calls.append((pdf_text, set(fields)))
+        return extract(pdf_text, aircraft_model, verbose, fields)
+    
+    monkeypatch.setattr(platform, "extract_data_from_pdf", recording)
+    progress = app.StreamingProgress(platform)
+    pages = ["citation excel\nserial number: 560-5123\ntotal time: 7,677"] + [f"filler page {i}" for i in range(5)]
+    for page in pages:
+        progress.add_page(page)
+    
+    assert [text for text, _ in calls] == pages
+    assert calls[0][1] == {"serial_number", "total_hours", "engine_overhaul"}
+    assert all(fields == {"engine_overhaul"} for _, fields in calls[1:])
+
+
+def test_model_found_late_searches_earlier_pages(platform):
+    progress = app.StreamingProgress(platform)
+    progress.add_page("serial number: 560-5123\ntotal time: 7,677\ntime since overhaul: 1,500\ntcas")
+    assert progress.aircraft_model is None
+    progress.add_page("cessna citation excel")
+    assert progress.complete()
@@ -0,0 +1,133 @@
+"""extract_text_from_pdf backend chains and page stats; model-pinned backends."""
+from io import BytesIO
+
+import pytest
+import streamlit as st
+
+import Enhanced_aircraft_app as app
+
+GOOD_PAGE = "citation excel serial number 560-5123 total time 7,677 hours " * 4
+
+
+class FakeBackend:
+    def __init__(self, name, pages):
+        self.name = name
+        self.pages = pages
+        self.calls = 0
+    
+    def available(self):
+        return True
+    
+    def version(self):
+        return f"{self.name}-test"
+    
+    def extract(self, pdf_bytes, workers=1, stats=None):
+        self.calls += 1
+        return "\n".join(app.count_page(stats, page_text) for page_text in self.pages)
+    
+    def extract_pages(self, pdf_bytes):
+        self.calls += 1
+        return list(self.pages)
+    
+    def iter_pages(self, pdf_bytes, workers=1, stats=None):
+        self.calls += 1
+        self.workers = workers
+        for page_text in self.pages:
+            yield app.count_page(stats, page_text)
+    
+    def extract_page_list(self, pdf_bytes, indexes):
+        self.calls += 1
+        self.pages_read = list(indexes)
+        return [self.pages[index] for index in indexes]
+
+
+@pytest.fixture
+def platform(tmp_path):
+    st.session_state.configurations = {}
+    st.session_state.config_caches = {}
+    st.session_state.extraction_stats = {}
+    st.session_state.pdf_extract_workers = 1
+    platform = app.CompletePlatform.__new__(app.CompletePlatform)
+    platform.text_cache = app.PdfTextCache(str(tmp_path), 10 * 2**20)
+    return platform
+
+
+def use_backends(monkeypatch, pdfplumber_pages, pdftotext_pages):
+    backends = {"pdfplumber": FakeBackend("pdfplumber", pdfplumber_pages),
+                "pdftotext": FakeBackend("pdftotext", pdftotext_pages),
+                "auto": app.AutoBackend()}
+    monkeypatch.setattr(app, "TEXT_BACKENDS", backends)
+    return backends
+
+
+def test_auto_uses_pdftotext_and_pdfplumber_for_its_empty_pages(platform, monkeypatch):
+    backends = use_backends(monkeypatch, ["p1", "plumber page 2", None, "p4"], [GOOD_PAGE, "  ", "", GOOD_PAGE])
+    text = platform.extract_text_from_pdf(BytesIO(b"pdf"), backend="auto")
+    assert text == f"{GOOD_PAGE}\nplumber page 2\n\n{GOOD_PAGE}".lower()
+    assert backends["pdfplumber"].pages_read == [1, 2]
+    stats = st.session_state.extraction_stats
+    assert stats["pages"] == 4
+    assert stats["image_pages_skipped"] == 1
+
+
+def test_auto_without_any_pdftotext_text_falls_back_to_pdfplumber(platform, monkeypatch):
+    backends = use_backends(monkeypatch, [GOOD_PAGE, GOOD_PAGE], ["", " "])
+    assert platform.extract_text_from_pdf(BytesIO(b"pdf"), backend="auto") == "\n".join([GOOD_PAGE] * 2).lower()
+    assert not hasattr(backends["pdfplumber"], "pages_read")
+    assert st.session_state.extraction_stats["pages"] == 2
+
+
+def test_fallback_counts_only_returned_pages(platform, monkeypatch):
+    use_backends(monkeypatch, [GOOD_PAGE, None, GOOD_PAGE], ["�" * 400] * 5)
+    assert platform.extract_text_from_pdf(BytesIO(b"pdf"), backend="pdftotext") == f"{GOOD_PAGE}\n\n{GOOD_PAGE}".lower()
+    stats = st.session_state.extraction_stats
+    assert stats["pages"] == 3
+    assert stats["image_pages_skipped"] == 1
+
+
+def test_pinned_backend_probes_first_page_only_when_pinned(platform, monkeypatch):
+    probed = []
+    
+    def first_page(pdf_bytes, start, end, window=app.PAGE_WINDOW):
+        probed.append((start, end))
+        yield "Cessna Citation Excel for sale"
+    
+    monkeypatch.setattr(app, "iter_page_windows", first_page)
+    st.session_state.configurations = {"Citation Excel": {"row_mappings": {}}}
+    assert platform.pinned_text_backend(BytesIO(b"pdf")) is None
+    assert probed == []
+    
+    st.session_state.configurations["Citation Excel"]["text_backend"] = "pdftotext"
+    pdf_file = BytesIO(b"pdf")
+    assert platform.pinned_text_backend(pdf_file) == "pdftotext"
+    assert probed == [(0, 1)]
+    assert pdf_file.tell() == 0
+
+
+def test_streaming_uses_selected_backend_and_workers(platform, monkeypatch):
+    backends = use_backends(monkeypatch, [GOOD_PAGE], [GOOD_PAGE, "Second Page"])
+    st.session_state.pdf_extract_workers = 3
+    text, complete = platform.extract_text_streaming(BytesIO(b"pdf"), backend="pdftotext")
+    assert (text, complete) == (f"{GOOD_PAGE}\nsecond page".lower(), True)
+    assert backends["pdftotext"].workers == 3
+    assert backends["pdfplumber"].calls == 0
+    assert st.session_state.extraction_stats["pages"] == 2
+
+
+def test_streaming_falls_back_when_pdftotext_unusable(platform, monkeypatch):
+    backends = use_backends(monkeypatch, [GOOD_PAGE, None], ["\ufffd" * 400] * 3)
+    text, complete = platform.extract_text_streaming(BytesIO(b"pdf"), backend="pdftotext")
+    assert (text, complete) == (f"{GOOD_PAGE}\n".lower(), True)
+    assert backends["pdfplumber"].workers == 1
+    assert st.session_state.extraction_stats["pages"] == 2
+
+
+def test_streaming_stopped_early_is_incomplete_and_not_cached(platform, monkeypatch):
+    st.session_state.configurations = {"Citation Excel": {"row_mappings": {"serial_number": 1, "total_hours": 20}}}
+    first_page = "Cessna Citation Excel for sale\nSerial Number: 560-5123\nTotal Time: 7,677 hours"
+    backends = use_backends(monkeypatch, [first_page, GOOD_PAGE, GOOD_PAGE], [])
+    
+    for _ in range(2):
+        text, complete = platform.extract_text_streaming(BytesIO(b"pdf"), backend="pdfplumber")
+        assert (text, complete) == (first_page.lower(), False)
+    assert backends["pdfplumber"].calls == 2
@@ -0,0 +1,113 @@
+"""UpgradeMatcher against the substring test it replaced (`keyword in pdf_text` over every variation)."""
+import json
+import os
+import random
+import re
+
+import pytest
+
+import Enhanced_aircraft_app as app
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+with open(os.path.join(REPO, "keyword_synonyms.json")) as f:
+    SYNONYMS = json.load(f)
+
+# The synonym file's keywords plus the kind of labels configurations are built from
+KEYWORDS = sorted({keyword for key, values in SYNONYMS.items() for keyword in [key, *values]} | {
+    "heated window", "auto throttle", "uns-1espw", "wi-fi", "g-5000", "collins 7.1", "hud", "satcom",
+})
+SPLITS = [" ", "-", "", ".", "\n", "  ", "- \n"]
+CONTEXTS = ["", "non", "dual ", "the ", "s", "es", " unit", "ly"]
+
+
+@pytest.fixture(scope="module")
+def platform():
+    return app.CompletePlatform.__new__(app.CompletePlatform)
+
+
+@pytest.fixture(scope="module")
+def synonyms():
+    return app.SynonymTable(SYNONYMS)
+
+
+def variations(platform, synonyms, keyword):
+    return [variation for variation in platform.generate_keyword_variations(keyword, synonyms) if variation]
+
+
+def old_matcher(platform, synonyms, text):
+    return {keyword for keyword in KEYWORDS if any(variation in text for variation in variations(platform, synonyms, keyword))}
+
+
+def reference_matcher(platform, synonyms, text):
+    """Separator-insensitive substring matching, written independently of CanonicalText."""
+    separator = app.SEPARATOR_PATTERN.pattern.rstrip("+")
+    hits = set()
+    for keyword in KEYWORDS:
+        allowed = {}
+        for variation in variations(platform, synonyms, keyword):
+            canonical = app.canonical_keyword(variation)
+            if canonical:
+                allowed.setdefault(canonical, set()).update(app.separator_offsets(variation))
+        for canonical, offsets in allowed.items():
+            pattern = "".join(
+                (f"{separator}*" if i in offsets else "") + re.escape(ch) for i, ch in enumerate(canonical)
+            )
+            if re.search(pattern, re.sub(r"[\-­][ \t]*\n", "", text)):
+                hits.add(keyword)
+    return hits
+
+
+def new_matcher(platform, synonyms, text):
+    matcher = app.UpgradeMatcher(
+        {keyword: {"keywords": [keyword]} for keyword in KEYWORDS},
+        lambda keyword: platform.generate_keyword_variations(keyword, synonyms),
+    )
+    return set(matcher.find(text))
+
+
+def respell(rng, variation):
+    """The variation with its separators swapped, or a letter split off, inside some context."""
+    if rng.random() < 0.3 and len(variation) > 2:
+        cut = rng.randrange(1, len(variation))
+        word = variation[:cut] + rng.choice(SPLITS) + variation[cut:]
+    else:
+        word = app.SEPARATOR_PATTERN.sub(lambda match: rng.choice(SPLITS), variation)
+    return rng.choice(CONTEXTS) + word + rng.choice(CONTEXTS)
+
+
+def corpus(platform, synonyms, documents=300):
+    rng = random.Random(11)
+    spellings = [variation for keyword in KEYWORDS for variation in variations(platform, synonyms, keyword)]
+    for _ in range(documents):
+        words = [respell(rng, rng.choice(spellings)) for _ in range(rng.randint(1, 6))]
+        yield " filler ".join(words)
+
+
+def test_finds_everything_the_old_matcher_found(platform, synonyms):
+    for text in corpus(platform, synonyms):
+        missed = old_matcher(platform, synonyms, text) - new_matcher(platform, synonyms, text)
+        assert not missed, (text, missed)
+
+
+def test_extra_hits_only_differ_in_separators(platform, synonyms):
+    for text in corpus(platform, synonyms):
+        assert new_matcher(platform, synonyms, text) == reference_matcher(platform, synonyms, text), text
+
+
+@pytest.mark.parametrize("keyword, text, found", [
+    ("heated window", "heated windows", True),
+    ("auto throttle", "auto throttles fitted", True),
+    ("synthetic vision", "nonsynthetic vision", True),
+    ("auto throttle", "auto-throttle", True),
+    ("uns-1espw", "dual uns-\n1espw", True),
+    ("auxiliary power unit", "auxil-\niary power unit", True),
+    ("apu", "a pu unit", False),
+    ("apu", "a pump", False),
+])
+def test_reviewed_cases(platform, synonyms, keyword, text, found):
+    matcher = app.UpgradeMatcher(
+        {"UPGRADE": {"keywords": [keyword]}},
+        lambda keyword: platform.generate_keyword_variations(keyword, synonyms),
+    )
+    assert ("UPGRADE" in matcher.find(text)) is found
@@ -0,0 +1,246 @@
+"""XlsxCellPatch and WorkbookSession against the same writes made through openpyxl."""
+import re
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.chart import BarChart, Reference
+from openpyxl.styles import Font, PatternFill
+
+import Enhanced_aircraft_app as app
+
+RED = Font(name="Calibri", size=11, bold=True, color="FFFF0000")
+GREEN = Font(name="Calibri", size=11, color="FF00B050")
+
+# (sheet, row, column, value, font): overwrites of strings, numbers and formulas, new cells
+# in existing rows, new rows between and after existing ones, and restyled Y/N cells
+UPDATES = [
+    ("Master", 1, 3, "560-5123", None),
+    ("Master", 2, 3, 7677, None),
+    ("Master", 3, 3, "=C2*2", None),
+    ("Master", 4, 3, 12.5, None),
+    ("Master", 4, 4, "Y", RED),
+    ("Master", 5, 4, "N", GREEN),
+    ("Master", 6, 5, "  padded  ", None),
+    ("Master", 9, 3, True, None),
+    ("Master", 9, 4, "Y", RED),
+    ("Master", 40, 3, "new row", GREEN),
+    ("Master", 2, 6, None, None),
+    ("Notes", 1, 1, "Jet Partners", None),
+    ("Notes", 3, 2, 42, None),
+]
+
+
+def make_workbook():
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Master"
+    for row, label in enumerate(["Serial", "Total time", "Doubled", "Rate", "Wifi", "Notes"], start=1):
+        ws.cell(row=row, column=1).value = label
+        ws.cell(row=row, column=1).font = Font(name="Arial", bold=True)
+    ws["B1"], ws["C1"], ws["E1"] = "550-0001", "old serial", "Broker"
+    ws["B2"], ws["C2"], ws["F2"] = 5000, 6000, "spare"
+    ws["B3"], ws["C3"] = "=B2*2", "=C2+1"
+    ws["C4"].fill = PatternFill("solid", fgColor="FFFFFF00")
+    ws["C4"].number_format = "#,##0.00"
+    ws["D4"] = "N"
+    ws["D4"].font = Font(name="Calibri", italic=True)
+    ws["B12"] = "after the gap"
+    notes = wb.create_sheet("Notes")
+    notes["A2"] = "kept"
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def rewrite_part(content, name, edit):
+    """`content` with the package part `name` replaced by edit(its text)."""
+    source = zipfile.ZipFile(BytesIO(content))
+    output = BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as package:
+        for info in source.infolist():
+            data = source.read(info)
+            if info.filename == name:
+                data = edit(data.decode("utf-8")).encode("utf-8")
+            package.writestr(info, data)
+    return output.getvalue()
+
+
+def add_parts(content, parts, relationship=None, override=None):
+    """`content` with extra package parts, plus a workbook relationship and content type override."""
+    content = rewrite_part(content, "[Content_Types].xml", lambda xml: xml.replace("</Types>", (override or "") + "</Types>"))
+    if relationship:
+        content = rewrite_part(content, "xl/_rels/workbook.xml.rels", lambda xml: xml.replace("</Relationships>", relationship + "</Relationships>"))
+    output = BytesIO(content)
+    with zipfile.ZipFile(output, "a") as package:
+        for name, data in parts.items():
+            package.writestr(name, data)
+    return output.getvalue()
+
+
+def with_shared_strings(content):
+    """`content` (whose strings openpyxl wrote inline) with its strings moved to sharedStrings.xml, as Excel saves them."""
+    strings = {}
+    
+    def shared(match):
+        index = strings.setdefault(match.group(3), len(strings))
+        return f'<c r="{match.group(1)}"{match.group(2)} t="s"><v>{index}</v></c>'
+    
+    inline_cell = re.compile(r'<c r="([A-Z]+\d+)"([^>]*) t="inlineStr"><is><t>(.*?)</t></is></c>')
+    for sheet in ("xl/worksheets/sheet1.xml", "xl/worksheets/sheet2.xml"):
+        content = rewrite_part(content, sheet, lambda xml: inline_cell.sub(shared, xml))
+    items = "".join(f"<si><t>{text}</t></si>" for text in strings)
+    return add_parts(
+        content,
+        {"xl/sharedStrings.xml": f'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="{len(strings)}" uniqueCount="{len(strings)}">{items}</sst>'},
+        relationship='<Relationship Id="rIdStrings" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>',
+        override='<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>',
+    )
+
+
+def with_calc_chain(content):
+    return add_parts(
+        content,
+        {"xl/calcChain.xml": '<calcChain xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><c r="B3" i="1"/><c r="C3" i="1"/></calcChain>',
+         "customXml/item1.xml": "<broker-notes>kept as is</broker-notes>"},
+        relationship='<Relationship Id="rIdCalc" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/calcChain" Target="calcChain.xml"/>',
+        override='<Override PartName="/xl/calcChain.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml"/>',
+    )
+
+
+def openpyxl_reference(content, updates):
+    wb = load_workbook(BytesIO(content))
+    for sheet, row, column, value, font in updates:
+        cell = wb[sheet].cell(row=row, column=column)
+        cell.value = value
+        if font is not None:
+            cell.font = font
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def cells(content):
+    """{(sheet, coordinate): value and style} for every cell with a value or a style."""
+    wb = load_workbook(BytesIO(content))
+    result = {}
+    for ws in wb:
+        for row in ws.iter_rows():
+            for cell in row:
+                if cell.value is None and not cell.has_style:
+                    continue
+                font = cell.font
+                result[ws.title, cell.coordinate] = (
+                    cell.value, font.name, font.sz, font.b, font.i, font.color.rgb if font.color is not None else None,
+                    cell.fill.fgColor.rgb, cell.number_format,
+                )
+    return result
+
+
+def patched(content, updates):
+    patch = app.XlsxCellPatch(content)
+    for sheet, row, column, value, font in updates:
+        patch.set_value(sheet, row, column, value, font)
+    return patch.save()
+
+
+@pytest.mark.parametrize("strings", ["inline", "shared"])
+def test_patch_matches_openpyxl(strings):
+    content = make_workbook() if strings == "inline" else with_shared_strings(make_workbook())
+    output = patched(content, UPDATES)
+    assert cells(output) == cells(openpyxl_reference(content, UPDATES))
+    if strings == "shared":
+        shared = zipfile.ZipFile(BytesIO(output)).read("xl/sharedStrings.xml").decode("utf-8")
+        assert f'uniqueCount="{shared.count("<si>")}"' in shared and "<t>Jet Partners</t>" in shared
+        assert 'xml:space="preserve">  padded  </t>' in shared
+
+
+def test_overwritten_formula_drops_calc_chain_and_keeps_other_parts():
+    content = with_calc_chain(make_workbook())
+    package = zipfile.ZipFile(BytesIO(patched(content, [("Master", 3, 3, 12000, None)])))
+    names = package.namelist()
+    assert "xl/calcChain.xml" not in names
+    assert "calcChain" not in package.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+    assert "calcChain" not in package.read("[Content_Types].xml").decode("utf-8")
+    assert package.read("customXml/item1.xml") == b"<broker-notes>kept as is</broker-notes>"
+    assert 'fullCalcOnLoad="1"' in package.read("xl/workbook.xml").decode("utf-8")
+    
+    untouched = zipfile.ZipFile(BytesIO(patched(content, [("Master", 1, 3, "560-5123", None)])))
+    assert "xl/calcChain.xml" in untouched.namelist()
+
+
+def write(session, sheet, updates):
+    session.write_cells(sheet, updates)
+    return updates
+
+
+def failing_write(session, sheet, updates):
+    session.write_cells(sheet, updates)
+    return None
+
+
+def session_output(content, writes):
+    session = app.WorkbookSession(BytesIO(content))
+    for write_function, updates in writes:
+        session.apply(write_function, "Master", updates)
+    return session, session.save()
+
+
+def rows(updates):
+    return [(row, column, value, font) for _, row, column, value, font in updates]
+
+
+def test_session_patches_without_loading_openpyxl():
+    content = make_workbook()
+    master = [update for update in UPDATES if update[0] == "Master"]
+    session, output = session_output(content, [(write, rows(master))])
+    assert session.patch is not None and session._wb is None
+    assert cells(output) == cells(openpyxl_reference(content, master))
+
+
+def test_unwritable_value_moves_session_to_openpyxl_with_earlier_writes():
+    content = make_workbook()
+    stamp = datetime(2024, 5, 1, 12, 0)
+    session, output = session_output(content, [
+        (write, [(1, 3, "560-5123", None), (4, 4, "Y", RED)]),
+        (write, [(7, 3, stamp, None)]),
+    ])
+    assert session.patch is None
+    expected = [("Master", 1, 3, "560-5123", None), ("Master", 4, 4, "Y", RED), ("Master", 7, 3, stamp, None)]
+    assert cells(output) == cells(openpyxl_reference(content, expected))
+
+
+def test_unsupported_part_at_save_replays_writes_through_openpyxl():
+    # A shared formula anchored on C3: the patch engine refuses to overwrite it when saving
+    content = rewrite_part(make_workbook(), "xl/worksheets/sheet1.xml", lambda xml: xml.replace(
+        "<f>C2+1</f>", '<f t="shared" ref="C3:C3" si="0">C2+1</f>'
+    ))
+    updates = [(3, 3, 99, None), (4, 4, "Y", RED)]
+    session, output = session_output(content, [(write, updates)])
+    assert session.patch is None
+    assert cells(output) == cells(openpyxl_reference(content, [("Master", *update) for update in updates]))
+
+
+@pytest.mark.parametrize("content", [make_workbook(), with_shared_strings(with_calc_chain(make_workbook()))])
+def test_failed_write_rolls_back_to_the_writes_before_it(content):
+    kept = [(1, 3, "560-5123", None), (5, 4, "N", GREEN)]
+    session, output = session_output(content, [
+        (write, kept),
+        (failing_write, [(2, 3, 1, None), (9, 4, "Y", RED)]),
+    ])
+    assert session.writes == [(write, ("Master", kept))]
+    assert cells(output) == cells(openpyxl_reference(content, [("Master", *update) for update in kept]))
+
+
+def test_chartsheet_workbook_uses_openpyxl_from_the_start():
+    wb = load_workbook(BytesIO(make_workbook()))
+    chart = BarChart()
+    chart.add_data(Reference(wb["Master"], min_col=2, min_row=2, max_row=3))
+    wb.create_chartsheet("Chart").add_chart(chart)
+    buffer = BytesIO()
+    wb.save(buffer)
+    session, output = session_output(buffer.getvalue(), [(write, [(2, 3, 1234, None)])])
+    assert session.patch is None
+    assert cells(output)["Master", "C2"][0] == 1234